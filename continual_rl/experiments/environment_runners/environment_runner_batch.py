@@ -3,6 +3,7 @@ import numpy as np
 from collections import deque
 from continual_rl.experiments.environment_runners.parallel_env import ParallelEnv
 from continual_rl.experiments.environment_runners.environment_runner_base import EnvironmentRunnerBase
+from continual_rl.utils import env_fork_server
 import copy
 
 
@@ -14,10 +15,20 @@ class EnvironmentRunnerBatch(EnvironmentRunnerBase):
     The arguments provided to collect_data are from the task.
     """
     def __init__(self, policy, num_parallel_envs, timesteps_per_collection, render_collection_freq=None,
-                 output_dir=None):
+                 output_dir=None, fork_server=None, env_preload_modules=(), warm_env_template=False):
+        """
+        :param fork_server: An (already started) EnvForkServer to fork the env workers from, instead of this process.
+        Owned by the caller.
+        :param env_preload_modules: Simulator modules to import in this process before forking the env workers (if
+        there's a fork_server, it should have preloaded them instead)
+        :param warm_env_template: Build the task's env once before forking the workers, and have each take a copy
+        """
         super().__init__()
         self._policy = policy
         self._num_parallel_envs = num_parallel_envs
+        self._fork_server = fork_server
+        self._env_preload_modules = env_preload_modules
+        self._warm_env_template = warm_env_template
         self._timesteps_per_collection = timesteps_per_collection
         self._render_collection_freq = render_collection_freq  # In timesteps
         self._output_dir = output_dir
@@ -35,10 +46,23 @@ class EnvironmentRunnerBatch(EnvironmentRunnerBase):
     def _preprocess_raw_observations(self, preprocessor, raw_observations):
         return preprocessor.preprocess(raw_observations)
 
-    def _initialize_envs(self, env_spec, preprocessor):
+    def _initialize_envs(self, env_spec, preprocessor, task_id):
         if self._parallel_env is None:
+            if self._fork_server is None:
+                env_fork_server.preload_modules(self._env_preload_modules)
+
+            # Only workers forked after the template is built can take it (the first env is this process's own)
+            template_key = None
+            if self._warm_env_template and self._num_parallel_envs > 1:
+                template_key = task_id
+                if self._fork_server is not None:
+                    self._fork_server.set_template_env(env_spec, template_key)
+                else:
+                    env_fork_server.set_template_env(env_spec, template_key)
+
             env_specs = [env_spec for _ in range(self._num_parallel_envs)]
-            self._parallel_env = ParallelEnv(env_specs, self._output_dir)
+            self._parallel_env = ParallelEnv(env_specs, self._output_dir, fork_server=self._fork_server,
+                                             template_key=template_key)
 
         # Initialize the observation time-batch with n of the first observation.
         raw_observations = self._parallel_env.reset()
@@ -106,7 +130,7 @@ class EnvironmentRunnerBatch(EnvironmentRunnerBase):
 
         # Grabbed the saved-off observations, if applicable.
         if self._last_observations is None:
-            processed_observations = self._initialize_envs(env_spec, preprocessor)
+            processed_observations = self._initialize_envs(env_spec, preprocessor, task_id)
         else:
             processed_observations = self._last_observations
 
@@ -172,3 +196,4 @@ class EnvironmentRunnerBatch(EnvironmentRunnerBase):
 
     def cleanup(self, task_spec):
         self._parallel_env.close()
+        env_fork_server.clear_template_env()
@@ -2,6 +2,7 @@ import torch.multiprocessing as multiprocessing
 import cloudpickle
 from continual_rl.experiments.environment_runners.environment_runner_base import EnvironmentRunnerBase
 from continual_rl.experiments.environment_runners.full_parallel.collection_process import CollectionProcess
+from continual_rl.utils import env_fork_server
 
 
 class EnvironmentRunnerFullParallel(EnvironmentRunnerBase):
@@ -9,7 +10,8 @@ class EnvironmentRunnerFullParallel(EnvironmentRunnerBase):
     Runs the entirety of collection on separate processes. Uses pytorch multiprocessing so share_memory() can be used.
     """
     def __init__(self, policy, num_parallel_processes, timesteps_per_collection, render_collection_freq=None,
-                 create_update_process_bundle=None, receive_update_process_bundle=None, output_dir=None):
+                 create_update_process_bundle=None, receive_update_process_bundle=None, output_dir=None,
+                 env_preload_modules=()):
         """
         create_update_process_bundle is a callback that creates a list of arbitrary data bundles, one per process, to
         be used to update the states of the processes. This callback is executed on the main process, and the data is
@@ -17,8 +19,11 @@ class EnvironmentRunnerFullParallel(EnvironmentRunnerBase):
         receive_update_process_bundle is the callback that will be called per-process, to consume the data bundle
         and update accordingly.
         The form of the data bundles is entirely up to the creator of this EnvironmentRunner.
+        env_preload_modules are imported here, before the processes are forked, so they inherit them.
         """
         super().__init__()
+        env_fork_server.preload_modules(env_preload_modules)
+
         self._create_update_process_bundle = create_update_process_bundle
         self._process_managers = [CollectionProcess(policy, timesteps_per_collection,
                                                     render_collection_freq=render_collection_freq,
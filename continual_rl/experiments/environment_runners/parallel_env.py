@@ -27,12 +27,13 @@
 from multiprocessing import Process, Pipe
 import gym
 import cloudpickle
+from continual_rl.utils import env_fork_server
 from continual_rl.utils.utils import Utils
 
 
-def worker(conn, env_spec, output_dir):
+def worker(conn, env_spec, output_dir, template_key=None):
     env_spec = cloudpickle.loads(env_spec)
-    env, seed = Utils.make_env(env_spec, create_seed=True)
+    env, seed = env_fork_server.make_env(env_spec, template_key=template_key, create_seed=True)
 
     if output_dir is not None:
         logger = Utils.create_logger(f"{output_dir}/env.log")
@@ -58,14 +59,20 @@ def worker(conn, env_spec, output_dir):
 class ParallelEnv(gym.Env):
     """A concurrent execution of environments in multiple processes."""
 
-    def __init__(self, envs, output_dir):
+    def __init__(self, envs, output_dir, fork_server=None, template_key=None):
+        """
+        If fork_server (an EnvForkServer) is given, the worker processes are forked from it, rather than from this
+        process. If template_key is given, each worker takes its copy of the template env with that key (see
+        env_fork_server.set_template_env), if the process it's forked from holds one.
+        """
         assert len(envs) >= 1, "No environment given."
 
         self._env_specs = envs
 
         # The first env is local. This helps with testing, and also makes the sync runner easier
         # Downside: slightly different code paths for 1st as opposed to rest.
-        self._local_env, seed = Utils.make_env(self._env_specs[0], create_seed=True)
+        self._local_env, seed = env_fork_server.make_env(self._env_specs[0], template_key=template_key,
+                                                         create_seed=True)
         self.observation_space = self._local_env.observation_space
         self.action_space = self._local_env.action_space
 
@@ -79,8 +86,11 @@ class ParallelEnv(gym.Env):
             self.locals.append(local)
 
             pickled_spec = cloudpickle.dumps(env_spec)
-            p = Process(target=worker, args=(remote, pickled_spec, output_dir))
-            p.daemon = True
+            if fork_server is not None:
+                p = fork_server.Process(target=worker, args=(remote, pickled_spec, output_dir, template_key))
+            else:
+                p = Process(target=worker, args=(remote, pickled_spec, output_dir, template_key))
+                p.daemon = True
             p.start()
             remote.close()
 
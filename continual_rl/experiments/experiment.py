@@ -191,6 +191,6 @@ class Experiment(object):
             self._run(policy, summary_writer)
         except Exception as e:
             self._logger.exception(f"Failed with exception: {e}")
-            policy.shutdown()
-
             raise e
+        finally:
+            policy.shutdown()
@@ -2,10 +2,17 @@ import numpy as np
 import torch
 import threading
 import os
+import time
 from torch.nn import functional as F
-import queue
-from continual_rl.policies.impala.torchbeast.monobeast import Monobeast, Buffers
+from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
+from continual_rl.policies.clear.reservoir_index import ReservoirIndex
+from continual_rl.policies.clear.replay_prefetcher import ReplayPrefetcher
+from continual_rl.policies.clear.replay_writer import ReplayWriter
+from continual_rl.policies.clear.replay_entry_versions import ReplayEntryVersions
+from continual_rl.policies.clear.tiered_replay_cache import TieredReplayCache
+from continual_rl.policies.clear.compressed_frame_store import CompressedFrameStore, FrameCodec, compare_frame_codecs
 from continual_rl.utils.utils import Utils
+from continual_rl.utils.replay_arena import ReplayArena
 
 
 class ClearMonobeast(Monobeast):
@@ -38,28 +45,59 @@ class ClearMonobeast(Monobeast):
             output_dir_str,
             f"{model_flags.policy_unique_id}"
         )
-        buffers_existed = os.path.exists(permanent_path)
         os.makedirs(permanent_path, exist_ok=True)
 
         self._entries_per_buffer = int(
             model_flags.replay_buffer_frames // (model_flags.unroll_length * model_flags.num_actors)
         )
-        self._replay_buffers, self._temp_files = self._create_replay_buffers(
+        self._replay_buffers, self._replay_specs, self._frame_store, self._temp_files = self._create_replay_buffers(
             model_flags,
             observation_space.shape,
             common_action_space.n,
             self._entries_per_buffer,
             permanent_path,
-            buffers_existed,
         )
-        self._replay_lock = threading.Lock()
 
-        # Each replay batch needs to also have cloning losses applied to it
-        # Keep track of them as they're generated, to ensure we apply losses to all. This doesn't currently
-        # guarantee order - i.e. one learner thread might get one replay batch for training and a different for cloning
-        self._replay_batches_for_loss = queue.Queue()
+        # Each actor's section fills from its first entry onwards (see ReservoirIndex), so the number filled is enough
+        # to sample from. Kept in shared memory, since the actors (separate processes) are the ones filling it.
+        filled_entries = self._replay_buffers['reservoir_val'].squeeze(-1) != 0
+        self._replay_fill_counts = filled_entries.sum(dim=1).share_memory_()
+
+        # Per learner thread: the RNG for sampling, and the preallocated tensors the combined batches are built in
+        self._replay_thread_state = threading.local()
+
+        # Created on first use, if replay_prefetch_batches > 0, by whichever learner thread gets there first
+        self._replay_prefetcher = None
+        self._replay_prefetcher_lock = threading.Lock()
+
+        # Since stats were last collected: learning steps that had no replay entries to apply the cloning losses to,
+        # replay entries requested but not available (the sampled actor had nothing stored yet, or the entry was being
+        # written, i.e. torn), and the time spent gathering replay entries, and by the learner waiting on them
+        # (including the gather, if not prefetched)
+        self._replay_stats_lock = threading.Lock()
+        self._replay_stats = {"replay_cloning_skips": 0, "replay_entries_short": 0, "replay_entries_torn": 0}
+        self._replay_latencies = {"replay_gather_latency": [], "replay_wait_latency": []}
+        self._frame_codecs_compared = False
+
+        # Insertion happens in whichever process is adding to an actor's section (usually that actor's own, forked
+        # process), so each process lazily builds the ReservoirIndex for the sections it writes to:
+        # actor_index -> (pid, generation, index). Every insertion bumps the section's shared generation, so an index
+        # built by one process is rebuilt if another process has written to the section since.
+        self._reservoir_indices = {}
+        self._replay_generations = torch.zeros(model_flags.num_actors, dtype=torch.int64).share_memory_()
+
+        # Entries are written by the actors (or the replay writer) and read by the learner, in different processes,
+        # so instead of a lock each entry has a seqlock. Reads that overlap a write are retried, or dropped.
+        self._replay_entry_versions = ReplayEntryVersions(model_flags.num_actors * self._entries_per_buffer)
+        self._replay_tier = self._create_replay_tier(model_flags)
+
+        # Started per task, before the actors are forked, if replay_writer_process (see _start_replay_writer)
+        self._replay_writer = None
 
     def permanent_delete(self):
+        self._stop_replay_prefetcher()
+        self._stop_replay_writer()
+
         for file_path in self._temp_files:
             os.remove(file_path)
 
@@ -75,67 +113,122 @@ class ClearMonobeast(Monobeast):
         num_actions,
         entries_per_buffer,
         permanent_path,
-        buffers_existed,
     ):
         """
         Key differences from normal buffers:
-        1. File-backed, so we can store more at a time
-        2. Structured so that there are num_actors buffers, each with entries_per_buffer entries
+        1. File-backed, so we can store more at a time. All keys share one file (a ReplayArena), which is sparse, so
+        nothing needs to be zeroed on creation (in particular reservoir_val, where 0 indicates an unfilled entry).
+        2. One tensor per key, of shape [num_actors, entries_per_buffer, ...], so that a whole replay batch can be
+        gathered with one index per key. buffers[key][actor_index] is still the actor's section.
 
         Each buffer entry has unroll_length size, so the number of frames stored is (roughly, because of integer
         rounding): num_actors * entries_per_buffer * unroll_length
+
+        If replay_frame_compression is set, the frames are instead kept in a CompressedFrameStore (in the same arena),
+        and are not in the returned buffers.
+        :return: (buffers, the specs of all replay keys (including frame), the CompressedFrameStore or None,
+        files to delete on permanent_delete)
         """
         # Get the standard specs, and also add the CLEAR-specific reservoir value
         specs = self.create_buffer_specs(model_flags.unroll_length, obs_shape, num_actions)
         # Note: one reservoir value per row
         specs["reservoir_val"] = dict(size=(1,), dtype=torch.float32)
-        buffers: Buffers = {key: [] for key in specs}
-
-        # Hold on to the file handle so it does not get deleted. Technically optional, as at least linux will
-        # keep the file open even after deletion, but this way it is still visible in the location it was created
-        temp_files = []
-
-        for actor_id in range(model_flags.num_actors):
-            for key in buffers:
-                shape = (entries_per_buffer, *specs[key]["size"])
-                permanent_file_name = f"replay_{actor_id}_{key}.fbt"
-                new_tensor, file_name, temp_file = Utils.create_file_backed_tensor(
-                    permanent_path,
-                    shape,
-                    specs[key]["dtype"],
-                    permanent_file_name=permanent_file_name,
-                )
-
-                # reservoir_val needs to be 0'd out so we can use it to see if a row is filled
-                # but this operation is slow, so leave the rest as-is
-                # Only do this if we created the buffers anew
-                if not buffers_existed and key == "reservoir_val":
-                    new_tensor.zero_()
-
-                buffers[key].append(new_tensor)
-                temp_files.append(file_name)
-
-        return buffers, temp_files
-
-    def _get_replay_buffer_filled_indices(self, replay_buffers, actor_index):
+
+        replay_specs = {key: dict(size=(model_flags.num_actors, entries_per_buffer, *spec["size"]), dtype=spec["dtype"])
+                        for key, spec in specs.items()}
+        arena_specs = dict(replay_specs)
+
+        if model_flags.replay_frame_compression is not None:
+            frame_spec = arena_specs.pop("frame")
+            arena_specs.update(CompressedFrameStore.get_arena_specs(model_flags.num_actors, entries_per_buffer,
+                                                                    specs["frame"]["size"], frame_spec["dtype"]))
+
+        arena_path = os.path.join(permanent_path, "replay_arena.fbt")
+        arena = ReplayArena(arena_path, arena_specs, preallocate=model_flags.replay_arena_preallocate,
+                            huge_pages=model_flags.replay_arena_huge_pages,
+                            access_hint=model_flags.replay_arena_access_hint)
+        self.logger.info(f"{'Created' if arena.created else 'Loaded'} replay arena: {arena_path}")
+
+        buffers = arena.tensors
+        temp_files = [arena_path]
+        frame_store = None
+
+        if model_flags.replay_frame_compression is not None:
+            codec = FrameCodec(model_flags.replay_frame_compression, level=model_flags.replay_frame_compression_level)
+            counters = torch.zeros((model_flags.num_actors, 4), dtype=torch.float64).share_memory_()
+            frame_store = CompressedFrameStore(buffers.pop("frame_chunks"), buffers.pop("frame_chunk_lengths"),
+                                               buffers.pop("frame_chunk_versions"), specs["frame"]["size"],
+                                               specs["frame"]["dtype"], codec,
+                                               cache_entries=model_flags.replay_frame_cache_entries,
+                                               counters=counters)
+
+        return buffers, replay_specs, frame_store, temp_files
+
+    def _create_replay_tier(self, model_flags):
         """
-        Get the indices in the replay buffer corresponding to the actor_index.
+        Compressed frames already have their own cache of decompressed entries, so they're not kept in the RAM tier.
         """
-        # We know that the reservoir value > 0 if it's been filled, so check for entries where it == 0
-        buffer_indicator = replay_buffers['reservoir_val'][actor_index].squeeze(1)
-        replay_indices = np.where(buffer_indicator != 0)[0]
-        return replay_indices
+        if model_flags.replay_ram_tier_insert_entries == 0 and model_flags.replay_ram_tier_sample_entries == 0:
+            return None
+
+        tier_specs = {key: dict(size=spec["size"][2:], dtype=spec["dtype"]) for key, spec in self._replay_specs.items()
+                      if key != "reservoir_val" and (key != "frame" or self._frame_store is None)}
+        replay_tier = TieredReplayCache(tier_specs, model_flags.num_actors, self._entries_per_buffer,
+                                        self._replay_entry_versions.tensor,
+                                        insert_entries_per_actor=model_flags.replay_ram_tier_insert_entries,
+                                        sample_entries=model_flags.replay_ram_tier_sample_entries)
+        self.logger.info(f"Replay RAM tier: {replay_tier.num_bytes / 1e6:.1f}MB")
+
+        return replay_tier
 
-    def _get_actor_unfilled_indices(self, actor_index, entries_per_buffer):
+    def _start_replay_writer(self):
         """
-        Get the unfilled entries in the actor's subset of the replay buffer using a set difference.
+        If replay_writer_process, all replay insertion from the actors goes through a ReplayWriter, which is forked
+        from this (the learner's) process. Insertions made while it isn't running (e.g. SANE's, between tasks) are
+        done directly.
         """
-        filled_indices = set(
-            self._get_replay_buffer_filled_indices(self._replay_buffers, actor_index)
-        )
-        actor_id_set = set(range(0, entries_per_buffer))
-        unfilled_indices = actor_id_set - filled_indices
-        return unfilled_indices
+        if not self._model_flags.replay_writer_process or self._replay_writer is not None:
+            return
+
+        staging_specs = {key: dict(size=spec["size"][2:], dtype=spec["dtype"])
+                         for key, spec in self._replay_specs.items() if key != "reservoir_val"}
+        self._replay_writer = ReplayWriter(staging_specs, self._model_flags.num_actors,
+                                           staging_entries_per_actor=self._model_flags.replay_writer_staging_entries,
+                                           apply_entries=self._insert_replay_entries,
+                                           max_batch_entries=self._model_flags.replay_writer_batch_entries)
+        self.logger.info(f"Replay writer staging: {self._replay_writer.num_bytes / 1e6:.1f}MB")
+        self._replay_writer.start()
+
+    def _stop_replay_writer(self):
+        if self._replay_writer is not None:
+            self._replay_writer.stop()
+            self._replay_writer = None
+
+    def train(self, task_flags):
+        self._start_replay_writer()
+
+        try:
+            yield from super().train(task_flags)
+        finally:
+            # The actors have been stopped by now, so everything they submitted gets written before this returns
+            self._stop_replay_writer()
+
+    def cleanup(self):
+        # Restarted on first use in the next task
+        self._stop_replay_prefetcher()
+        super().cleanup()
+        self._stop_replay_writer()
+
+    def _get_reservoir_index(self, actor_index):
+        pid = os.getpid()
+        generation = self._replay_generations[actor_index].item()
+        index_pid, index_generation, reservoir_index = self._reservoir_indices.get(actor_index, (None, None, None))
+
+        if index_pid != pid or index_generation != generation:
+            reservoir_index = ReservoirIndex(self._replay_buffers['reservoir_val'][actor_index])
+            self._reservoir_indices[actor_index] = (pid, generation, reservoir_index)
+
+        return reservoir_index
 
     def _compute_policy_cloning_loss(self, old_logits, curr_logits):
         # KLDiv requires inputs to be log-probs, and targets to be probs
@@ -148,7 +241,7 @@ class ClearMonobeast(Monobeast):
         return torch.sum((curr_value - old_value.detach()) ** 2)
 
     def get_min_reservoir_val_greater_than_zero(self):
-        reservoir_vals = torch.stack(self._replay_buffers['reservoir_val'])
+        reservoir_vals = self._replay_buffers['reservoir_val']
         vals_gt_zero = reservoir_vals[reservoir_vals > 0]
 
         if len(vals_gt_zero) > 0:
@@ -162,133 +255,375 @@ class ClearMonobeast(Monobeast):
         """
         Every step, update the replay buffer using reservoir sampling.
         """
-        # Compute a reservoir_val for the new entry, then, if the buffer is filled, throw out the entry with the lowest
-        # reservoir_val and replace it with the new one. If the buffer it not filled, simply put it in the next spot
-        # Using a new RandomState() because using np.random directly is not thread-safe
-        random_state = np.random.RandomState()
+        if self._replay_writer is not None:
+            self._replay_writer.submit(actor_index, new_buffers)
+        else:
+            self._insert_replay_entries([(actor_index, new_buffers)])
+
+    def _insert_replay_entries(self, entries):
+        """
+        Insert new entries, in order, with reservoir sampling. Only the last entry to land in each replay entry is
+        written, and the writes are made in file order, one indexed copy per key.
+        :param entries: [(actor_index, new_buffers)]. new_buffers may include a reservoir_val to insert with.
+        """
+        # Compute a reservoir_val for each new entry, then, if the buffer is filled, throw out the entry with the
+        # lowest reservoir_val and replace it with the new one. If the buffer it not filled, simply put it in the next
+        # spot
+        writes = {}  # flat index -> (actor_index, entry_index, reservoir_val, new_buffers)
+        written_reservoir_indices = {}
+
+        for actor_index, new_buffers in entries:
+            reservoir_index = self._get_reservoir_index(actor_index)
+            new_entry_reservoir_val = reservoir_index.sample_reservoir_val() if "reservoir_val" not in new_buffers.keys() else new_buffers["reservoir_val"].item()
+            to_populate_replay_index = reservoir_index.get_insertion_index(new_entry_reservoir_val)
+
+            if to_populate_replay_index is not None:
+                flat_index = actor_index * self._entries_per_buffer + to_populate_replay_index
+                writes[flat_index] = (actor_index, to_populate_replay_index, new_entry_reservoir_val, new_buffers)
+                written_reservoir_indices[actor_index] = reservoir_index
+
+        if len(writes) == 0:
+            return
+
+        flat_indices = sorted(writes.keys())
+        flat_index_tensor = torch.tensor(flat_indices, dtype=torch.int64)
+        ordered_writes = [writes[flat_index] for flat_index in flat_indices]
+        keys = [key for key in ordered_writes[0][3].keys() if key != 'reservoir_val']
+
+        versions = self._replay_entry_versions.begin_write(flat_index_tensor)
+
+        self._replay_buffers['reservoir_val'].view(-1)[flat_index_tensor] = torch.tensor(
+            [reservoir_val for _, _, reservoir_val, _ in ordered_writes], dtype=torch.float32)
+
+        for key in keys:
+            if key == 'frame' and self._frame_store is not None:
+                for actor_index, entry_index, _, new_buffers in ordered_writes:
+                    self._frame_store.write(actor_index, entry_index, new_buffers[key])
+            elif len(ordered_writes) == 1:
+                actor_index, entry_index, _, new_buffers = ordered_writes[0]
+                self._replay_buffers[key][actor_index][entry_index][...] = new_buffers[key]
+            else:
+                replay_buffer = self._replay_buffers[key].view(-1, *self._replay_specs[key]["size"][2:])
+                replay_buffer.index_copy_(0, flat_index_tensor,
+                                          torch.stack([new_buffers[key] for _, _, _, new_buffers in ordered_writes]))
+
+        self._replay_entry_versions.end_write(flat_index_tensor, versions)
+
+        if self._replay_tier is not None:
+            for actor_index, entry_index, _, new_buffers in ordered_writes:
+                self._replay_tier.on_insert(actor_index, entry_index, new_buffers)
+
+        # Let other processes know their index for these sections is stale, and keep ours current
+        for actor_index, reservoir_index in written_reservoir_indices.items():
+            self._replay_fill_counts[actor_index] = reservoir_index.num_filled
+            self._replay_generations[actor_index] += 1
+            self._reservoir_indices[actor_index] = (os.getpid(), self._replay_generations[actor_index].item(),
+                                                    reservoir_index)
+
+    def _get_replay_thread_state(self):
+        thread_state = self._replay_thread_state
+        if not hasattr(thread_state, "random_state"):
+            # Using a RandomState per thread because using np.random directly is not thread-safe
+            thread_state.random_state = np.random.RandomState()
+            thread_state.tensors = {}
+            thread_state.slots = {}
+            thread_state.copy_event = None
+
+        return thread_state
+
+    def _get_preallocated_tensor(self, name, shape, dtype, device):
+        """
+        Tensors are reused by the learner thread that requested them, so a batch is only valid until that thread
+        gets its next one.
+        """
+        tensors = self._get_replay_thread_state().tensors
+        tensor = tensors.get(name, None)
 
-        # > 0 so we can use reservoir_val==0 to indicate unfilled
-        new_entry_reservoir_val = random_state.uniform(0.001, 1.0) if "reservoir_val" not in new_buffers.keys() else new_buffers["reservoir_val"].item()
-        to_populate_replay_index = None
-        unfilled_indices = self._get_actor_unfilled_indices(actor_index, self._entries_per_buffer)
+        if tensor is None or tensor.shape != shape or tensor.dtype != dtype or tensor.device != device:
+            tensor = torch.empty(shape, dtype=dtype, device=device)
+            tensors[name] = tensor
 
-        actor_replay_reservoir_vals = self._replay_buffers['reservoir_val'][actor_index]
+        return tensor
 
-        if len(unfilled_indices) > 0:
-            current_replay_index = min(unfilled_indices)
-            to_populate_replay_index = current_replay_index
-        else:
-            # If we've filled our quota, we need to find something to throw out.
-            reservoir_threshold = actor_replay_reservoir_vals.min()
-
-            # If our new value is higher than our existing minimum, replace that one with this new data
-            if new_entry_reservoir_val > reservoir_threshold:
-                to_populate_replay_index = np.argmin(actor_replay_reservoir_vals)
-
-        # Do the replacement into the buffer, and update the reservoir_vals list
-        if to_populate_replay_index is not None:
-            with self._replay_lock:
-                actor_replay_reservoir_vals[to_populate_replay_index][0] = new_entry_reservoir_val
-                for key in new_buffers.keys():
-                    if key == 'reservoir_val':
-                        continue
-                    self._replay_buffers[key][actor_index][to_populate_replay_index][...] = new_buffers[key]
+    def _create_replay_slot(self, keys, replay_entry_count):
+        """
+        Tensors to gather replay entries into: [replay_entry_count, T+1, ...] per key. Pinned if the learner is on
+        CUDA, so the copy to the learner's device can be asynchronous.
+        """
+        pin_memory = self._model_flags.device.type == "cuda"
+        return {key: torch.empty((replay_entry_count, *self._replay_specs[key]["size"][2:]),
+                                 dtype=self._replay_specs[key]["dtype"], pin_memory=pin_memory) for key in keys}
 
-    def get_batch_for_training(self, batch, store_for_loss=True, reuse_actor_indices=False, replay_entry_scale=1.0):
+    def _fill_replay_slot(self, slot, replay_entry_count, reuse_actor_indices):
         """
-        Augment the batch with entries from our replay buffer.
+        Sample replay entries, and gather them (one index per key) into the first entries of the slot. Entries whose
+        read overlapped a write are re-read, and if they're still being written after a few attempts, dropped.
+        :return: The number of entries gathered
         """
-        # Select a random batch set of replay buffers to add also. Only select from ones that have been filled
-        shuffled_subset = []  # Will contain a list of tuples of (actor_index, buffer_index)
+        replay_indices = self._sample_replay_entries(replay_entry_count, reuse_actor_indices)
+        num_replay_entries = len(replay_indices)
+        start_time = time.time()
+
+        replay_entries = {key: tensor[:num_replay_entries] for key, tensor in slot.items()}
+        tier_keys = [key for key in replay_entries if self._replay_tier is not None and key in self._replay_tier.keys]
+        disk_keys = [key for key in replay_entries
+                     if key not in tier_keys and (key != "frame" or self._frame_store is None)]
+
+        def read_from_disk(keys, positions, flat_indices):
+            for key in keys:
+                replay_buffer = self._replay_buffers[key].view(-1, *self._replay_specs[key]["size"][2:])
+                if positions is None:
+                    torch.index_select(replay_buffer, 0, flat_indices, out=replay_entries[key])
+                else:
+                    replay_entries[key][positions] = replay_buffer[flat_indices]
+
+        def read_entries(positions, flat_indices):
+            if positions is None:
+                read_from_disk(disk_keys, None, flat_indices)
+
+                if len(tier_keys) > 0:
+                    self._replay_tier.gather(flat_indices, replay_entries,
+                                             lambda tier_positions, tier_indices: read_from_disk(
+                                                 tier_keys, tier_positions, tier_indices))
+
+                if "frame" in slot and self._frame_store is not None:
+                    self._frame_store.gather(flat_indices, out=replay_entries["frame"])
+            else:
+                # Retries (of the few torn entries) go straight to disk
+                read_from_disk(disk_keys + tier_keys, positions, flat_indices)
+
+                if "frame" in slot and self._frame_store is not None:
+                    frames = torch.empty((len(flat_indices), *replay_entries["frame"].shape[1:]),
+                                         dtype=replay_entries["frame"].dtype)
+                    self._frame_store.gather(flat_indices, out=frames)
+                    replay_entries["frame"][positions] = frames
+
+        consistent = self._replay_entry_versions.read(replay_indices, read_entries)
+
+        if not consistent.all():
+            consistent_positions = consistent.nonzero().squeeze(1)
+            for key, entries in replay_entries.items():
+                entries[:len(consistent_positions)] = entries[consistent_positions]
+
+            with self._replay_stats_lock:
+                self._replay_stats["replay_entries_torn"] += num_replay_entries - len(consistent_positions)
+
+            num_replay_entries = len(consistent_positions)
+
+        self._record_replay_latency("replay_gather_latency", time.time() - start_time)
+        return num_replay_entries
+
+    def _record_replay_latency(self, key, seconds):
+        with self._replay_stats_lock:
+            self._replay_latencies[key].append(seconds)
+
+    def _get_replay_prefetcher(self, keys, replay_entry_count):
+        with self._replay_prefetcher_lock:
+            if self._replay_prefetcher is None:
+                # Each learner thread holds a slot while it copies out of it, so there's one extra per thread
+                num_slots = self._model_flags.replay_prefetch_batches + self._model_flags.num_learner_threads
+                self._replay_prefetcher = ReplayPrefetcher(
+                    create_slot=lambda: self._create_replay_slot(keys, replay_entry_count),
+                    fill_slot=lambda slot: self._fill_replay_slot(slot, replay_entry_count, reuse_actor_indices=False),
+                    num_slots=num_slots)
+                self._replay_prefetcher.start()
+
+            return self._replay_prefetcher
+
+    def _stop_replay_prefetcher(self):
+        with self._replay_prefetcher_lock:
+            if self._replay_prefetcher is not None:
+                self._replay_prefetcher.stop()
+                self._replay_prefetcher = None
+
+    def _sample_replay_entries(self, replay_entry_count, reuse_actor_indices):
+        """
+        Select a random set of actors, and from each a random filled entry. Actors with nothing stored yet are
+        skipped, so fewer than replay_entry_count entries may be returned.
+        :return: The indices of the entries, into the replay buffers flattened to [num_actors * entries_per_buffer]
+        """
+        random_state = self._get_replay_thread_state().random_state
+        num_actors = self._model_flags.num_actors
 
         # We only allow each actor to be sampled from once, to reduce variance, and for parity with the original
         # paper
-        actor_indices = list(range(self._model_flags.num_actors))
+        if reuse_actor_indices or self._model_flags.always_reuse_actor_indices:
+            actor_indices = random_state.randint(num_actors, size=replay_entry_count)
+        else:
+            actor_indices = random_state.choice(num_actors, size=replay_entry_count, replace=False)
+
+        # Each actor's filled entries are its first fill_count entries
+        fill_counts = self._replay_fill_counts.numpy()[actor_indices]
+        actor_indices = actor_indices[fill_counts > 0]
+        fill_counts = fill_counts[fill_counts > 0]
+        entry_indices = (random_state.random_sample(len(actor_indices)) * fill_counts).astype(np.int64)
+
+        return torch.from_numpy(actor_indices * self._entries_per_buffer + entry_indices)
+
+    def get_batch_for_training(self, batch, store_for_loss=True, reuse_actor_indices=False, replay_entry_scale=1.0):
+        """
+        Augment the batch with entries from our replay buffer. The combined batch is [T+1, B + B_replay, ...], with
+        the replay entries last. If store_for_loss, the cloning losses are applied to the replay entries, which are
+        marked by batch["replay_mask"].
+        """
         replay_entry_count = int(self._model_flags.batch_size * self._model_flags.batch_replay_ratio * replay_entry_scale)
         assert replay_entry_count > 0, "Attempting to run CLEAR without actually using any replay buffer entries."
 
-        random_state = np.random.RandomState()
-
-        with self._replay_lock:
-            # Select a random actor, and from that, a random buffer entry.
-            for _ in range(replay_entry_count):
-                # Pick an actor and remove it from our options
-                actor_index = random_state.choice(actor_indices)
-
-                if not reuse_actor_indices and not self._model_flags.always_reuse_actor_indices:
-                    actor_indices.remove(actor_index)
-
-                # From that actor's set of available indices, pick one randomly.
-                replay_indices = self._get_replay_buffer_filled_indices(self._replay_buffers, actor_index=actor_index)
-                if len(replay_indices) > 0:
-                    buffer_index = random_state.choice(replay_indices)
-                    shuffled_subset.append((actor_index, buffer_index))
-
-            if len(shuffled_subset) > 0:
-                replay_batch = {
-                    # Get the actor_index and entry_id from the raw id
-                    key: torch.stack([self._replay_buffers[key][actor_id][buffer_id]
-                                      for actor_id, buffer_id in shuffled_subset], dim=1)
-                    for key in self._replay_buffers
-                }
-
-                replay_entries_retrieved = torch.sum(replay_batch["reservoir_val"] > 0)
-                assert replay_entries_retrieved <= replay_entry_count, \
-                    f"Incorrect replay entries retrieved. Expected at most {replay_entry_count} got {replay_entries_retrieved}"
-
-                replay_batch = {
-                    k: t.to(device=self._model_flags.device, non_blocking=True)
-                    for k, t in replay_batch.items()
-                }
-
-                # Combine the replay in with the recent entries
+        device = self._model_flags.device
+        keys = list(batch.keys()) if batch is not None else list(self._replay_specs.keys())
+        thread_state = self._get_replay_thread_state()
+
+        # Only the learner's own requests are prefetched (others, e.g. from SANE, are sampled differently)
+        use_prefetcher = self._model_flags.replay_prefetch_batches > 0 and batch is not None and store_for_loss and \
+            not reuse_actor_indices and replay_entry_scale == 1.0
+
+        if use_prefetcher:
+            replay_prefetcher = self._get_replay_prefetcher(keys, replay_entry_count)
+            replay_slot, num_replay_entries, wait_seconds = replay_prefetcher.get()
+        else:
+            # The slot is about to be overwritten, so the previous batch's copies out of it must be done
+            if thread_state.copy_event is not None:
+                thread_state.copy_event.synchronize()
+
+            start_time = time.time()
+            slot_key = (tuple(keys), replay_entry_count)
+            if slot_key not in thread_state.slots:
+                thread_state.slots[slot_key] = self._create_replay_slot(keys, replay_entry_count)
+
+            replay_slot = thread_state.slots[slot_key]
+            num_replay_entries = self._fill_replay_slot(replay_slot, replay_entry_count, reuse_actor_indices)
+            wait_seconds = time.time() - start_time
+
+        if store_for_loss:
+            with self._replay_stats_lock:
+                self._replay_stats["replay_cloning_skips"] += int(num_replay_entries == 0)
+                self._replay_stats["replay_entries_short"] += replay_entry_count - num_replay_entries
+                self._replay_latencies["replay_wait_latency"].append(wait_seconds)
+
+        combo_batch = batch
+        if num_replay_entries > 0:
+            batch_size = batch["frame"].shape[1] if batch is not None else 0
+            combo_batch = {}
+
+            for key, replay_entries in replay_slot.items():
+                # Write the replay entries into the end of the combined batch, and the batch into the start. Sized to
+                # the entries actually gathered, since the model views the batch as contiguous.
+                entry_shape = replay_entries.shape[1:]  # [T+1, ...]
+                combo_tensor = self._get_preallocated_tensor(
+                    f"{key}_combined", (entry_shape[0], batch_size + num_replay_entries, *entry_shape[1:]),
+                    replay_entries.dtype, device)
+                combo_tensor[:, batch_size:].copy_(replay_entries[:num_replay_entries].transpose(0, 1),
+                                                   non_blocking=True)
+
                 if batch is not None:
-                    combo_batch = {
-                        key: torch.cat((batch[key], replay_batch[key]), dim=1) for key in batch
-                    }
-                else:
-                    combo_batch = replay_batch
+                    combo_tensor[:, :batch_size].copy_(batch[key])
 
-                # Store the batch so we can generate some losses with it
-                if store_for_loss:
-                    self._replay_batches_for_loss.put(replay_batch)
+                combo_batch[key] = combo_tensor
 
-            else:
-                combo_batch = batch
+            # Mark the entries the cloning losses should be computed on
+            replay_mask = torch.zeros(combo_batch["frame"].shape[:2], dtype=torch.bool, device=device)
+            replay_mask[:, batch_size:] = store_for_loss
+            combo_batch["replay_mask"] = replay_mask
+
+        copy_event = None
+        if device.type == "cuda":
+            copy_event = torch.cuda.Event()
+            copy_event.record()
+
+        if use_prefetcher:
+            replay_prefetcher.release(replay_slot, copy_event)
+        else:
+            thread_state.copy_event = copy_event
 
         return combo_batch
 
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
+    def get_replay_buffer(self, key):
         """
-        Compute the policy and value cloning losses
+        The whole replay buffer for the key, [num_actors, entries_per_buffer, ...], including unfilled entries.
+        If the frames are compressed, getting them decompresses every entry.
         """
-        # If the get doesn't happen basically immediately, it's not happening
-        cloning_loss = torch.Tensor([0]).to(batch['frame'].device)
-        stats = {}
+        if key == "frame" and self._frame_store is not None:
+            return self._frame_store.decompress_all()
 
-        try:
-            replay_batch = self._replay_batches_for_loss.get(timeout=5)
-        except queue.Empty:
-            replay_batch = None
-            print("Skipping CLEAR custom loss due to lack of replay_batch")
-
-        if replay_batch is not None:
-            replay_learner_outputs, unused_state = model(replay_batch, task_flags.action_space_id, initial_agent_state)
-
-            replay_batch_policy = replay_batch['policy_logits']
-            current_policy = replay_learner_outputs['policy_logits']
-            policy_cloning_loss = self._model_flags.policy_cloning_cost * self._compute_policy_cloning_loss(
-                replay_batch_policy, current_policy)
-
-            replay_batch_baseline = replay_batch['baseline']
-            current_baseline = replay_learner_outputs['baseline']
-            value_cloning_loss = self._model_flags.value_cloning_cost * self._compute_value_cloning_loss(
-                replay_batch_baseline, current_baseline)
-
-            cloning_loss = policy_cloning_loss + value_cloning_loss
-            stats = {
-                "policy_cloning_loss": policy_cloning_loss.item(),
-                "value_cloning_loss": value_cloning_loss.item(),
-            }
+        return self._replay_buffers[key]
+
+    def get_replay_entry(self, actor_index, entry_index):
+        """
+        :return: {key: the replay entry's data}, for every replay key (including reservoir_val)
+        """
+        entry = {key: buffer[actor_index][entry_index] for key, buffer in self._replay_buffers.items()}
+
+        if self._frame_store is not None:
+            frames = self._frame_store.read(actor_index * self._entries_per_buffer + entry_index)
+            entry["frame"] = torch.from_numpy(frames.copy())
+
+        return entry
+
+    def _log_frame_codec_comparison(self):
+        """
+        Once there's something stored, log how a stored entry compresses with each available codec, for choosing
+        replay_frame_compression.
+        """
+        if self._frame_codecs_compared:
+            return
+
+        filled_actors = np.flatnonzero(self._replay_fill_counts.numpy())
+        if len(filled_actors) > 0:
+            frames = self._frame_store.read(filled_actors[0] * self._entries_per_buffer)
+            for codec_name, result in compare_frame_codecs(frames).items():
+                self.logger.info(f"Replay frame codec {codec_name}: compression ratio {result['compression_ratio']:.2f}, "
+                                 f"encode {result['encode_seconds'] * 1000:.2f}ms, "
+                                 f"decode {result['decode_seconds'] * 1000:.2f}ms per entry")
+
+            self._frame_codecs_compared = True
+
+    def collect_custom_stats(self):
+        stats = super().collect_custom_stats()
+
+        with self._replay_stats_lock:
+            stats.update(self._replay_stats)
+            self._replay_stats = {key: 0 for key in self._replay_stats}
+
+            for key, latencies in self._replay_latencies.items():
+                if len(latencies) > 0:
+                    stats[key] = np.mean(latencies)
+
+            self._replay_latencies = {key: [] for key in self._replay_latencies}
+
+        if self._replay_tier is not None:
+            stats.update(self._replay_tier.collect_stats())
+
+        if self._replay_writer is not None:
+            stats.update(self._replay_writer.collect_stats())
+
+        if self._frame_store is not None:
+            stats.update(self._frame_store.collect_stats())
+            self._log_frame_codec_comparison()
+
+        return stats
+
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs, replay_mask):
+        """
+        Compute the policy and value cloning losses. The replay entries went through the learner's forward pass along
+        with the rest of the batch, so their outputs are sliced out rather than recomputed.
+        """
+        if replay_mask is None or not replay_mask.any():
+            return torch.zeros((), device=batch['frame'].device), {}
+
+        replay_batch_policy = batch['policy_logits'][:, replay_mask]
+        current_policy = learner_outputs['policy_logits'][:, replay_mask]
+        policy_cloning_loss = self._model_flags.policy_cloning_cost * self._compute_policy_cloning_loss(
+            replay_batch_policy, current_policy)
+
+        replay_batch_baseline = batch['baseline'][:, replay_mask]
+        current_baseline = learner_outputs['baseline'][:, replay_mask]
+        value_cloning_loss = self._model_flags.value_cloning_cost * self._compute_value_cloning_loss(
+            replay_batch_baseline, current_baseline)
+
+        cloning_loss = policy_cloning_loss + value_cloning_loss
+        stats = {
+            "policy_cloning_loss": policy_cloning_loss.item(),
+            "value_cloning_loss": value_cloning_loss.item(),
+        }
 
         return cloning_loss, stats
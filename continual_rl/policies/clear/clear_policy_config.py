@@ -16,9 +16,38 @@ class ClearPolicyConfig(ImpalaPolicyConfig):
         self.batch_replay_ratio = 1.0
         self.always_reuse_actor_indices = False
 
+        # The number of replay batches to sample and gather ahead of the learners, on a background thread.
+        # 0 samples on the learner threads.
+        self.replay_prefetch_batches = 0
+
         self.policy_cloning_cost = 0.01
         self.value_cloning_cost = 0.005
         self.large_file_path = None  # No default, since it can be very large and we want no surprises
+
+        # The replay buffers are stored in one sparse file (see ReplayArena). Optionally reserve its disk space up
+        # front, and give the kernel hints: transparent huge pages, and the access pattern (None, "random",
+        # "sequential", or "willneed")
+        self.replay_arena_preallocate = False
+        self.replay_arena_huge_pages = False
+        self.replay_arena_access_hint = None
+
+        # Optionally compress the replay frames, per unroll: None, "zlib", "lz4" (needs lz4), or "zstd" (needs
+        # zstandard). Decompressed entries are cached, up to replay_frame_cache_entries.
+        self.replay_frame_compression = None
+        self.replay_frame_compression_level = None  # None uses the codec's (fast) default
+        self.replay_frame_cache_entries = 128
+
+        # An optional RAM tier in front of the file-backed replay (see TieredReplayCache): each actor's most recent
+        # insertions (per actor), and the most recently sampled entries. 0 and 0 disables it.
+        self.replay_ram_tier_insert_entries = 0
+        self.replay_ram_tier_sample_entries = 0
+
+        # Optionally do all replay insertion in a dedicated writer process (see ReplayWriter), instead of in the
+        # actors. Each actor can have up to replay_writer_staging_entries unrolls waiting to be written, and the writer
+        # applies up to replay_writer_batch_entries at a time.
+        self.replay_writer_process = False
+        self.replay_writer_staging_entries = 4
+        self.replay_writer_batch_entries = 64
         self.policy_unique_id = ""
 
         # if getting "too many open files", then try switching to "file_system"
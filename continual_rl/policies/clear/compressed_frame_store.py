@@ -0,0 +1,268 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+import torch
+from continual_rl.policies.clear.replay_entry_versions import ReplayEntryVersions
+
+
+class FrameCompressionException(Exception):
+    pass
+
+
+class FrameCodec(object):
+    """
+    Compresses a whole unroll of frames at a time. zlib is always available; lz4 and zstd need the lz4 and zstandard
+    packages respectively.
+    """
+    CODECS = ["zlib", "lz4", "zstd"]
+
+    def __init__(self, name, level=None):
+        if name not in self.CODECS:
+            raise FrameCompressionException(f"Unknown frame codec {name}. Options: {self.CODECS}")
+
+        self.name = name
+        self._level = level
+        self._thread_state = threading.local()  # zstd's compressor objects are not thread-safe
+
+        # Fail now, rather than in an actor
+        try:
+            if name == "lz4":
+                import lz4.frame
+            elif name == "zstd":
+                import zstandard
+        except ImportError:
+            package = {"lz4": "lz4", "zstd": "zstandard"}[name]
+            raise FrameCompressionException(f"The {name} frame codec requires the {package} package")
+
+    def _get_zstd(self):
+        if not hasattr(self._thread_state, "compressor"):
+            import zstandard
+            self._thread_state.compressor = zstandard.ZstdCompressor(level=3 if self._level is None else self._level)
+            self._thread_state.decompressor = zstandard.ZstdDecompressor()
+
+        return self._thread_state.compressor, self._thread_state.decompressor
+
+    def compress(self, data):
+        if self.name == "zlib":
+            return zlib.compress(data, 1 if self._level is None else self._level)
+        elif self.name == "lz4":
+            import lz4.frame
+            return lz4.frame.compress(data, compression_level=0 if self._level is None else self._level)
+        else:
+            return self._get_zstd()[0].compress(data)
+
+    def decompress(self, data):
+        if self.name == "zlib":
+            return zlib.decompress(data)
+        elif self.name == "lz4":
+            import lz4.frame
+            return lz4.frame.decompress(data)
+        else:
+            return self._get_zstd()[1].decompress(data)
+
+
+def compare_frame_codecs(frames, codecs=None, level=None):
+    """
+    Compress and decompress the given frames (a uint8 tensor or array) with each codec, for choosing between them.
+    Codecs whose package isn't installed are skipped.
+    :return: {codec name: {"compression_ratio", "encode_seconds", "decode_seconds"}}
+    """
+    raw_data = np.ascontiguousarray(frames).tobytes()
+    results = {}
+
+    for codec_name in codecs or FrameCodec.CODECS:
+        try:
+            codec = FrameCodec(codec_name, level=level)
+        except FrameCompressionException:
+            continue
+
+        start_time = time.time()
+        compressed = codec.compress(raw_data)
+        encode_seconds = time.time() - start_time
+
+        start_time = time.time()
+        codec.decompress(compressed)
+        decode_seconds = time.time() - start_time
+
+        results[codec_name] = {"compression_ratio": len(raw_data) / len(compressed),
+                               "encode_seconds": encode_seconds,
+                               "decode_seconds": decode_seconds}
+
+    return results
+
+
+class CompressedFrameStore(object):
+    """
+    The frames of each replay entry, compressed per unroll. Each entry has a fixed-size chunk, big enough for the raw
+    frames (which are stored as-is if they don't compress), but only the compressed bytes are written, so in a sparse
+    file (see ReplayArena) the rest of the chunk takes no disk space or page cache.
+
+    Each entry's version (a ReplayEntryVersions seqlock) is odd while it's being written, so readers can detect (and
+    retry) a read that overlapped a write from another process. Decompressed entries are kept in a bounded LRU cache, keyed by entry and version.
+    The cache and the decode stats are per process (in practice, the learner's).
+    """
+
+    def __init__(self, chunks, chunk_lengths, chunk_versions, frame_shape, frame_dtype, codec, cache_entries,
+                 counters):
+        """
+        :param chunks, chunk_lengths, chunk_versions: Tensors laid out as in get_arena_specs
+        :param codec: A FrameCodec
+        :param cache_entries: The maximum number of decompressed entries to cache
+        :param counters: A shared float64 tensor, [num_actors, 4]: raw bytes, stored bytes, encode seconds, and
+        number of entries written by each actor. Each process only writes to its own actor's row.
+        """
+        self._frame_shape = tuple(frame_shape)
+        self._frame_dtype = torch.empty((), dtype=frame_dtype).numpy().dtype
+        self._raw_size = chunks.shape[-1]
+        self._chunks = chunks
+        self._flat_chunks = chunks.view(-1, self._raw_size).numpy()
+        self._flat_lengths = chunk_lengths.view(-1).numpy()
+        self._versions = ReplayEntryVersions(tensor=chunk_versions.view(-1))
+        self._codec = codec
+        self._counters = counters
+
+        self._cache_entries = cache_entries
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._decode_seconds = []
+
+    @staticmethod
+    def get_arena_specs(num_actors, entries_per_buffer, frame_shape, frame_dtype):
+        raw_size = int(np.prod(frame_shape)) * torch.empty((), dtype=frame_dtype).element_size()
+        return {
+            "frame_chunks": dict(size=(num_actors, entries_per_buffer, raw_size), dtype=torch.uint8),
+            "frame_chunk_lengths": dict(size=(num_actors, entries_per_buffer), dtype=torch.int64),
+            "frame_chunk_versions": dict(size=(num_actors, entries_per_buffer), dtype=torch.int64),
+        }
+
+    @property
+    def num_entries(self):
+        return len(self._flat_lengths)
+
+    def write(self, actor_index, entry_index, frames):
+        raw_data = frames.contiguous().numpy().tobytes()
+
+        start_time = time.time()
+        data = self._codec.compress(raw_data)
+        encode_seconds = time.time() - start_time
+
+        if len(data) >= len(raw_data):
+            data = raw_data  # Stored raw, which is indicated by the length
+
+        flat_index = actor_index * self._chunks.shape[1] + entry_index
+        flat_index_tensor = torch.tensor([flat_index])
+
+        versions = self._versions.begin_write(flat_index_tensor)
+        self._flat_chunks[flat_index, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self._flat_lengths[flat_index] = len(data)
+        self._versions.end_write(flat_index_tensor, versions)
+
+        self._counters[actor_index] += torch.tensor([len(raw_data), len(data), encode_seconds, 1],
+                                                    dtype=self._counters.dtype)
+
+    def _read_consistent(self, flat_index, max_attempts=1000):
+        """
+        :return: (version, length, data), or None if no read completed without overlapping a write, e.g. because the
+        writer was killed partway through
+        """
+        flat_index_tensor = torch.tensor([flat_index])
+        read = {}
+
+        # The version is read in between the seqlock's own checks, so for a consistent read it's the one they saw
+        def read_entry(positions, flat_indices):
+            read["version"] = self._versions.tensor[flat_index].item()
+            read["length"] = self._flat_lengths[flat_index]
+            read["data"] = self._flat_chunks[flat_index, :read["length"]].tobytes()
+
+        if not self._versions.read(flat_index_tensor, read_entry, max_attempts=max_attempts)[0]:
+            return None
+
+        return read["version"], read["length"], read["data"]
+
+    def read(self, flat_index):
+        """
+        :return: The entry's frames, as a (read-only) numpy array
+        """
+        consistent_read = self._read_consistent(flat_index)
+        if consistent_read is None:
+            return np.zeros(self._frame_shape, dtype=self._frame_dtype)
+
+        version, length, data = consistent_read
+
+        with self._cache_lock:
+            cached = self._cache.get(flat_index, None)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(flat_index)
+                self._cache_hits += 1
+                return cached[1]
+
+            self._cache_misses += 1
+
+        if length == 0:
+            frames = np.zeros(self._frame_shape, dtype=self._frame_dtype)  # Never written
+        else:
+            if length < self._raw_size:
+                data = self._codec.decompress(data)
+
+            frames = np.frombuffer(data, dtype=self._frame_dtype).reshape(self._frame_shape)
+
+        if self._cache_entries > 0:
+            with self._cache_lock:
+                self._cache[flat_index] = (version, frames)
+                self._cache.move_to_end(flat_index)
+
+                while len(self._cache) > self._cache_entries:
+                    self._cache.popitem(last=False)
+
+        return frames
+
+    def gather(self, flat_indices, out):
+        """
+        Decompress the given entries (indices into the [num_actors * entries_per_buffer] flattened store) into out,
+        a CPU tensor of [len(flat_indices), *frame_shape].
+        """
+        start_time = time.time()
+
+        for out_index, flat_index in enumerate(flat_indices.tolist()):
+            out[out_index].numpy()[...] = self.read(flat_index)
+
+        with self._cache_lock:
+            self._decode_seconds.append(time.time() - start_time)
+
+    def decompress_all(self):
+        """
+        :return: All entries' frames (zeros for unwritten entries) as a tensor of [num_actors, entries_per_buffer, ...]
+        """
+        frames = torch.empty((*self._chunks.shape[:2], *self._frame_shape),
+                             dtype=torch.from_numpy(np.zeros((), dtype=self._frame_dtype)).dtype)
+        self.gather(torch.arange(self.num_entries), frames.view(-1, *self._frame_shape))
+        return frames
+
+    def collect_stats(self):
+        """
+        Compression stats are cumulative (over all actors); decode stats are since the last collection.
+        """
+        stats = {}
+        raw_bytes, stored_bytes, encode_seconds, num_encoded = self._counters.sum(dim=0).tolist()
+
+        if num_encoded > 0:
+            stats["replay_frame_compression_ratio"] = raw_bytes / stored_bytes
+            stats["replay_frame_encode_latency"] = encode_seconds / num_encoded
+
+        with self._cache_lock:
+            num_reads = self._cache_hits + self._cache_misses
+            if num_reads > 0:
+                stats["replay_frame_cache_hit_rate"] = self._cache_hits / num_reads
+
+            if len(self._decode_seconds) > 0:
+                stats["replay_frame_decode_latency"] = np.mean(self._decode_seconds)
+
+            self._cache_hits = 0
+            self._cache_misses = 0
+            self._decode_seconds = []
+
+        return stats
@@ -0,0 +1,63 @@
+import time
+import torch
+
+
+class ReplayEntryVersions(object):
+    """
+    A seqlock per replay entry, in shared memory, so entries can be written and read from any process without a
+    lock: a writer bumps the entry's version to odd before writing it and to the next even number after, and a reader
+    checks the version before and after reading. A read that saw an odd version, or a version that changed, may be
+    torn (overlapped a write), and is retried.
+
+    Each entry must only have one writer at a time (in practice, each actor's section is written by one process).
+
+    There are no explicit memory fences: this relies on x86's store ordering (other cores see a process's stores in
+    the order they were made, and loads aren't reordered with other loads), so the version stores bracket the entry's
+    stores. A weakly-ordered CPU (e.g. ARM) would need fences around the version reads and writes.
+    """
+
+    def __init__(self, num_entries=None, tensor=None):
+        """
+        :param tensor: An existing int64 tensor of [num_entries] versions to use (e.g. one in a ReplayArena), instead
+        of allocating a new one in shared memory
+        """
+        self.tensor = tensor if tensor is not None else torch.zeros((num_entries,), dtype=torch.int64).share_memory_()
+
+    def begin_write(self, flat_indices):
+        """
+        :return: The versions to pass to end_write
+        """
+        versions = self.tensor[flat_indices]
+        versions += versions % 2  # A write that was interrupted (e.g. the writer was killed) leaves it odd
+        self.tensor[flat_indices] = versions + 1
+        return versions
+
+    def end_write(self, flat_indices, versions):
+        self.tensor[flat_indices] = versions + 2
+
+    def read(self, flat_indices, read_entries, max_attempts=10):
+        """
+        Read the given entries with read_entries(positions, flat_indices), which should read flat_indices into the
+        given positions of its output (positions is None for all of them), retrying the torn reads.
+        :return: A bool mask of the positions that were read consistently. The rest were still torn after
+        max_attempts, e.g. because their writer was killed partway through.
+        """
+        consistent = torch.zeros((len(flat_indices),), dtype=torch.bool)
+        pending_positions = torch.arange(len(flat_indices))
+
+        for attempt in range(max_attempts):
+            pending_indices = flat_indices[pending_positions]
+            versions_before = self.tensor[pending_indices]
+            read_entries(None if attempt == 0 else pending_positions, pending_indices)
+            versions_after = self.tensor[pending_indices]
+
+            untorn = (versions_before % 2 == 0) & (versions_before == versions_after)
+            consistent[pending_positions[untorn]] = True
+            pending_positions = pending_positions[~untorn]
+
+            if len(pending_positions) == 0:
+                break
+
+            time.sleep(0)  # Give the writers a chance to finish
+
+        return consistent
@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+
+
+class ReplayPrefetchException(Exception):
+    pass
+
+
+class ReplayPrefetcher(object):
+    """
+    Samples replay entries on a background thread, so the learner takes entries that have already been gathered out of
+    the (file-backed) replay buffers, rather than sampling and gathering them on its critical path.
+
+    A fixed set of slots (preallocated tensors) is cycled between the sampler and the learners: the sampler fills a
+    free slot and queues it as ready, and a learner takes a ready slot, copies out of it, and releases it. So at most
+    num_slots batches are gathered ahead.
+    """
+
+    def __init__(self, create_slot, fill_slot, num_slots):
+        """
+        :param create_slot: create_slot() -> a new slot (e.g. a dict of tensors)
+        :param fill_slot: fill_slot(slot) -> the number of entries written into the slot. Run on the sampler thread.
+        :param num_slots: The number of slots to cycle through
+        """
+        self._fill_slot = fill_slot
+        self._free_slots = queue.Queue()
+        self._ready_slots = queue.Queue()
+        self._stop_event = threading.Event()
+        self._exception = None
+
+        for _ in range(num_slots):
+            self._free_slots.put((create_slot(), None))
+
+        self._thread = threading.Thread(target=self._run, name="replay-prefetcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    slot, release_event = self._free_slots.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                # The learner's (asynchronous) copy out of the slot has to finish before we overwrite it
+                if release_event is not None:
+                    release_event.synchronize()
+
+                num_entries = self._fill_slot(slot)
+                self._ready_slots.put((slot, num_entries))
+
+        except Exception as e:
+            # Raised in the learner, on its next get()
+            self._exception = e
+
+    def get(self):
+        """
+        Take the oldest ready slot, waiting for one if necessary. It must be given back with release().
+        :return: (slot, number of entries in the slot, seconds spent waiting)
+        """
+        start_time = time.time()
+
+        while True:
+            try:
+                slot, num_entries = self._ready_slots.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._exception is not None:
+                    raise ReplayPrefetchException(f"Replay prefetching failed with: {self._exception}")
+
+                if not self._thread.is_alive():
+                    raise ReplayPrefetchException("Replay prefetcher is not running")
+
+        return slot, num_entries, time.time() - start_time
+
+    def release(self, slot, release_event=None):
+        """
+        Give a slot back to be refilled. If the slot is still being copied from asynchronously, pass an event
+        (e.g. a torch.cuda.Event) recorded after the copy, and the sampler will wait on it before refilling.
+        """
+        self._free_slots.put((slot, release_event))
@@ -0,0 +1,151 @@
+import queue
+import time
+import torch
+import torch.multiprocessing as mp
+
+
+class ReplayWriterException(Exception):
+    pass
+
+
+class ReplayWriter(object):
+    """
+    A dedicated process that does all replay insertion, so the actors never touch the (file-backed) replay buffers.
+
+    Each actor has a ring of staging slots in shared memory: submit() copies the unroll into the actor's next slot
+    (waiting for the writer to free it, if the ring is full) and queues the slot. The writer takes everything queued,
+    up to max_batch_entries at a time, and passes it to apply_entries in one call, so the reservoir decisions are made
+    in one place and the writes can be coalesced. Then the slots are freed.
+
+    Must be started before the processes that submit to it are forked.
+    """
+
+    def __init__(self, specs, num_actors, staging_entries_per_actor, apply_entries, max_batch_entries):
+        """
+        :param specs: {key: dict(size=entry shape ([T+1, ...]), dtype)}, for the keys that will be submitted
+        :param apply_entries: apply_entries([(actor_index, {key: entry tensor})]), run in the writer process. The
+        entry tensors are only valid for the duration of the call.
+        :param max_batch_entries: The most entries passed to one apply_entries call
+        """
+        self._staging_entries_per_actor = staging_entries_per_actor
+        self._apply_entries = apply_entries
+        self._max_batch_entries = max_batch_entries
+
+        num_slots = num_actors * staging_entries_per_actor
+        self._staging = {key: torch.zeros((num_slots, *spec["size"]), dtype=spec["dtype"]).share_memory_()
+                         for key, spec in specs.items()}
+        self._slot_free = torch.ones((num_slots,), dtype=torch.uint8).share_memory_()
+        self._running = torch.zeros((1,), dtype=torch.uint8).share_memory_()
+
+        # Written by the writer: batches applied, entries applied, seconds spent applying them. And by each
+        # submitting process, for its own actors: seconds spent waiting for a free slot, and entries submitted.
+        self._writer_counters = torch.zeros((3,), dtype=torch.float64).share_memory_()
+        self._stall_counters = torch.zeros((num_actors, 2), dtype=torch.float64).share_memory_()
+        self._last_collected = (self._writer_counters.clone(), self._stall_counters.clone())
+
+        # Per process: the next ring position of each actor that this process has submitted for
+        self._staging_cursors = {}
+
+        self._ctx = mp.get_context("fork")
+        self._queue = self._ctx.Queue()
+        self._process = None
+
+    @property
+    def num_bytes(self):
+        return sum(tensor.numel() * tensor.element_size() for tensor in self._staging.values())
+
+    def start(self):
+        self._running[0] = 1
+        self._process = self._ctx.Process(target=self._run, name="replay-writer", daemon=True)
+        self._process.start()
+
+    def stop(self, timeout=30):
+        """
+        Everything submitted before the stop is applied first.
+        """
+        self._queue.put(None)
+        self._process.join(timeout)
+
+        if self._process.exitcode is None:
+            self._process.terminate()
+            self._process.join()
+
+        self._running[0] = 0
+
+    def submit(self, actor_index, new_buffers):
+        """
+        Called by the process producing actor_index's unrolls. Only the keys in the specs are submitted.
+        """
+        cursor = self._staging_cursors.get(actor_index, 0)
+        self._staging_cursors[actor_index] = (cursor + 1) % self._staging_entries_per_actor
+        slot = actor_index * self._staging_entries_per_actor + cursor
+
+        # Backpressure: the writer hasn't caught up with this actor's ring yet
+        start_time = time.time()
+        while self._slot_free[slot] == 0:
+            if self._running[0] == 0:
+                raise ReplayWriterException("Replay writer is not running")
+
+            time.sleep(0.001)
+
+        stall_seconds = time.time() - start_time
+
+        for key, tensor in self._staging.items():
+            tensor[slot].copy_(new_buffers[key])
+
+        self._slot_free[slot] = 0
+        self._queue.put((actor_index, slot))
+        self._stall_counters[actor_index] += torch.tensor([stall_seconds, 1], dtype=self._stall_counters.dtype)
+
+    def _run(self):
+        torch.set_num_threads(1)
+        stopping = False
+
+        try:
+            while not stopping:
+                messages = [self._queue.get()]
+
+                # Coalesce everything else already queued
+                while len(messages) < self._max_batch_entries and messages[-1] is not None:
+                    try:
+                        messages.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if messages[-1] is None:
+                    stopping = True
+                    messages.pop()
+
+                if len(messages) == 0:
+                    continue
+
+                start_time = time.time()
+                self._apply_entries([(actor_index, {key: tensor[slot] for key, tensor in self._staging.items()})
+                                     for actor_index, slot in messages])
+                write_seconds = time.time() - start_time
+
+                self._slot_free[[slot for _, slot in messages]] = 1
+                self._writer_counters += torch.tensor([1, len(messages), write_seconds],
+                                                      dtype=self._writer_counters.dtype)
+        finally:
+            self._running[0] = 0
+
+    def collect_stats(self):
+        """
+        Since the last collection (by this process).
+        """
+        writer_counters = self._writer_counters.clone()
+        stall_counters = self._stall_counters.clone()
+        num_batches, num_entries, write_seconds = (writer_counters - self._last_collected[0]).tolist()
+        stall_seconds, num_submitted = (stall_counters - self._last_collected[1]).sum(dim=0).tolist()
+        self._last_collected = (writer_counters, stall_counters)
+
+        stats = {}
+        if num_batches > 0:
+            stats["replay_writer_batch_size"] = num_entries / num_batches
+            stats["replay_writer_write_latency"] = write_seconds / num_batches
+
+        if num_submitted > 0:
+            stats["replay_writer_stall_latency"] = stall_seconds / num_submitted
+
+        return stats
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class ReservoirIndex(object):
+    """
+    Tracks one actor's section of the CLEAR replay buffer, so reservoir sampling doesn't have to scan it on every
+    insertion: the unfilled entries (handed out lowest first, by a fill cursor), and a min-heap of the filled entries'
+    reservoir values (so the entry to evict is always on top). Insertion and eviction are O(log n).
+
+    The index is rebuilt from the (file-backed) reservoir values, which remain the source of truth, so it can be
+    recreated after a resume or in another process. The heap is kept in numpy arrays, so sections with millions of
+    entries stay compact.
+    """
+
+    def __init__(self, reservoir_vals):
+        """
+        :param reservoir_vals: The actor's reservoir values, shape [entries, 1]. 0 indicates an unfilled entry.
+        """
+        values = reservoir_vals.squeeze(1).numpy()
+        num_entries = len(values)
+
+        self._unfilled_indices = np.flatnonzero(values == 0)
+        self._fill_cursor = 0
+
+        # A sorted array is a valid min-heap
+        filled_indices = np.flatnonzero(values)
+        sorted_order = np.argsort(values[filled_indices], kind="stable")
+        self._heap_values = np.zeros(num_entries, dtype=np.float32)
+        self._heap_indices = np.zeros(num_entries, dtype=np.int64)
+        self._heap_size = len(filled_indices)
+        self._heap_values[:self._heap_size] = values[filled_indices][sorted_order]
+        self._heap_indices[:self._heap_size] = filled_indices[sorted_order]
+
+        # Persistent, and seeded from OS entropy so forked actors don't share a sequence
+        self._random_state = np.random.RandomState()
+
+    @property
+    def num_filled(self):
+        return self._heap_size
+
+    def sample_reservoir_val(self):
+        # > 0 so we can use reservoir_val==0 to indicate unfilled
+        return self._random_state.uniform(0.001, 1.0)
+
+    def _swap(self, first, second):
+        self._heap_values[[first, second]] = self._heap_values[[second, first]]
+        self._heap_indices[[first, second]] = self._heap_indices[[second, first]]
+
+    def _sift_up(self, position):
+        while position > 0:
+            parent = (position - 1) // 2
+            if self._heap_values[position] >= self._heap_values[parent]:
+                break
+
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(self, position):
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < self._heap_size and self._heap_values[child] < self._heap_values[smallest]:
+                    smallest = child
+
+            if smallest == position:
+                break
+
+            self._swap(position, smallest)
+            position = smallest
+
+    def get_insertion_index(self, reservoir_val):
+        """
+        Get the entry a new item with the given reservoir_val should be written to: the next unfilled entry, or if
+        there are none, the entry with the lowest reservoir value, if the new value is higher. The index is updated as
+        though the write has happened.
+        :return: The entry index, or None if the new item should be dropped
+        """
+        # Stored as float32, so compare (and keep) the value as it will be stored
+        reservoir_val = np.float32(reservoir_val)
+
+        if self._fill_cursor < len(self._unfilled_indices):
+            index = int(self._unfilled_indices[self._fill_cursor])
+            self._fill_cursor += 1
+
+            self._heap_values[self._heap_size] = reservoir_val
+            self._heap_indices[self._heap_size] = index
+            self._heap_size += 1
+            self._sift_up(self._heap_size - 1)
+
+        elif self._heap_size > 0 and reservoir_val > self._heap_values[0]:
+            index = int(self._heap_indices[0])
+            self._heap_values[0] = reservoir_val
+            self._sift_down(0)
+
+        else:
+            index = None
+
+        return index
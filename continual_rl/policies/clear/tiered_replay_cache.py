@@ -0,0 +1,182 @@
+import threading
+from collections import OrderedDict
+import torch
+
+
+class TieredReplayCache(object):
+    """
+    A bounded in-RAM tier in front of the file-backed replay buffers, so sampling doesn't depend on the OS page cache
+    holding the entries it picks. It holds two regions of slots, in shared memory:
+
+    1. Insert region: each actor's most recent insertions, in a ring of insert_entries_per_actor slots per actor.
+    Written by the inserting process alongside the file-backed write; the oldest insertion is evicted (FIFO).
+    2. Sample region: entries that were read from disk when sampled are promoted into it, evicting the least
+    recently sampled entry (LRU). Only used by the sampling (learner) process.
+
+    Every replay entry has a version (in the shared entry_versions, odd while the entry is being written), and each
+    slot records which entry and version it holds, so a slot whose entry has since been overwritten is treated as a
+    miss, and read from disk instead.
+    """
+
+    def __init__(self, specs, num_actors, entries_per_buffer, entry_versions, insert_entries_per_actor,
+                 sample_entries):
+        """
+        :param specs: {key: dict(size=entry shape ([T+1, ...]), dtype)}, for the keys to keep in RAM
+        :param entry_versions: The shared int64 versions of the [num_actors * entries_per_buffer] replay entries
+        """
+        self._entries_per_buffer = entries_per_buffer
+        self._insert_entries_per_actor = insert_entries_per_actor
+        self._sample_entries = sample_entries
+        self._entry_versions = entry_versions
+        num_insert_slots = num_actors * insert_entries_per_actor
+        num_slots = num_insert_slots + sample_entries
+
+        self.tensors = {key: torch.zeros((num_slots, *spec["size"]), dtype=spec["dtype"]).share_memory_()
+                        for key, spec in specs.items()}
+        self._slot_entries = torch.full((num_slots,), -1, dtype=torch.int64).share_memory_()
+        self._slot_versions = torch.zeros((num_slots,), dtype=torch.int64).share_memory_()
+        self._entry_insert_slots = torch.full((num_actors * entries_per_buffer,), -1,
+                                              dtype=torch.int64).share_memory_()
+
+        # Per process: the next ring position of each actor that this process has inserted for
+        self._insert_cursors = {}
+
+        # Sampling process only: flat entry index -> slot, least recently sampled first
+        self._sample_slots = OrderedDict()
+        self._free_sample_slots = list(range(num_insert_slots, num_slots))
+        self._lock = threading.Lock()
+        self._stats = self._create_empty_stats()
+
+    @staticmethod
+    def _create_empty_stats():
+        return {"lookups": 0, "insert_hits": 0, "sample_hits": 0, "promotions": 0, "evictions": 0}
+
+    @property
+    def keys(self):
+        return self.tensors.keys()
+
+    @property
+    def num_bytes(self):
+        return sum(tensor.numel() * tensor.element_size() for tensor in self.tensors.values())
+
+    def on_insert(self, actor_index, entry_index, new_buffers):
+        """
+        Called after the entry has been written to the file-backed buffers (and its version bumped to even).
+        """
+        if self._insert_entries_per_actor == 0:
+            return
+
+        flat_index = actor_index * self._entries_per_buffer + entry_index
+        cursor = self._insert_cursors.get(actor_index, 0)
+        self._insert_cursors[actor_index] = (cursor + 1) % self._insert_entries_per_actor
+        slot = actor_index * self._insert_entries_per_actor + cursor
+
+        # Evict the slot's previous entry, and invalidate the slot while it's being written
+        evicted_index = self._slot_entries[slot].item()
+        self._slot_entries[slot] = -1
+        if evicted_index >= 0 and self._entry_insert_slots[evicted_index] == slot:
+            self._entry_insert_slots[evicted_index] = -1
+
+        for key, tensor in self.tensors.items():
+            tensor[slot].copy_(new_buffers[key])
+
+        self._slot_versions[slot] = self._entry_versions[flat_index]
+        self._slot_entries[slot] = flat_index
+        self._entry_insert_slots[flat_index] = slot
+
+    def _get_valid_hits(self, flat_indices, versions, slots):
+        in_range_slots = slots.clamp(min=0)
+        return (slots >= 0) & (versions % 2 == 0) & (self._slot_entries[in_range_slots] == flat_indices) & \
+            (self._slot_versions[in_range_slots] == versions)
+
+    def gather(self, flat_indices, out, read_from_disk):
+        """
+        Fill out[key][i] with entry flat_indices[i], for each of our keys, from RAM where possible. The rest are read
+        with read_from_disk(positions, flat_indices), which should fill out[key][positions]. Entries read from disk
+        are then promoted into the sample region.
+        """
+        versions = self._entry_versions[flat_indices]
+        insert_slots = self._entry_insert_slots[flat_indices]
+
+        with self._lock:
+            sample_slots = torch.tensor([self._sample_slots.get(flat_index, -1) for flat_index in flat_indices.tolist()],
+                                        dtype=torch.int64)
+            for flat_index in flat_indices[sample_slots >= 0].tolist():
+                self._sample_slots.move_to_end(flat_index)
+
+        # Prefer the insert region, unless its copy is stale
+        from_insert_region = self._get_valid_hits(flat_indices, versions, insert_slots)
+        slots = torch.where(from_insert_region, insert_slots, sample_slots)
+        hits = self._get_valid_hits(flat_indices, versions, slots)
+        hit_positions = hits.nonzero().squeeze(1)
+
+        for key, tensor in self.tensors.items():
+            out[key][hit_positions] = tensor[slots[hit_positions]]
+
+        # A slot may have been reused while we were copying out of it, in which case it's a miss after all
+        hits[hit_positions] = self._get_valid_hits(flat_indices[hit_positions], versions[hit_positions],
+                                                   slots[hit_positions])
+        miss_positions = (~hits).nonzero().squeeze(1)
+        read_from_disk(miss_positions, flat_indices[miss_positions])
+
+        with self._lock:
+            self._stats["lookups"] += len(flat_indices)
+            self._stats["insert_hits"] += int((hits & from_insert_region).sum())
+            self._stats["sample_hits"] += int((hits & ~from_insert_region).sum())
+
+            if self._sample_entries > 0:
+                self._promote(flat_indices[miss_positions], versions[miss_positions], miss_positions, out)
+
+    def _promote(self, flat_indices, versions, positions, out):
+        # Only entries that weren't being written while we read them, so we know what version we have
+        unchanged = (versions % 2 == 0) & (self._entry_versions[flat_indices] == versions)
+
+        # Promoting more than fit would evict entries promoted in this same call
+        if unchanged.sum() > self._sample_entries:
+            unchanged[unchanged.nonzero().squeeze(1)[:-self._sample_entries]] = False
+        promoted_slots = []
+        promoted_positions = []
+
+        for flat_index, version, position in zip(flat_indices[unchanged].tolist(), versions[unchanged].tolist(),
+                                                 positions[unchanged].tolist()):
+            if flat_index in self._sample_slots:
+                slot = self._sample_slots[flat_index]  # Holding an old version
+                self._sample_slots.move_to_end(flat_index)
+            elif len(self._free_sample_slots) > 0:
+                slot = self._free_sample_slots.pop()
+                self._sample_slots[flat_index] = slot
+            else:
+                _, slot = self._sample_slots.popitem(last=False)
+                self._sample_slots[flat_index] = slot
+                self._stats["evictions"] += 1
+
+            self._slot_entries[slot] = -1
+            self._slot_versions[slot] = version
+            promoted_slots.append(slot)
+            promoted_positions.append(position)
+
+        promoted_slots = torch.tensor(promoted_slots, dtype=torch.int64)
+        promoted_positions = torch.tensor(promoted_positions, dtype=torch.int64)
+        for key, tensor in self.tensors.items():
+            tensor[promoted_slots] = out[key][promoted_positions]
+
+        self._slot_entries[promoted_slots] = flat_indices[unchanged]
+        self._stats["promotions"] += len(promoted_slots)
+
+    def collect_stats(self):
+        """
+        Since the last collection. Hits in either region count toward the hit rate.
+        """
+        with self._lock:
+            stats = self._stats
+            self._stats = self._create_empty_stats()
+
+        collected = {"replay_ram_tier_promotions": stats["promotions"],
+                     "replay_ram_tier_evictions": stats["evictions"]}
+
+        if stats["lookups"] > 0:
+            collected["replay_ram_tier_hit_rate"] = (stats["insert_hits"] + stats["sample_hits"]) / stats["lookups"]
+            collected["replay_ram_tier_insert_hit_rate"] = stats["insert_hits"] / stats["lookups"]
+            collected["replay_ram_tier_sample_hit_rate"] = stats["sample_hits"] / stats["lookups"]
+
+        return collected
@@ -4,6 +4,7 @@ from continual_rl.policies.discrete_random.discrete_random_policy_config import
 from continual_rl.policies.discrete_random.discrete_random_timestep_data import DiscreteRandomTimestepData
 from continual_rl.experiments.environment_runners.environment_runner_sync import EnvironmentRunnerSync
 from continual_rl.experiments.environment_runners.environment_runner_batch import EnvironmentRunnerBatch
+from continual_rl.utils.env_fork_server import EnvForkServer
 
 
 class DiscreteRandomPolicy(PolicyBase):
@@ -16,15 +17,29 @@ class DiscreteRandomPolicy(PolicyBase):
         self._config = config
         self._action_spaces = action_spaces
 
+        # Started before the model exists, so the env workers it forks start small
+        self._env_fork_server = None
+        if config.use_env_fork_server:
+            self._env_fork_server = EnvForkServer(preload_modules=config.env_preload_modules)
+            self._env_fork_server.start()
+
     def get_environment_runner(self, task_spec):
         if self._config.num_parallel_envs is None:
             runner = EnvironmentRunnerSync(policy=self, timesteps_per_collection=self._config.timesteps_per_collection)
         else:
             runner = EnvironmentRunnerBatch(policy=self, num_parallel_envs=self._config.num_parallel_envs,
                                             timesteps_per_collection=self._config.timesteps_per_collection,
-                                            output_dir=self._config.output_dir)
+                                            output_dir=self._config.output_dir,
+                                            fork_server=self._env_fork_server,
+                                            env_preload_modules=self._config.env_preload_modules,
+                                            warm_env_template=self._config.warm_env_template)
         return runner
 
+    def shutdown(self):
+        if self._env_fork_server is not None:
+            self._env_fork_server.stop()
+            self._env_fork_server = None
+
     def compute_action(self, observation, task_id, action_space_id, last_timestep_data, eval_mode):
         task_action_count = self._action_spaces[action_space_id].n
 
@@ -8,6 +8,11 @@ class DiscreteRandomPolicyConfig(ConfigBase):
         self.timesteps_per_collection = 128  # Per process, for batch
         self.num_parallel_envs = None  # If None we operate synchronously, otherwise we batch
 
+        # Simulator libraries (e.g. "ale_py", "procgen", "nle") imported once, before any env workers are forked
+        self.env_preload_modules = []
+        self.use_env_fork_server = False  # Fork env workers from a small, preloaded server process
+        self.warm_env_template = False  # Build each task's env once, and give each forked worker a copy of it
+
     def _load_from_dict_internal(self, config_dict):
         self.timesteps_per_collection = config_dict.pop("timesteps_per_collection", self.timesteps_per_collection)
 
@@ -15,4 +20,7 @@ class DiscreteRandomPolicyConfig(ConfigBase):
         self.num_parallel_envs = config_dict.pop("num_parallel_envs", self.num_parallel_envs)
         self.num_parallel_envs = int(self.num_parallel_envs) if self.num_parallel_envs is not None else None
 
+        # The rest are loaded as-is
+        self._auto_load_class_parameters(config_dict)
+
         return self
@@ -0,0 +1,93 @@
+import torch
+
+
+class BatchedFisher(object):
+    """
+    Estimates the diagonal of the Fisher information as the mean, over samples (e.g. replay batches), of each sample's
+    squared gradient, accumulated into one flat buffer.
+
+    Samples are processed samples_per_pass at a time: each one's gradient is still computed separately, but in a
+    single pass, using torch.func (grad, vmapped over the samples). If the model or loss can't be transformed (e.g.
+    because the loss updates module state, such as running reward moments), or torch.func isn't available (torch < 2.0),
+    it falls back to one backward per sample.
+    """
+
+    def __init__(self, model, sample_loss, samples_per_pass, logger=None):
+        """
+        :param sample_loss: sample_loss(model_fn, sample) -> a scalar loss, where model_fn(*args) runs the model
+        :param samples_per_pass: The most samples to compute gradients for in one pass. 1 disables batching.
+        """
+        self._model = model
+        self._sample_loss = sample_loss
+        self._samples_per_pass = samples_per_pass
+        self._logger = logger
+        self._use_vmap = samples_per_pass > 1
+
+        self._params = {name: param for name, param in model.named_parameters() if param.requires_grad}
+        self._param_shapes = {name: param.shape for name, param in self._params.items()}
+        num_elements = sum(param.numel() for param in self._params.values())
+        device = next(iter(self._params.values())).device
+
+        self.squared_grads = torch.zeros((num_elements,), device=device)
+        self.num_samples = 0
+
+    def _compute_squared_grads_vmapped(self, samples):
+        """
+        :return: The flat sum of the samples' squared gradients
+        """
+        from torch.func import functional_call, grad, vmap  # Only in torch >= 2.0, so imported on first use
+
+        params = {name: param.detach() for name, param in self._params.items()}
+        buffers = dict(self._model.named_buffers())
+        stacked_samples = {key: torch.stack([sample[key] for sample in samples]) for key in samples[0].keys()}
+
+        def compute_loss(params, sample):
+            return self._sample_loss(lambda *args: functional_call(self._model, (params, buffers), args), sample)
+
+        # The model may sample (e.g. actions), so each sample gets its own randomness
+        per_sample_grads = vmap(grad(compute_loss), in_dims=(None, 0), randomness="different")(params,
+                                                                                               stacked_samples)
+        return torch.cat([per_sample_grads[name].pow(2).sum(dim=0).flatten() for name in self._params.keys()])
+
+    def _compute_squared_grads(self, sample):
+        loss = self._sample_loss(self._model, sample)
+        grads = torch.autograd.grad(loss, list(self._params.values()))
+        return torch.cat([sample_grad.detach().pow(2).flatten() for sample_grad in grads])
+
+    def accumulate(self, samples):
+        """
+        :param samples: A list of samples, each a dict of tensors. Only samples with the same shapes can be batched
+        together, so they're grouped by shape.
+        """
+        groups = {}
+        for sample in samples:
+            shape_key = tuple((key, tuple(tensor.shape)) for key, tensor in sample.items())
+            groups.setdefault(shape_key, []).append(sample)
+
+        for group in groups.values():
+            for start in range(0, len(group), self._samples_per_pass):
+                pass_samples = group[start:start + self._samples_per_pass]
+
+                if self._use_vmap and len(pass_samples) > 1:
+                    try:
+                        self.squared_grads += self._compute_squared_grads_vmapped(pass_samples)
+                        self.num_samples += len(pass_samples)
+                        continue
+                    except (ImportError, RuntimeError, NotImplementedError) as e:
+                        if self._logger is not None:
+                            self._logger.warning(f"Batched Fisher estimation not supported ({e}), computing one "
+                                                 f"sample at a time instead")
+                        self._use_vmap = False
+
+                for sample in pass_samples:
+                    self.squared_grads += self._compute_squared_grads(sample)
+                    self.num_samples += 1
+
+    def get_importance(self):
+        """
+        :return: {parameter name: the mean squared gradient}, shaped like the parameter
+        """
+        mean_squared_grads = self.squared_grads / max(self.num_samples, 1)
+        split_grads = torch.split(mean_squared_grads, [shape.numel() for shape in self._param_shapes.values()])
+        return {name: split_grad.view(shape) for (name, shape), split_grad in zip(self._param_shapes.items(),
+                                                                                  split_grads)}
@@ -4,7 +4,11 @@ import threading
 import json
 import shutil
 import os
+import time
 from continual_rl.policies.impala.torchbeast.monobeast import Monobeast, Buffers
+from continual_rl.policies.ewc.batched_fisher import BatchedFisher
+from continual_rl.policies.ewc.ewc_penalty import EWCPenalty, sparsify_terms, densify_terms
+from continual_rl.policies.ewc.ewc_terms_store import EWCTermsStore
 from continual_rl.utils.utils import Utils
 
 
@@ -29,9 +33,6 @@ class EWCTaskInfo(object):
         buffers_existed = os.path.exists(permanent_path)
         os.makedirs(permanent_path, exist_ok=True)
 
-        self.replay_buffers, self.temp_files = self._create_replay_buffers(
-            model_flags, buffer_specs, entries_per_buffer, permanent_path
-        )
         self.total_steps, _, total_step_file = Utils.create_file_backed_tensor(
             permanent_path, (1,), dtype=torch.int64, permanent_file_name="total_steps.fbt"
         )
@@ -42,44 +43,95 @@ class EWCTaskInfo(object):
             permanent_file_name="replay_counters.fbt",
         )
 
-        self.temp_files.append(total_step_file)
-        self.temp_files.append(replay_counter_file)
+        self.temp_files = [total_step_file, replay_counter_file]
 
         if not buffers_existed:
             # Set to 0, since they're both counters.
             self.total_steps.zero_()
             self.replay_buffer_counters.zero_()
+        elif not all(os.path.exists(os.path.join(permanent_path, self._get_replay_file_name(key)))
+                     for key in buffer_specs):
+            # The counters describe replay that is no longer there (e.g. it was written in an older layout, or only
+            # partially), so don't sample from entries that would be created empty
+            self.replay_buffer_counters.zero_()
+
+        # Set while the task is being consolidated asynchronously, so its replay stays as it was at the boundary
+        self.replay_frozen = torch.zeros((1,), dtype=torch.uint8).share_memory_()
+
+        # The replay buffers are only created once used (see get_replay_buffers), separately by each process
+        self._model_flags = model_flags
+        self._buffer_specs = buffer_specs
+        self._entries_per_buffer = entries_per_buffer
+        self._permanent_path = permanent_path
+        self._replay_buffers = None
+        self._replay_temp_files = None
 
         # Main-process only variables
         self.ewc_regularization_terms = None
 
+    def get_replay_buffers(self):
+        """
+        The replay buffers are created the first time they're used (normally the task's first insert, in an actor),
+        so tasks that haven't been seen yet take no space. Any other process that uses them later opens the same
+        files. The files are sparse: their blocks are only allocated as entries are written.
+        """
+        replay_buffers = self._replay_buffers
+        if replay_buffers is None:
+            replay_buffers, self._replay_temp_files = self._create_replay_buffers(
+                self._model_flags, self._buffer_specs, self._entries_per_buffer, self._permanent_path
+            )
+            self._replay_buffers = replay_buffers
+
+        return replay_buffers
+
+    def release_replay_buffers(self, discard=False):
+        """
+        Unmap this process's replay buffers. They're reopened if used again (e.g. if the task is seen again).
+        :param discard: Also delete the replay's files, and reset its counters, so its disk space is freed and the
+        replay starts over if the task is seen again. Only safe once no other process has them open.
+        """
+        self._replay_buffers = None
+        self._replay_temp_files = None
+
+        if discard:
+            self.replay_buffer_counters.zero_()
+            for key in self._buffer_specs:
+                file_path = os.path.join(self._permanent_path, self._get_replay_file_name(key))
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    @staticmethod
+    def _get_replay_file_name(key):
+        return f"replay_{key}.fbt"
+
     def _create_replay_buffers(self, model_flags, specs, entries_per_buffer, permanent_path):
         """
         Key differences from normal buffers:
         1. File-backed, so we can store more at a time
-        2. Structured so that there are num_actors buffers, each with entries_per_buffer entries
+        2. Sparse, so only the entries written take space
+        3. Structured so that there are num_actors buffers, each with entries_per_buffer entries. They're stored as
+        one [num_actors, entries_per_buffer, ...] tensor per key, so entries from any actors can be read together.
 
         Each buffer entry has unroll_length size, so the number of frames stored is (roughly, because of integer
         rounding): num_actors * entries_per_buffer * unroll_length
         """
-        buffers: Buffers = {key: [] for key in specs}
+        buffers: Buffers = {}
 
         # Hold on to the file handle so it does not get deleted. Technically optional, as at least linux will
         # keep the file open even after deletion, but this way it is still visible in the location it was created
         temp_files = []
 
-        for actor_id in range(model_flags.num_actors):
-            for key in buffers:
-                shape = (entries_per_buffer, *specs[key]["size"])
-                permanent_file_name = f"replay_{actor_id}_{key}.fbt"
-                new_tensor, _, temp_file = Utils.create_file_backed_tensor(
-                    permanent_path,
-                    shape,
-                    specs[key]["dtype"],
-                    permanent_file_name=permanent_file_name,
-                )
-                buffers[key].append(new_tensor.share_memory_())
-                temp_files.append(temp_file)
+        for key in specs:
+            shape = (model_flags.num_actors, entries_per_buffer, *specs[key]["size"])
+            permanent_file_name = self._get_replay_file_name(key)
+            new_tensor, _, temp_file = Utils.create_file_backed_tensor(
+                permanent_path,
+                shape,
+                specs[key]["dtype"],
+                permanent_file_name=permanent_file_name,
+            )
+            buffers[key] = new_tensor.share_memory_()
+            temp_files.append(temp_file)
 
         return buffers, temp_files
 
@@ -107,11 +159,45 @@ class EWCMonobeast(Monobeast):
         )
         self._prev_task_id = None
         self._checkpoint_lock = threading.Lock()
+        self._sampling_thread_state = threading.local()
         self._collection_paused = False
 
+        # If async_ewc_consolidation, a task is consolidated on a background thread, while learning continues. Its
+        # regularization terms are published (and so the penalty turned on) once the Fisher is complete.
+        self._consolidation_thread = None
+        self._consolidation_exception = None
+
+        # Since stats were last collected: the time spent consolidating, the time from the task boundary until
+        # the new terms were published, and if the Fisher is sparsified, the fraction of its entries kept and the
+        # resulting relative error of the penalty (see _sparsify_terms)
+        self._consolidation_stats_lock = threading.Lock()
+        self._consolidation_stats = self._create_empty_consolidation_stats()
+
+        # The EWCPenalty for the tasks last included, and those tasks' (task_id, regularization terms), to tell when
+        # it needs rebuilding (the current task changed, or new terms were published)
+        self._ewc_penalty = None
+        self._ewc_penalty_terms = None
+        self._ewc_penalty_lock = threading.Lock()
+
+        # If ewc_graph_free_penalty: (penalty, model, flat gradient) computed by the loss, for custom_gradients to add
+        self._pending_ewc_gradient = None
+
+        # Where the regularization terms are saved (see save), and the files the last save referenced
+        self._terms_store = None
+        self._terms_store_directory = None
+        self._previous_saved_terms_files = set()
+
         self._tasks = None  # If you observe this never getting set, make sure initialize_tasks is getting called
 
+    @staticmethod
+    def _create_empty_consolidation_stats():
+        return {"ewc_consolidation_latency": [], "ewc_consolidation_delay_latency": [],
+                "ewc_fisher_kept_fraction": [], "ewc_fisher_approximation_error": []}
+
     def save(self, output_path):
+        # Otherwise the terms being computed wouldn't be saved, and the boundary wouldn't be detected again on load
+        self._wait_for_consolidation()
+
         super().save(output_path)
         ewc_metadata_path = os.path.join(output_path, "ewc_metadata.tar")
 
@@ -119,15 +205,22 @@ class EWCMonobeast(Monobeast):
         if os.path.exists(ewc_metadata_path):
             shutil.copyfile(ewc_metadata_path, os.path.join(output_path, "ewc_metadata_bak.tar"))
 
-        metadata = {"prev_task_id": self._prev_task_id}
-        per_task_metadata = {}
+        # The terms only change at task boundaries, so each is only written once, to its own file, and the metadata
+        # just records which files. The files the backup references are kept too.
+        terms_store = self._get_terms_store(output_path)
+        per_task_terms_files = {}
 
         for task_id, task_info in self._tasks.items():
-            per_task_metadata[task_id] = task_info.ewc_regularization_terms
+            terms = task_info.ewc_regularization_terms
+            per_task_terms_files[task_id] = terms_store.put(terms) if terms is not None else None
 
-        metadata["per_task_metadata"] = per_task_metadata
+        metadata = {"prev_task_id": self._prev_task_id, "per_task_terms_files": per_task_terms_files}
         torch.save(metadata, ewc_metadata_path)
 
+        saved_terms_files = set(per_task_terms_files.values()) - {None}
+        terms_store.remove_unreferenced(saved_terms_files | self._previous_saved_terms_files)
+        self._previous_saved_terms_files = saved_terms_files
+
     def load(self, output_path):
         super().load(output_path)
         ewc_metadata_path = os.path.join(output_path, "ewc_metadata.tar")
@@ -140,11 +233,28 @@ class EWCMonobeast(Monobeast):
 
         if metadata is not None:
             self._prev_task_id = metadata["prev_task_id"]
-            per_task_metadata = metadata["per_task_metadata"]
+
+            if "per_task_terms_files" in metadata:
+                terms_store = self._get_terms_store(output_path)
+                per_task_terms_files = metadata["per_task_terms_files"]
+                per_task_metadata = {task_id: terms_store.get(file_name) if file_name is not None else None
+                                     for task_id, file_name in per_task_terms_files.items()}
+                self._previous_saved_terms_files = set(per_task_terms_files.values()) - {None}
+            else:
+                # Saved before the terms were stored separately
+                per_task_metadata = metadata["per_task_metadata"]
 
             for task_id in self._tasks.keys():
                 self._tasks[task_id].ewc_regularization_terms = per_task_metadata[key_fn(task_id)]
 
+    def _get_terms_store(self, output_path):
+        terms_directory = os.path.join(output_path, "ewc_terms")
+        if self._terms_store is None or self._terms_store_directory != terms_directory:
+            self._terms_store = EWCTermsStore(terms_directory)
+            self._terms_store_directory = terms_directory
+
+        return self._terms_store
+
     def set_pause_collection_state(self, state):
         self._collection_paused = state
 
@@ -165,40 +275,63 @@ class EWCMonobeast(Monobeast):
                 for id in task_ids
             }
 
+    def _get_ewc_penalty(self, task_flags):
+        """
+        :return: The EWCPenalty over the tasks whose regularization terms should be included, or None if there are
+        none. If online ewc, then there should only be one "task".
+        """
+        included_terms = [(task_id, task_info.ewc_regularization_terms) for task_id, task_info in self._tasks.items()
+                          if task_info.ewc_regularization_terms is not None and (
+                              not self._model_flags.omit_ewc_for_current_task
+                              or task_info != self._get_task(task_flags.task_id))]
+
+        with self._ewc_penalty_lock:
+            # Compared by identity: terms are only ever replaced, never modified
+            previous_terms = self._ewc_penalty_terms
+            if previous_terms is None or len(previous_terms) != len(included_terms) or any(
+                    task_id != previous_task_id or terms is not previous
+                    for (task_id, terms), (previous_task_id, previous) in zip(included_terms, previous_terms)):
+                self._ewc_penalty = None
+                self._ewc_penalty_terms = included_terms
+
+                if len(included_terms) > 0:
+                    self.logger.info(f"EWC regularization terms found for {[task_id for task_id, _ in included_terms]}: "
+                                     f"aggregating")
+
+                    # Scale by the number of tasks whose losses we're including, so the scale is roughly consistent
+                    num_tasks_included = len(included_terms)
+                    scale = 1 / num_tasks_included if self._model_flags.scale_ewc_by_num_tasks else 1
+                    self._ewc_penalty = EWCPenalty([terms for _, terms in included_terms],
+                                                   use_mean=self._model_flags.use_ewc_mean, scale=scale / 2.0)
+
+            return self._ewc_penalty
+
     def _compute_ewc_loss(self, task_flags, model):
-        ewc_loss = 0
-        num_tasks_included = 0
+        """
+        If ewc_graph_free_penalty, the returned loss has no graph. Its gradient is instead added by custom_gradients,
+        after the backward.
+        """
+        ewc_penalty = self._get_ewc_penalty(task_flags)
+        if ewc_penalty is None:
+            return 0.0
 
-        # For each task, incorporate its regularization terms. If online ewc, then there should only be one "task"
-        for task_id, task_info in self._tasks.items():
-            if task_info.ewc_regularization_terms is not None and (
-                not self._model_flags.omit_ewc_for_current_task
-                or task_info != self._get_task(task_flags.task_id)
-            ):
-                self.logger.info("EWC regularization terms found: computing loss")
-                task_param, importance = task_info.ewc_regularization_terms
-                task_reg_loss = 0
-                for n, p in model.named_parameters():
-                    mean = task_param[n]
-                    fisher = importance[n]
-                    task_reg_loss_delta = fisher.detach() * (p - mean.detach()) ** 2
-                    if self._model_flags.use_ewc_mean:
-                        task_reg_loss = task_reg_loss + task_reg_loss_delta.mean()
-                    else:
-                        task_reg_loss = task_reg_loss + task_reg_loss_delta.sum()
-
-                ewc_loss = ewc_loss + task_reg_loss
-                num_tasks_included += 1
-
-        if self._model_flags.scale_ewc_by_num_tasks and num_tasks_included != 0:
-            # Scale by the number of tasks whose losses we're including, so the scale is roughly consistent
-            final_ewc_loss = ewc_loss / num_tasks_included
-        else:
-            final_ewc_loss = ewc_loss
+        if self._model_flags.ewc_graph_free_penalty:
+            penalty, gradient = ewc_penalty.compute_with_gradient(model)
+            self._pending_ewc_gradient = (ewc_penalty, model, gradient)
+            return penalty
+
+        return ewc_penalty.compute(model)
+
+    def custom_gradients(self, task_flags, model):
+        # The penalty's model may not be the one passed in (e.g. P&C applies it to the knowledge base)
+        pending_ewc_gradient = self._pending_ewc_gradient
+        self._pending_ewc_gradient = None
 
-        return final_ewc_loss / 2.0
+        if pending_ewc_gradient is not None:
+            ewc_penalty, penalty_model, gradient = pending_ewc_gradient
+            ewc_penalty.add_to_grads(penalty_model, self._model_flags.ewc_lambda * gradient)
 
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs, replay_mask):
         """
         Use the learner_model to save off Fisher information/mean params (via "checkpointing"), and use those
         to compute the EWC loss. Both use the learner_model for consistency (specifically device consistency).
@@ -206,16 +339,23 @@ class EWCMonobeast(Monobeast):
         # If we've moved to a new task, save off what we need to for ewc loss computation
         # Don't let multiple learner threads trigger the checkpointing
         with self._checkpoint_lock:
+            if self._consolidation_exception is not None:
+                raise self._consolidation_exception
+
             cur_task_id = task_flags.task_id
             if self._prev_task_id is not None and cur_task_id != self._prev_task_id:
                 # Note: task_flags passed in here are only pseudo-used. Consider using prev task flags if this changes
                 self.logger.info(f"EWC: checkpointing {self._prev_task_id}")
 
-                # EWC checkpointing can take some time, so attempting to pause stats reporting
-                # so not just reporting nans. Still works without this, but cuts down on the
-                # nans logged so to not appear like actors are dead. 
-                with self._stats_lock:
-                    self.checkpoint_task(self._prev_task_id, task_flags, model, online=self._model_flags.online_ewc)
+                if self._model_flags.async_ewc_consolidation:
+                    self._start_consolidation(self._prev_task_id, task_flags, model)
+                else:
+                    # EWC checkpointing can take some time, so attempting to pause stats reporting
+                    # so not just reporting nans. Still works without this, but cuts down on the
+                    # nans logged so to not appear like actors are dead.
+                    with self._stats_lock:
+                        self.checkpoint_task(self._prev_task_id, task_flags, model,
+                                             online=self._model_flags.online_ewc)
             self._prev_task_id = cur_task_id
 
         if self._model_flags.online_ewc or self._get_task(cur_task_id).total_steps >= self._model_flags.ewc_per_task_min_frames:
@@ -227,40 +367,79 @@ class EWCMonobeast(Monobeast):
 
         return ewc_loss, stats
 
+    def _start_consolidation(self, task_id, task_flags, model):
+        """
+        Checkpoint the task on a background thread, against a snapshot of the model as of the boundary, and with the
+        task's replay frozen (only relevant for online EWC, where the new task shares the replay).
+        """
+        self._wait_for_consolidation()  # One at a time, so the online terms build on each other in order
+
+        task_info = self._get_task(task_id)
+        task_info.replay_frozen[0] = 1
+        snapshot_model = self._create_model_snapshot(model)
+        boundary_time = time.time()
+
+        def consolidate():
+            try:
+                self.checkpoint_task(task_id, task_flags, snapshot_model, online=self._model_flags.online_ewc)
+                self._record_consolidation_stat("ewc_consolidation_delay_latency", time.time() - boundary_time)
+            except Exception as e:
+                # Raised in the learner, on its next custom_loss
+                self._consolidation_exception = e
+            finally:
+                task_info.replay_frozen[0] = 0
+
+        self._consolidation_thread = threading.Thread(target=consolidate, name="ewc-consolidation", daemon=True)
+        self._consolidation_thread.start()
+
+    def _create_model_snapshot(self, model):
+        """
+        A fresh model with a copy of the model's parameters and buffers. Not a deepcopy, which would also copy any
+        forward hooks, and those can refer back to the live model (e.g. P&C's knowledge base records its inputs for
+        the active column).
+        """
+        snapshot_model = type(model)(self._observation_space, self._action_spaces, self._model_flags)
+        snapshot_model.load_state_dict(model.state_dict())
+        snapshot_model.to(next(model.parameters()).device)
+        snapshot_model.train(model.training)
+
+        for snapshot_param, param in zip(snapshot_model.parameters(), model.parameters()):
+            snapshot_param.requires_grad_(param.requires_grad)
+
+        return snapshot_model
+
+    def _wait_for_consolidation(self):
+        if self._consolidation_thread is not None:
+            self._consolidation_thread.join()
+            self._consolidation_thread = None
+
+    def _record_consolidation_stat(self, key, value):
+        with self._consolidation_stats_lock:
+            self._consolidation_stats[key].append(value)
+
     def checkpoint_task(self, task_id, task_flags, model, online=False):
         # save model weights for task (MAP estimate)
         task_params = {}
         for n, p in model.named_parameters():
             task_params[n] = p.detach().clone()
 
-        importance = {}
-        # initialize to zeros
-        for n, p in model.named_parameters():
-            if p.requires_grad:
-                importance[n] = p.detach().clone().fill_(0)  # initialize to zeros
-
         # estimate Fisher information matrix
-        for i in range(self._model_flags.n_fisher_samples):
-            task_replay_batch = self._sample_from_task_replay_buffer(task_id, self._model_flags.batch_size)
-
-            # NOTE: setting initial_agent_state to an empty list, not sure if this is correct?
-            # Calling Monobeast's loss explicitly to make sure the loss is the right one (PnC overrides it)
-            # This uses pg_loss and baseline_loss as the signals for importance of parameters (omitting entropy)
-            _, stats, pg_loss, baseline_loss = super().compute_loss(self._model_flags, task_flags, model, task_replay_batch, [], with_custom_loss=False)
-            loss = pg_loss + baseline_loss
-            self.optimizer.zero_grad()
-            loss.backward()
-
-            for n, p in model.named_parameters():
-                assert p.grad is not None, f"Parameter {n} did not have a gradient when computing the Fisher. Therefore it will not be saved correctly."
-                importance[n] = importance[n] + p.grad.detach().clone() ** 2
-
-        # Normalize by sample size used for estimation
+        start_time = time.time()
+        fisher = BatchedFisher(model, lambda model_fn, batch: self._compute_fisher_loss(task_flags, model, model_fn, batch),
+                               samples_per_pass=self._model_flags.n_fisher_samples_per_pass, logger=self.logger)
+
+        for start in range(0, self._model_flags.n_fisher_samples, self._model_flags.n_fisher_samples_per_pass):
+            num_samples = min(self._model_flags.n_fisher_samples_per_pass, self._model_flags.n_fisher_samples - start)
+            fisher.accumulate([self._sample_from_task_replay_buffer(task_id, self._model_flags.batch_size)
+                               for _ in range(num_samples)])
+
+        # Normalized by sample size used for estimation
         task_info = self._get_task(task_id)
-        importance = {n: p / self._model_flags.n_fisher_samples for n, p in importance.items()}
+        importance = fisher.get_importance()
 
         if online and task_info.ewc_regularization_terms is not None:
-            _, old_importance = task_info.ewc_regularization_terms
+            old_terms = task_info.ewc_regularization_terms
+            _, old_importance = densify_terms(old_terms) if isinstance(old_terms, dict) else old_terms
 
             for name, old_importance_entry in old_importance.items():
                 # see eq. 9 in Progress & Compress
@@ -284,7 +463,60 @@ class EWCMonobeast(Monobeast):
                 else:
                     raise ValueError(f"Unsupported fisher normalization method {self._model_flags.normalize_fisher_method}.")
 
-        task_info.ewc_regularization_terms = (task_params, importance)
+        # Published in one assignment, so the loss sees either the old terms or the new ones
+        task_info.ewc_regularization_terms = self._sparsify_terms(task_params, importance)
+
+        # Nothing samples a consolidated task's replay until the task is seen again. (Online EWC's replay is shared
+        # by all the tasks, so it's kept.)
+        if not online:
+            task_info.release_replay_buffers(discard=self._model_flags.ewc_discard_consolidated_replay)
+
+        consolidation_seconds = time.time() - start_time
+        self.logger.info(f"EWC: consolidated {task_id} in {consolidation_seconds:.2f}s")
+        self._record_consolidation_stat("ewc_consolidation_latency", consolidation_seconds)
+
+    def _sparsify_terms(self, task_params, importance):
+        """
+        If ewc_fisher_top_fraction or ewc_fisher_threshold is set, keep only the largest Fisher entries (and the task
+        parameters at them), and report the approximation error: the fraction of the Fisher's mass dropped, which is
+        the relative error of the task's penalty for a uniform displacement of the parameters.
+        """
+        if self._model_flags.ewc_fisher_top_fraction is None and self._model_flags.ewc_fisher_threshold is None:
+            return task_params, importance
+
+        sparse_terms, kept_fraction, approximation_error = sparsify_terms(
+            task_params, importance, top_fraction=self._model_flags.ewc_fisher_top_fraction,
+            threshold=self._model_flags.ewc_fisher_threshold)
+        self.logger.info(f"EWC: kept {kept_fraction:.4f} of the Fisher entries, "
+                         f"penalty approximation error {approximation_error:.4f}")
+        self._record_consolidation_stat("ewc_fisher_kept_fraction", kept_fraction)
+        self._record_consolidation_stat("ewc_fisher_approximation_error", approximation_error)
+
+        return sparse_terms
+
+    def _compute_fisher_loss(self, task_flags, model, model_fn, batch):
+        """
+        The loss whose gradients are used for the Fisher: pg_loss and baseline_loss, as the signals for importance of
+        parameters (omitting entropy). Monobeast's losses are used explicitly, to make sure they're the right ones
+        (PnC overrides compute_loss).
+        """
+        # NOTE: setting initial_agent_state to an empty tuple, not sure if this is correct?
+        learner_outputs, _ = model_fn(batch, task_flags.action_space_id, ())
+        _, pg_loss, baseline_loss, _ = Monobeast.compute_impala_losses(self, self._model_flags, model, batch,
+                                                                       learner_outputs)
+        return pg_loss + baseline_loss
+
+    def collect_custom_stats(self):
+        stats = super().collect_custom_stats()
+
+        with self._consolidation_stats_lock:
+            for key, values in self._consolidation_stats.items():
+                if len(values) > 0:
+                    stats[key] = np.mean(values)
+
+            self._consolidation_stats = self._create_empty_consolidation_stats()
+
+        return stats
 
     def on_act_unroll_complete(self, task_flags, actor_index, agent_output, env_output, new_buffers):
         if not self._collection_paused:
@@ -293,10 +525,14 @@ class EWCMonobeast(Monobeast):
             # update the tasks's total_steps
             task_info.total_steps += self._model_flags.unroll_length
 
-            # update the task replay buffer
+            # update the task replay buffer, unless it's being consolidated
+            if task_info.replay_frozen[0] == 1:
+                return
+
+            replay_buffers = task_info.get_replay_buffers()
             to_populate_replay_index = task_info.replay_buffer_counters[actor_index] % self._entries_per_buffer
             for key in new_buffers.keys():
-                task_info.replay_buffers[key][actor_index][to_populate_replay_index][...] = new_buffers[key]
+                replay_buffers[key][actor_index, to_populate_replay_index][...] = new_buffers[key]
 
             # should only be getting 1 unroll for any key
             task_info.replay_buffer_counters[actor_index] += 1
@@ -305,27 +541,59 @@ class EWCMonobeast(Monobeast):
         task_lookup_label = "online" if self._model_flags.online_ewc else task_id
         return self._tasks[task_lookup_label]
 
-    def _sample_from_task_replay_buffer(self, task_id, batch_size):
-        task_info = self._get_task(task_id)
-        replay_entry_count = batch_size
-        shuffled_subset = []  # Will contain a list of tuples of (actor_index, buffer_index)
-        random_state = np.random.RandomState()
+    def _get_sampling_thread_state(self):
+        thread_state = self._sampling_thread_state
+        if not hasattr(thread_state, "random_state"):
+            # Using a RandomState per thread because using np.random directly is not thread-safe
+            thread_state.random_state = np.random.RandomState()
+            thread_state.tensors = {}
 
-        # Select a random actor, and from that, a random buffer entry.
-        for _ in range(replay_entry_count):
-            actor_index = random_state.randint(0, self._model_flags.num_actors)
+        return thread_state
 
-            # We may not have anything in this buffer yet, so check for that (randint complains)
-            entries_in_buffer = min(task_info.replay_buffer_counters[actor_index], self._entries_per_buffer)
-            if entries_in_buffer > 0:
-                buffer_index = random_state.randint(0, entries_in_buffer)
-                shuffled_subset.append((actor_index, buffer_index))
+    def _get_preallocated_tensor(self, name, shape, dtype):
+        """
+        Tensors are reused by the thread that requested them, so a batch is only valid until that thread gets its
+        next one.
+        """
+        tensors = self._get_sampling_thread_state().tensors
+        tensor = tensors.get(name, None)
 
-        replay_batch = {
-            # Get the actor_index and entry_id from the raw id
-            key: torch.stack([task_info.replay_buffers[key][actor_id][buffer_id]
-                              for actor_id, buffer_id in shuffled_subset], dim=1) for key in task_info.replay_buffers
-        }
+        if tensor is None or tensor.shape != shape or tensor.dtype != dtype:
+            tensor = torch.empty(shape, dtype=dtype)
+            tensors[name] = tensor
+
+        return tensor
+
+    def _sample_from_task_replay_buffer(self, task_id, batch_size, reuse_batch=False):
+        """
+        Select a random actor, and from that, a random buffer entry, batch_size times. Draws that land on an actor
+        with nothing in its buffer yet are skipped, so the batch may be smaller.
+        All the indices are drawn at once, and each key is gathered with a single indexed read.
+        :param reuse_batch: Gather into tensors preallocated for this thread, rather than new ones. The batch is then
+        only valid until the thread's next reuse_batch sample.
+        :return: {key: [T+1, B, ...]}
+        """
+        task_info = self._get_task(task_id)
+        random_state = self._get_sampling_thread_state().random_state
+
+        actor_indices = random_state.randint(0, self._model_flags.num_actors, size=batch_size)
+        fill_counts = np.minimum(task_info.replay_buffer_counters.numpy(), self._entries_per_buffer)
+        entries_in_buffers = fill_counts[actor_indices]
+
+        # We may not have anything in some buffers yet, so drop those draws
+        actor_indices = actor_indices[entries_in_buffers > 0]
+        entries_in_buffers = entries_in_buffers[entries_in_buffers > 0]
+        buffer_indices = (random_state.random_sample(len(actor_indices)) * entries_in_buffers).astype(np.int64)
+        flat_indices = torch.from_numpy(actor_indices * self._entries_per_buffer + buffer_indices)
+
+        replay_batch = {}
+        for key, buffer in task_info.get_replay_buffers().items():
+            # Viewed as [T+1, num_actors * entries_per_buffer, ...], so the entries are read straight into [T+1, B, ...]
+            entries = buffer.flatten(0, 1).transpose(0, 1)
+            out_shape = (entries.shape[0], len(flat_indices), *entries.shape[2:])
+            out = self._get_preallocated_tensor(key, out_shape, buffer.dtype) if reuse_batch else \
+                torch.empty(out_shape, dtype=buffer.dtype)
+            replay_batch[key] = torch.index_select(entries, 1, flat_indices, out=out)
 
         replay_batch = {
             k: t.to(device=self._model_flags.device, non_blocking=True)
@@ -0,0 +1,180 @@
+import torch
+
+
+def sparsify_terms(task_params, importance, top_fraction=None, threshold=None):
+    """
+    Keep only a task's largest Fisher entries: the top_fraction of them, and/or those at least threshold. Stored as a
+    dict (so it can be saved and loaded like the dense terms) of the parameter names and shapes, and the kept entries'
+    flat indices (over the parameters flattened and concatenated in names order), Fisher values, and task parameter
+    values. The dropped entries are treated as having no importance.
+    :return: (sparse terms, the fraction of entries kept, the fraction of the Fisher's total mass dropped)
+    """
+    names = list(importance.keys())
+    fisher = torch.cat([importance[name].detach().reshape(-1) for name in names])
+    keep = torch.ones_like(fisher, dtype=torch.bool)
+
+    if top_fraction is not None:
+        num_kept = max(int(round(top_fraction * len(fisher))), 1)
+        keep_top = torch.zeros_like(keep)
+        keep_top[torch.topk(fisher, num_kept, sorted=False).indices] = True
+        keep &= keep_top
+
+    if threshold is not None:
+        keep &= fisher >= threshold
+
+    indices = keep.nonzero().squeeze(1)
+    params = torch.cat([task_params[name].detach().reshape(-1) for name in names])
+    total_mass = fisher.sum().item()
+    kept_mass = fisher[indices].sum().item()
+
+    sparse_terms = {"names": names,
+                    "shapes": [list(importance[name].shape) for name in names],
+                    "indices": indices,
+                    "importance": fisher[indices].clone(),
+                    "params": params[indices].clone()}
+    dropped_mass_fraction = 1 - kept_mass / total_mass if total_mass > 0 else 0.0
+
+    return sparse_terms, len(indices) / len(fisher), dropped_mass_fraction
+
+
+def densify_terms(sparse_terms):
+    """
+    :return: (task_params, importance) from sparsify_terms' output, with zeros for the dropped entries
+    """
+    numels = [torch.Size(shape).numel() for shape in sparse_terms["shapes"]]
+    dense_terms = []
+
+    for values in (sparse_terms["params"], sparse_terms["importance"]):
+        flat_values = torch.zeros((sum(numels),), dtype=values.dtype, device=values.device)
+        flat_values[sparse_terms["indices"]] = values
+        split_values = torch.split(flat_values, numels)
+        dense_terms.append({name: split_value.view(shape) for name, shape, split_value in
+                            zip(sparse_terms["names"], sparse_terms["shapes"], split_values)})
+
+    return tuple(dense_terms)
+
+
+class EWCPenalty(object):
+    """
+    The EWC penalty over a set of tasks, scale * sum_t sum_n reduce(F_t,n * (p_n - mean_t,n) ** 2), where reduce is a
+    sum or a mean over each parameter's elements, pre-aggregated over the tasks.
+
+    Per element, sum_t F_t * (p - mean_t) ** 2 == P * (p - anchor) ** 2 + C, with the precision P = sum_t F_t, the
+    anchor = sum_t F_t * mean_t / P, and the constant C = sum_t F_t * mean_t ** 2 - P * anchor ** 2. So however many
+    tasks are included, the penalty is one quadratic over the flattened parameters (with the mean reduction and the
+    scale folded into P and C). If every task's terms are sparse (see sparsify_terms), it's only over the entries any
+    of them kept.
+    """
+
+    def __init__(self, task_terms, use_mean, scale):
+        """
+        :param task_terms: [terms], each either (task_params, importance), each {parameter name: tensor}, or sparse
+        terms from sparsify_terms, for the tasks to include
+        :param use_mean: Whether each parameter's penalty is the mean over its elements (rather than the sum)
+        :param scale: Multiplies the whole penalty
+        """
+        first_terms = task_terms[0]
+        if isinstance(first_terms, dict):
+            self.names = first_terms["names"]
+            numels = [torch.Size(shape).numel() for shape in first_terms["shapes"]]
+            reference = first_terms["importance"]
+        else:
+            self.names = list(first_terms[1].keys())
+            numels = [first_terms[1][name].numel() for name in self.names]
+            reference = first_terms[1][self.names[0]]
+
+        # Aggregated in double precision, since the constant is a difference of sums
+        self.num_elements = sum(numels)
+        precision_sum = torch.zeros((self.num_elements,), dtype=torch.float64, device=reference.device)
+        weighted_mean_sum = torch.zeros_like(precision_sum)
+        weighted_square_sum = torch.zeros_like(precision_sum)
+        included = torch.zeros((self.num_elements,), dtype=torch.bool, device=reference.device)
+
+        for terms in task_terms:
+            if isinstance(terms, dict):
+                indices = terms["indices"]
+                fisher = terms["importance"].double()
+                mean = terms["params"].double()
+            else:
+                task_params, importance = terms
+                indices = slice(None)
+                fisher = self._flatten(importance).double()
+                mean = self._flatten(task_params).double()
+
+            included[indices] = True
+            precision_sum[indices] += fisher
+            weighted_mean_sum[indices] += fisher * mean
+            weighted_square_sum[indices] += fisher * mean ** 2
+
+        anchor = torch.where(precision_sum > 0, weighted_mean_sum / precision_sum.clamp(min=1e-300),
+                             torch.zeros_like(precision_sum))
+        constant = weighted_square_sum - precision_sum * anchor ** 2
+
+        element_weights = torch.full_like(precision_sum, scale)
+        if use_mean:
+            numels_tensor = torch.tensor(numels, device=reference.device)
+            element_weights /= torch.repeat_interleave(numels_tensor, numels_tensor)
+
+        # The entries the penalty is over, or None for all of them
+        self.indices = None if included.all() else included.nonzero().squeeze(1)
+        if self.indices is not None:
+            element_weights = element_weights[self.indices]
+            precision_sum = precision_sum[self.indices]
+            anchor = anchor[self.indices]
+            constant = constant[self.indices]
+
+        self.precision = (element_weights * precision_sum).to(reference.dtype)
+        self.anchor = anchor.to(reference.dtype)
+        self.offset = (element_weights * constant).sum().item()
+
+    def _flatten(self, tensors):
+        return torch.cat([tensors[name].detach().reshape(-1) for name in self.names])
+
+    def flatten_parameters(self, model):
+        """
+        :return: The model's parameters that the penalty is over, flattened
+        """
+        named_parameters = dict(model.named_parameters())
+        flat_parameters = torch.cat([named_parameters[name].reshape(-1) for name in self.names])
+        return flat_parameters if self.indices is None else flat_parameters[self.indices]
+
+    def compute(self, model):
+        """
+        :return: The penalty for the model's current parameters, differentiable with respect to them
+        """
+        return (self.precision * (self.flatten_parameters(model) - self.anchor) ** 2).sum() + self.offset
+
+    @torch.no_grad()
+    def compute_with_gradient(self, model):
+        """
+        The penalty and its gradient, 2 * P * (p - anchor), computed directly, without an autograd graph.
+        :return: (the penalty, as a tensor, the gradient with respect to flatten_parameters(model))
+        """
+        delta = self.flatten_parameters(model) - self.anchor
+        weighted_delta = self.precision * delta
+        penalty = (weighted_delta * delta).sum() + self.offset
+        return penalty, 2 * weighted_delta
+
+    def add_to_grads(self, model, gradient):
+        """
+        Add a gradient with respect to flatten_parameters(model) (e.g. from compute_with_gradient) into the
+        parameters' .grad
+        """
+        if self.indices is not None:
+            flat_gradient = torch.zeros((self.num_elements,), dtype=gradient.dtype, device=gradient.device)
+            flat_gradient[self.indices] = gradient
+        else:
+            flat_gradient = gradient
+
+        named_parameters = dict(model.named_parameters())
+        offset = 0
+
+        for name in self.names:
+            param = named_parameters[name]
+            param_gradient = flat_gradient[offset:offset + param.numel()].view_as(param)
+            offset += param.numel()
+
+            if param.grad is None:
+                param.grad = param_gradient.clone()
+            else:
+                param.grad.add_(param_gradient)
@@ -18,7 +18,18 @@ class EWCPolicyConfig(ImpalaPolicyConfig):
         self.replay_buffer_frames = int(1e6)  # save a buffer per task for computing Fisher estimates
         self.large_file_path = None  # No default, since it can be very large and we want no surprises
 
+        # Delete a task's replay once its Fisher is computed, to free its disk space. If the task is seen again, its
+        # Fisher is then computed from only its new replay.
+        self.ewc_discard_consolidated_replay = False
+
         self.n_fisher_samples = 100  # num of batches to draw to recompute the diagonal of the Fisher
+        # num of those batches whose gradients are computed together (see BatchedFisher). Mostly helps on GPU, at the
+        # cost of that many batches' activations in memory at once
+        self.n_fisher_samples_per_pass = 1
+
+        # Compute the Fisher on a background thread at each task boundary, against a snapshot of the model, while
+        # learning continues on the new task. The penalty uses the new terms once they're complete.
+        self.async_ewc_consolidation = False
 
         self.ewc_lambda = 500  # "tuned choosing from [500, 1000, 1500, 2000, 2500, 3000]? exact value not specified by Progress & Compress"
         self.ewc_per_task_min_frames = int(20e6)  # "EWC penalty is only applied after 20 million frames per game" (from original EWC paper)
@@ -30,9 +41,18 @@ class EWCPolicyConfig(ImpalaPolicyConfig):
 
         self.normalize_fisher_method = None  # if None, then do not normalize
 
+        # Optionally store only the largest Fisher entries per task (and compute the penalty over only those): the top
+        # fraction of them, and/or those at least the threshold. None and None stores the full Fisher.
+        self.ewc_fisher_top_fraction = None
+        self.ewc_fisher_threshold = None
+
         self.scale_ewc_by_num_tasks = True
         self.use_ewc_mean = False  # Default is sum
 
+        # Add the penalty's (analytic) gradient directly to .grad after the backward, instead of backpropagating
+        # through it
+        self.ewc_graph_free_penalty = False
+
         # NOTE:
         # the original EWC paper augments the network with
         # "biases and per element multiplicative gains that were specific to each game."
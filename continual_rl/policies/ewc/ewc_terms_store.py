@@ -0,0 +1,63 @@
+import hashlib
+import io
+import os
+import torch
+
+
+class EWCTermsStore(object):
+    """
+    Stores regularization terms in content-addressed files (named by the hash of their contents) in a directory, so
+    terms are written once, when they're created, rather than on every save. A save then only needs to record which
+    file each task's terms are in.
+
+    Terms are expected to be replaced, never modified, so the file for a given terms object is remembered by identity,
+    and it isn't re-serialized to be saved again.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._file_names = {}  # id(terms): (terms, file name). The terms are held so the id isn't reused.
+
+    def put(self, terms):
+        """
+        :return: The name of the file the terms are stored in, writing it if it doesn't exist yet
+        """
+        cached = self._file_names.get(id(terms), None)
+        if cached is not None and os.path.exists(os.path.join(self._directory, cached[1])):
+            return cached[1]
+
+        terms_bytes = io.BytesIO()
+        torch.save(terms, terms_bytes)
+        terms_bytes = terms_bytes.getvalue()
+        file_name = f"{hashlib.sha256(terms_bytes).hexdigest()}.tar"
+        file_path = os.path.join(self._directory, file_name)
+
+        if not os.path.exists(file_path):
+            os.makedirs(self._directory, exist_ok=True)
+
+            # Written to a temporary file and renamed into place, so a partially written file is never picked up
+            temp_path = f"{file_path}.partial"
+            with open(temp_path, "wb") as terms_file:
+                terms_file.write(terms_bytes)
+            os.replace(temp_path, file_path)
+
+        self._file_names[id(terms)] = (terms, file_name)
+        return file_name
+
+    def get(self, file_name):
+        terms = torch.load(os.path.join(self._directory, file_name))
+        self._file_names[id(terms)] = (terms, file_name)
+        return terms
+
+    def remove_unreferenced(self, referenced_file_names):
+        """
+        Delete the stored files not in referenced_file_names, and forget terms no longer in them
+        """
+        referenced_file_names = set(referenced_file_names)
+        self._file_names = {terms_id: entry for terms_id, entry in self._file_names.items()
+                            if entry[1] in referenced_file_names}
+
+        if os.path.exists(self._directory):
+            for file_name in os.listdir(self._directory):
+                if file_name not in referenced_file_names:
+                    os.remove(os.path.join(self._directory, file_name))
@@ -0,0 +1,95 @@
+"""
+Int8 inference copies of the IMPALA nets, for use by the actors (which only ever run forward passes, on CPU).
+"""
+import copy
+import timeit
+import torch
+import torch.nn as nn
+from continual_rl.utils.common_nets import CommonConv, ResidualBlock
+
+
+class UnsupportedQuantizationException(Exception):
+    pass
+
+
+def _create_static_quantized_conv(conv_net, calibration_frames, backend):
+    """
+    Statically quantize the convolutional trunk (conv_net is the Sequential inside a CommonConv), calibrating the
+    activation ranges on the given (already normalized) frames.
+    """
+    # Eager-mode static quantization can't handle the residual adds (they'd need FloatFunctional), so only the plain
+    # conv stacks are supported
+    if any(isinstance(module, ResidualBlock) for module in conv_net.modules()):
+        raise UnsupportedQuantizationException("Static quantization does not support residual conv architectures.")
+
+    quantized_conv = nn.Sequential(torch.quantization.QuantStub(), conv_net, torch.quantization.DeQuantStub())
+    quantized_conv.eval()
+    quantized_conv.qconfig = torch.quantization.get_default_qconfig(backend)
+    torch.quantization.prepare(quantized_conv, inplace=True)
+
+    with torch.no_grad():
+        quantized_conv(calibration_frames)
+
+    torch.quantization.convert(quantized_conv, inplace=True)
+    return quantized_conv
+
+
+def create_quantized_actor_model(model, mode, calibration_inputs=None, backend="fbgemm"):
+    """
+    Create an int8 copy of an ImpalaNet for inference. The original model is not modified.
+    :param mode: "dynamic" quantizes the Linear layers (weights in int8, activations quantized on the fly).
+    "static" additionally quantizes the conv layers, with activation ranges calibrated on calibration_inputs.
+    :param calibration_inputs: A dict in the format of the model's input (at least "frame"), required for "static"
+    :return: The quantized copy, in the same train/eval mode as the original (so action sampling is unchanged)
+    """
+    if mode not in ("dynamic", "static"):
+        raise UnsupportedQuantizationException(f"Unknown actor quantization mode {mode}")
+
+    # Other models whose Linear layers can be swapped for quantized ones (i.e. that call them as modules, with no
+    # hooks on them) can opt in to dynamic quantization
+    if getattr(model, "supports_dynamic_quantization", False):
+        if mode != "dynamic":
+            raise UnsupportedQuantizationException(f"Only dynamic quantization is supported for model type "
+                                                   f"{type(model)}")
+    elif not isinstance(getattr(model, "_conv_net", None), CommonConv):
+        raise UnsupportedQuantizationException(f"Quantization is not supported for model type {type(model)}")
+
+    torch.backends.quantized.engine = backend
+    quantized_model = copy.deepcopy(model)
+
+    if mode == "static":
+        assert calibration_inputs is not None, "Static quantization requires calibration inputs"
+
+        # The same preprocessing as in ImpalaNet.forward, so the calibration sees what the conv sees
+        frames = model.preprocess_frames(calibration_inputs)
+
+        common_conv = quantized_model._conv_net
+        common_conv._conv_net = _create_static_quantized_conv(common_conv._conv_net, frames, backend)
+
+    quantized_model = torch.quantization.quantize_dynamic(quantized_model, {nn.Linear}, dtype=torch.qint8)
+    quantized_model.train(model.training)
+
+    return quantized_model
+
+
+def compare_actor_models(reference_model, quantized_model, inputs, action_space_id):
+    """
+    Compare the quantized model against the fp32 reference on the same inputs.
+    :return: A dict with the fraction of greedy (argmax) actions that agree, and the forward time of each model
+    """
+    with torch.no_grad():
+        start_time = timeit.default_timer()
+        reference_output, _ = reference_model(inputs, action_space_id)
+        reference_time = timeit.default_timer() - start_time
+
+        start_time = timeit.default_timer()
+        quantized_output, _ = quantized_model(inputs, action_space_id)
+        quantized_time = timeit.default_timer() - start_time
+
+    reference_actions = reference_output["policy_logits"].argmax(dim=-1)
+    quantized_actions = quantized_output["policy_logits"].argmax(dim=-1)
+    agreement = (reference_actions == quantized_actions).float().mean().item()
+
+    return {"action_agreement": agreement,
+            "reference_forward_seconds": reference_time,
+            "quantized_forward_seconds": quantized_time}
@@ -118,7 +118,9 @@ class ImpalaEnvironmentRunner(EnvironmentRunnerBase):
             rewards_to_report = stats.get("episode_returns", [])
 
             for key in stats.keys():
-                if key.endswith("loss") or key == "total_norm":
+                if key.endswith("loss") or key.endswith("_latency") or key.startswith("quantized_") or \
+                        key.startswith("actor_") or key.startswith("replay_") or key.startswith("ewc_") or \
+                        key == "total_norm":
                     logs_to_report.append({"type": "scalar", "tag": key, "value": stats[key]})
 
             if "video" in stats and stats["video"] is not None:
@@ -54,3 +54,6 @@ class ImpalaPolicy(PolicyBase):
 
     def load(self, output_path_dir):
         self.impala_trainer.load(output_path_dir)
+
+    def shutdown(self):
+        self.impala_trainer.shutdown()
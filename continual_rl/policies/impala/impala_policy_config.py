@@ -34,6 +34,35 @@ class ImpalaPolicyConfig(ConfigBase):
         self.baseline_extended_arch = False
         self.baseline_includes_uncertainty = False
 
+        # Remote actors connect to the learner over a socket instead of being forked from it (see remote_actor.py).
+        # They take the last num_remote_actors of the num_actors actor indices.
+        self.num_remote_actors = 0
+        self.remote_actor_address = None  # "host:port" or "unix:/path/to/socket"
+        self.remote_actor_authkey = None  # Required if using remote actors; remote actors must use the same key
+        self.remote_actor_compression_level = 1  # zlib level used for unrolls and weights sent over the socket
+
+        # Actors run an int8 copy of the model: "dynamic" (Linear layers) or "static" (also convs, calibrated on recent
+        # observations). None means the actors use the fp32 model directly.
+        self.actor_quantization = None
+        self.actor_quantization_backend = "fbgemm"  # "qnnpack" on ARM
+        self.actor_requantize_interval_seconds = 10.0  # The least time between an actor's rebuilds of its int8 copy
+        self.actor_quantization_compare_interval = 10  # Actor 0 compares int8 vs fp32 every this many rebuilds
+
+        # Intra-op threads for the learner and for each actor (actors are many, so they default to one each). Each may
+        # be pinned to a list of CPU ids, or to the CPUs of a NUMA node (the list takes precedence). Actors get
+        # actor_num_threads consecutive CPUs each from theirs, round-robin. Pinning is Linux-only.
+        self.learner_num_threads = 1
+        self.actor_num_threads = 1
+        self.learner_cpus = []
+        self.actor_cpus = []
+        self.learner_numa_node = None
+        self.actor_numa_node = None
+
+        # Simulator libraries (e.g. "ale_py", "procgen", "nle") imported once, before any workers are forked
+        self.env_preload_modules = []
+        self.use_env_fork_server = False  # Fork test episode workers from a small, preloaded server process
+        self.warm_env_template = False  # Build each task's env once, and give each forked worker a copy of it
+
         # Does not call eval() on the policy before evaluation,
         # use when you want the same policy to run on the environment in eval as it does in test.
         self.no_eval_mode = False
@@ -64,19 +64,9 @@ class ImpalaNet(nn.Module):
         return tuple()
 
     def forward(self, inputs, action_space_id, core_state=()):
-        x = inputs["frame"]  # [T, B, S, C, H, W]. T=timesteps in collection, S=stacked frames
-        T, B, *_ = x.shape
-        x = torch.flatten(x, 0, 1)  # Merge time and batch.
-        x = torch.flatten(x, 1, 2)  # Merge stacked frames and channels.
-        x = x.float() / self._observation_space.high.max()
-        x = self._conv_net(x)
-        x = F.relu(x)
-
-        one_hot_last_action = F.one_hot(
-            inputs["last_action"].view(T * B), self.num_actions
-        ).float()
-        clipped_reward = torch.clamp(inputs["reward"], -1, 1).view(T * B, 1).float()
-        core_input = torch.cat([x, clipped_reward, one_hot_last_action], dim=-1)
+        T, B, *_ = inputs["frame"].shape  # [T, B, S, C, H, W]. T=timesteps in collection, S=stacked frames
+        x = self._conv_net(self.preprocess_frames(inputs))
+        core_input = self.create_core_input(x, inputs)
 
         if self.use_lstm:
             core_input = core_input.view(T, B, -1)
@@ -98,6 +88,39 @@ class ImpalaNet(nn.Module):
         policy_logits = self.policy(core_output)
         baseline = self.baseline(core_output)
 
+        return (
+            self.create_output_dict(policy_logits, baseline, action_space_id, T, B),
+            core_state,
+        )
+
+    def preprocess_frames(self, inputs):
+        """
+        :return: The frames as the conv net takes them: [T * B, S * C, H, W], normalized
+        """
+        x = inputs["frame"]
+        x = torch.flatten(x, 0, 1)  # Merge time and batch.
+        x = torch.flatten(x, 1, 2)  # Merge stacked frames and channels.
+        return x.float() / self._observation_space.high.max()
+
+    def create_core_input(self, x, inputs):
+        """
+        :param x: The conv net's output
+        :return: [T * B, core input size]: x, the clipped reward, and the one-hot last action
+        """
+        x = F.relu(x)
+        T, B = inputs["reward"].shape[:2]
+
+        # Equivalent to F.one_hot, but without its data-dependent range check, so it works under torch.func.vmap
+        one_hot_last_action = (
+            inputs["last_action"].view(T * B, 1) == torch.arange(self.num_actions, device=x.device)
+        ).float()
+        clipped_reward = torch.clamp(inputs["reward"], -1, 1).view(T * B, 1).float()
+        return torch.cat([x, clipped_reward, one_hot_last_action], dim=-1)
+
+    def create_output_dict(self, policy_logits, baseline, action_space_id, T, B):
+        """
+        :return: The policy logits, baseline, and action (sampled if training, otherwise greedy), each [T, B, ...]
+        """
         # Used to select the action appropriate for this task (might be from a reduced set)
         current_action_size = self._action_spaces[action_space_id].n
         policy_logits_subset = policy_logits[:, :current_action_size]
@@ -117,10 +140,7 @@ class ImpalaNet(nn.Module):
         if self._model_flags.baseline_includes_uncertainty:
             output_dict["uncertainty"] = baseline[:, :, 1]
 
-        return (
-            output_dict,
-            core_state,
-        )
+        return output_dict
 
     # from https://github.com/MiniHackPlanet/MiniHack/blob/e124ae4c98936d0c0b3135bf5f202039d9074508/minihack/agent/polybeast/models/base.py#L67
     @torch.no_grad()
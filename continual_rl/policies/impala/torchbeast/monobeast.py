@@ -41,7 +41,12 @@ from torch.nn import functional as F
 from continual_rl.policies.impala.torchbeast.core import environment
 from continual_rl.policies.impala.torchbeast.core import prof
 from continual_rl.policies.impala.torchbeast.core import vtrace
+from continual_rl.policies.impala.torchbeast.remote_actor import RemoteActorServer
+from continual_rl.policies.impala.actor_quantization import create_quantized_actor_model, compare_actor_models
 from continual_rl.utils.utils import Utils
+from continual_rl.utils import env_fork_server
+from continual_rl.utils import cpu_layout
+from continual_rl.utils.env_fork_server import EnvForkServer
 
 
 Buffers = typing.Dict[str, typing.List[torch.Tensor]]
@@ -52,27 +57,63 @@ class LearnerThreadState():
 
     def __init__(self):
         """
-        This class is a helper class to manage communication of state between threads. For now I'm assuming just
-        setting state is atomic enough to not require further thread safety.
+        This class is a helper class to manage communication of state between threads. All state changes go through
+        a condition variable, so anyone waiting on a state is woken as soon as it is reached (rather than polling).
+        The time each state was entered is recorded, so the latency of transitions can be reported.
         """
-        self.state = self.STARTING
-        self.lock = threading.Lock()
+        self._state = self.STARTING
+        self._state_entered_times = {self.STARTING: time.monotonic()}
 
-    def wait_for(self, desired_state_list, timeout=300):
-        time_passed = 0
-        delta = 0.1  # seconds
+        # Re-entrant so the owner of the lock can still set the state (which notifies under the same lock)
+        self.lock = threading.Condition(threading.RLock())
+
+    @property
+    def state(self):
+        return self._state
 
-        while self.state not in desired_state_list and time_passed < timeout:
-            time.sleep(delta)
-            time_passed += delta
+    @state.setter
+    def state(self, new_state):
+        with self.lock:
+            if new_state != self._state:
+                self._state = new_state
+                self._state_entered_times[new_state] = time.monotonic()
+                self.lock.notify_all()
+
+    def wait_for(self, desired_state_list, timeout=300):
+        with self.lock:
+            reached = self.lock.wait_for(lambda: self._state in desired_state_list, timeout=timeout)
 
-        if time_passed > timeout:
+        if not reached:
             print(f"Gave up on waiting due to timeout. Desired list: {desired_state_list}, current state: {self.state}")  # TODO: not print
 
+        return reached
+
+    def get_transition_latency(self, from_state, to_state):
+        """
+        The time (in seconds) between most recently entering from_state and most recently entering to_state, or None if
+        either has not happened (or they happened out of order).
+        """
+        from_time = self._state_entered_times.get(from_state, None)
+        to_time = self._state_entered_times.get(to_state, None)
+
+        if from_time is None or to_time is None or to_time < from_time:
+            return None
+
+        return to_time - from_time
+
 
 class Monobeast():
     def __init__(self, model_flags, observation_space, action_spaces, policy_class):
         self._model_flags = model_flags
+        self._env_fork_server = None  # Started in setup, if requested
+        self._learner_cpus = None  # CPU pinning, resolved in setup. None means unpinned
+        self._actor_cpus = None
+        self._unpinned_cpus = None
+
+        # Kept so remote actors can construct their own copies of the model
+        self._observation_space = observation_space
+        self._action_spaces = action_spaces
+        self._policy_class = policy_class
 
         # The latest full episode's set of observations generated by actor with actor_index == 0
         self._videos_to_log = py_mp.Manager().Queue(maxsize=1)
@@ -101,6 +142,24 @@ class Monobeast():
         self.free_queue = None
         self.full_queue = None
 
+        # Incremented every time the learner publishes new weights to the actor_model, so actors that keep their own
+        # copy of the weights (e.g. remote actors) know when to refresh
+        self._actor_model_version = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self._remote_actor_server = None
+
+        # Actor 0 occasionally compares its quantized model (if any) to the fp32 one when it rebuilds, accumulating:
+        # (action agreement, fp32 forward seconds, quantized forward seconds, count)
+        self._actor_quantization_stats = torch.zeros(4, dtype=torch.float64).share_memory_()
+
+        # Each actor accumulates its own row: (env steps, seconds spent producing them, of which rebuilding the model)
+        self._actor_throughput_stats = torch.zeros((model_flags.num_actors, 3), dtype=torch.float64).share_memory_()
+
+        # Set to wake the train loop before seconds_between_yields has elapsed
+        self._train_loop_wakeup = threading.Event()
+
+        # Latencies (in seconds) of learner and actor state transitions, reported with the next set of stats
+        self._transition_latencies = {}
+
         # Pillow sometimes pollutes the logs, see: https://github.com/python-pillow/Pillow/issues/5096
         logging.getLogger("PIL.PngImagePlugin").setLevel(logging.CRITICAL + 1)
 
@@ -119,21 +178,41 @@ class Monobeast():
         """
         return batch
 
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs, replay_mask):
         """
         Create a new loss. This is added to the existing losses before backprop. Any returned stats will be added
         to the logged stats. If a stat's key ends in "_loss", it'll automatically be plotted as well.
         This is run in each learner thread.
+        The batch and the learner_outputs (the model's outputs for the batch) are the full [T+1, B] versions, before
+        they're shifted for vtrace. replay_mask is a [B] mask of the entries get_batch_for_training marked (in
+        batch["replay_mask"]) as replayed, or None if there are none.
         :return: (loss, dict of stats)
         """
         return 0, {}
 
+    def custom_gradients(self, task_flags, model):
+        """
+        Add gradients directly to the parameters' .grad, for terms whose gradients are known analytically, so they
+        needn't go through autograd. Called after the loss's backward, before the gradients are clipped. This is run
+        in each learner thread (one learning step at a time).
+        """
+        pass
+
+    def collect_custom_stats(self):
+        """
+        Stats that aren't tied to a single learning step, such as counters. Called (from the train loop) each time
+        stats are returned; anything accumulated should be reset.
+        :return: dict of stats
+        """
+        return {}
+
     def permanent_delete(self):
         pass
 
     # Core Monobeast functionality
     def setup(self, model_flags, observation_space, action_spaces, policy_class):
-        os.environ["OMP_NUM_THREADS"] = "1"
+        # Inherited by anything started from this process. The learner's own budget is set below, via torch.
+        os.environ["OMP_NUM_THREADS"] = str(model_flags.actor_num_threads)
         logging.basicConfig(
             format=(
                 "[%(levelname)s:%(process)d %(module)s:%(lineno)d %(asctime)s] " "%(message)s"
@@ -146,12 +225,36 @@ class Monobeast():
 
         checkpointpath = os.path.join(model_flags.savedir, "model.tar")
 
+        # Started before the models (and any threads) exist, so the workers it forks start small
+        if model_flags.use_env_fork_server:
+            self._env_fork_server = EnvForkServer(preload_modules=model_flags.env_preload_modules, logger=logger)
+            self._env_fork_server.start()
+
+        # The actors are forked from this process, so they inherit anything imported here
+        if len(model_flags.env_preload_modules) > 0:
+            import_seconds = env_fork_server.preload_modules(model_flags.env_preload_modules)
+            logger.info(f"Preloaded env modules (seconds): {import_seconds}")
+
+        # Forked processes inherit the learner's affinity, so keep the original around for those that aren't pinned
+        self._unpinned_cpus = cpu_layout.get_available_cpus()
+        self._learner_cpus = cpu_layout.resolve_cpus(model_flags.learner_cpus, model_flags.learner_numa_node)
+        self._actor_cpus = cpu_layout.resolve_cpus(model_flags.actor_cpus, model_flags.actor_numa_node)
+        cpu_layout.apply_thread_budget(model_flags.learner_num_threads, self._learner_cpus)
+        self._report_thread_layout(model_flags, logger)
+
         if model_flags.num_buffers is None:  # Set sensible default for num_buffers.
             model_flags.num_buffers = max(2 * model_flags.num_actors, model_flags.batch_size)
         if model_flags.num_actors >= model_flags.num_buffers:
             raise ValueError("num_buffers should be larger than num_actors")
         if model_flags.num_buffers < model_flags.batch_size:
             raise ValueError("num_buffers should be larger than batch_size")
+        if model_flags.actor_quantization not in (None, "dynamic", "static"):
+            raise ValueError(f"Unsupported actor_quantization {model_flags.actor_quantization}")
+        if model_flags.num_remote_actors > model_flags.num_actors:
+            raise ValueError("num_remote_actors should be no larger than num_actors")
+        if model_flags.num_remote_actors > 0 and (model_flags.remote_actor_address is None or
+                                                  model_flags.remote_actor_authkey is None):
+            raise ValueError("remote_actor_address and remote_actor_authkey must be set to use remote actors")
 
         # Convert the device string into an actual device
         model_flags.device = torch.device(model_flags.device)
@@ -200,6 +303,46 @@ class Monobeast():
         cross_entropy = cross_entropy.view_as(advantages)
         return torch.sum(cross_entropy * advantages.detach())
 
+    @staticmethod
+    def run_unroll(model_flags, task_flags, model, env, env_output, agent_output, agent_state, unroll_buffers,
+                   timings, on_step=None):
+        """
+        Run one unroll of the environment, writing the results into unroll_buffers (a dict of key -> [T + 1, ...]
+        tensors). The first row is the end of the previous unroll. Shared by the forked actors and the remote actors.
+        :param on_step: Optional callable that gets the env_output after each step (e.g. for video capture)
+        :return: The final (env_output, agent_output, agent_state), to be passed into the next unroll
+        """
+        # Write old rollout end.
+        for key in env_output:
+            unroll_buffers[key][0, ...] = env_output[key]
+        for key in agent_output:
+            unroll_buffers[key][0, ...] = agent_output[key]
+
+        # Do new rollout.
+        for t in range(model_flags.unroll_length):
+            timings.reset()
+
+            with torch.no_grad():
+                agent_output, agent_state = model(env_output, task_flags.action_space_id, agent_state)
+
+            timings.time("model")
+
+            env_output = env.step(agent_output["action"])
+
+            timings.time("step")
+
+            for key in env_output:
+                unroll_buffers[key][t + 1, ...] = env_output[key]
+            for key in agent_output:
+                unroll_buffers[key][t + 1, ...] = agent_output[key]
+
+            if on_step is not None:
+                on_step(env_output)
+
+            timings.time("write")
+
+        return env_output, agent_output, agent_state
+
     def act(
             self,
             model_flags,
@@ -214,14 +357,35 @@ class Monobeast():
         env = None
         try:
             self.logger.info("Actor %i started.", actor_index)
+            cpu_layout.apply_thread_budget(*self._get_actor_thread_budget(model_flags, actor_index))
             timings = prof.Timings()  # Keep track of how fast things are.
 
-            gym_env, seed = Utils.make_env(task_flags.env_spec, create_seed=True)
+            gym_env, seed = env_fork_server.make_env(task_flags.env_spec, template_key=task_flags.task_id,
+                                                     create_seed=True)
             self.logger.info(f"Environment and libraries setup with seed {seed}")
 
             # Parameters involved in rendering behavior video
             observations_to_render = []  # Only populated by actor 0
 
+            def save_video_step(step_env_output):
+                if step_env_output['done'].squeeze():
+                    # If we have a video in there, replace it with this new one
+                    try:
+                        self._videos_to_log.get(timeout=1)
+                    except queue.Empty:
+                        pass
+                    except (FileNotFoundError, ConnectionRefusedError, ConnectionResetError, RuntimeError) as e:
+                        # Sometimes it seems like the videos_to_log socket fails. Since video logging is not
+                        # mission-critical, just let it go.
+                        self.logger.warning(
+                            f"Video logging socket seems to have failed with error {e}. Aborting video log.")
+                        pass
+
+                    self._videos_to_log.put(copy.deepcopy(observations_to_render))
+                    observations_to_render.clear()
+
+                observations_to_render.append(step_env_output['frame'].squeeze(0).squeeze(0)[-1])
+
             env = environment.Environment(gym_env)
             env_output = env.initial()
             agent_state = model.initial_state(batch_size=1)
@@ -233,63 +397,55 @@ class Monobeast():
 
             signal.signal(signal.SIGTERM, end_task)
 
+            # Actors only run forward passes, so they may use an int8 copy of the model. The learner publishes new
+            # weights every step, so it's rebuilt at most every actor_requantize_interval_seconds (a deepcopy and
+            # quantization, and for static, calibration on the actor's most recent observations).
+            inference_model = model
+            inference_model_version = None
+            last_rebuild_time = None
+            num_rebuilds = 0
+            calibration_inputs = env_output
+
             while True:
                 index = free_queue.get()
                 if index is None:
                     break
 
-                # Write old rollout end.
-                for key in env_output:
-                    buffers[key][index][0, ...] = env_output[key]
-                for key in agent_output:
-                    buffers[key][index][0, ...] = agent_output[key]
-                for i, tensor in enumerate(agent_state):
-                    initial_agent_state_buffers[index][i][...] = tensor
-
-                # Do new rollout.
-                for t in range(model_flags.unroll_length):
-                    timings.reset()
-
-                    with torch.no_grad():
-                        agent_output, agent_state = model(env_output, task_flags.action_space_id, agent_state)
-
-                    timings.time("model")
-
-                    env_output = env.step(agent_output["action"])
+                unroll_start_time = timeit.default_timer()
+                rebuild_seconds = 0
 
-                    timings.time("step")
+                if model_flags.actor_quantization is not None and \
+                        inference_model_version != self._actor_model_version.item() and \
+                        (last_rebuild_time is None or
+                         unroll_start_time - last_rebuild_time >= model_flags.actor_requantize_interval_seconds):
+                    inference_model_version = self._actor_model_version.item()
+                    compare = actor_index == 0 and num_rebuilds % model_flags.actor_quantization_compare_interval == 0
+                    inference_model = self._create_actor_inference_model(
+                        model_flags, task_flags, model, calibration_inputs, compare)
+                    timings.time("quantize")
 
-                    for key in env_output:
-                        buffers[key][index][t + 1, ...] = env_output[key]
-                    for key in agent_output:
-                        buffers[key][index][t + 1, ...] = agent_output[key]
+                    last_rebuild_time = timeit.default_timer()
+                    rebuild_seconds = last_rebuild_time - unroll_start_time
+                    num_rebuilds += 1
 
-                    # Save off video if appropriate
-                    if actor_index == 0:
-                        if env_output['done'].squeeze():
-                            # If we have a video in there, replace it with this new one
-                            try:
-                                self._videos_to_log.get(timeout=1)
-                            except queue.Empty:
-                                pass
-                            except (FileNotFoundError, ConnectionRefusedError, ConnectionResetError, RuntimeError) as e:
-                                # Sometimes it seems like the videos_to_log socket fails. Since video logging is not
-                                # mission-critical, just let it go.
-                                self.logger.warning(
-                                    f"Video logging socket seems to have failed with error {e}. Aborting video log.")
-                                pass
-
-                            self._videos_to_log.put(copy.deepcopy(observations_to_render))
-                            observations_to_render.clear()
+                for i, tensor in enumerate(agent_state):
+                    initial_agent_state_buffers[index][i][...] = tensor
 
-                        observations_to_render.append(env_output['frame'].squeeze(0).squeeze(0)[-1])
+                new_buffers = {key: buffers[key][index] for key in buffers.keys()}
+                env_output, agent_output, agent_state = self.run_unroll(
+                    model_flags, task_flags, inference_model, env, env_output, agent_output, agent_state, new_buffers,
+                    timings, on_step=save_video_step if actor_index == 0 else None)
 
-                    timings.time("write")
+                # Add the batch dimension back in, so it's in the format the model expects
+                calibration_inputs = {key: tensor.unsqueeze(1) for key, tensor in new_buffers.items()}
 
-                new_buffers = {key: buffers[key][index] for key in buffers.keys()}
                 self.on_act_unroll_complete(task_flags, actor_index, agent_output, env_output, new_buffers)
                 full_queue.put(index)
 
+                self._actor_throughput_stats[actor_index] += torch.tensor(
+                    [model_flags.unroll_length, timeit.default_timer() - unroll_start_time, rebuild_seconds],
+                    dtype=torch.float64)
+
             if actor_index == 0:
                 self.logger.info("Actor %i: %s", actor_index, timings.summary())
 
@@ -305,6 +461,82 @@ class Monobeast():
             if env is not None:
                 env.close()
 
+    def _create_actor_inference_model(self, model_flags, task_flags, model, calibration_inputs, compare):
+        """
+        :param compare: Also measure the quantized model against the fp32 one, which costs an extra forward pass of
+        each, so only done occasionally, by one actor
+        """
+        inference_model = create_quantized_actor_model(model, model_flags.actor_quantization,
+                                                       calibration_inputs=calibration_inputs,
+                                                       backend=model_flags.actor_quantization_backend)
+
+        if compare:
+            comparison = compare_actor_models(model, inference_model, calibration_inputs, task_flags.action_space_id)
+            self._actor_quantization_stats += torch.tensor([comparison["action_agreement"],
+                                                            comparison["reference_forward_seconds"],
+                                                            comparison["quantized_forward_seconds"],
+                                                            1], dtype=torch.float64)
+
+        return inference_model
+
+    def _collect_actor_quantization_stats(self):
+        agreement_sum, reference_seconds, quantized_seconds, count = self._actor_quantization_stats.tolist()
+        self._actor_quantization_stats.zero_()
+
+        stats = {}
+        if count > 0:
+            stats["quantized_action_agreement"] = agreement_sum / count
+            stats["quantized_forward_speedup"] = reference_seconds / max(quantized_seconds, 1e-12)
+
+        return stats
+
+    def _collect_actor_throughput_stats(self):
+        """
+        The steps per second of one actor while it's producing unrolls (not while it waits for a free buffer),
+        including the time spent rebuilding its quantized model, if any. Compare against a run without quantization
+        to see whether it pays off.
+        """
+        steps, seconds, rebuild_seconds = self._actor_throughput_stats.sum(dim=0).tolist()
+        self._actor_throughput_stats.zero_()
+
+        stats = {}
+        if seconds > 0:
+            stats["actor_steps_per_second"] = steps / seconds
+
+            if self._model_flags.actor_quantization is not None:
+                stats["quantized_rebuild_time_fraction"] = rebuild_seconds / seconds
+
+        return stats
+
+    def _get_actor_thread_budget(self, model_flags, actor_index):
+        """
+        :return: (number of threads, CPUs to pin to, or None to leave the affinity alone)
+        """
+        if self._actor_cpus is not None:
+            actor_cpus = cpu_layout.get_actor_cpus(self._actor_cpus, actor_index, model_flags.actor_num_threads)
+        elif self._learner_cpus is not None:
+            actor_cpus = self._unpinned_cpus  # Don't let the actors crowd onto the learner's CPUs
+        else:
+            actor_cpus = None
+
+        return model_flags.actor_num_threads, actor_cpus
+
+    def _report_thread_layout(self, model_flags, logger):
+        layout = [f"{len(self._unpinned_cpus)} CPUs available across {cpu_layout.get_num_numa_nodes()} NUMA node(s)",
+                  f"Learner: {model_flags.learner_num_threads} threads on CPUs {self._learner_cpus or 'unpinned'}"]
+
+        num_local_actors = model_flags.num_actors - model_flags.num_remote_actors
+        for actor_index in range(num_local_actors):
+            num_threads, actor_cpus = self._get_actor_thread_budget(model_flags, actor_index)
+            layout.append(f"Actor {actor_index}: {num_threads} threads on CPUs {actor_cpus or 'unpinned'}")
+
+        logger.info("Thread layout:\n" + "\n".join(layout))
+
+        num_threads_requested = model_flags.learner_num_threads + num_local_actors * model_flags.actor_num_threads
+        if num_threads_requested > len(self._unpinned_cpus):
+            logger.warning(f"{num_threads_requested} threads requested for {len(self._unpinned_cpus)} CPUs. "
+                           f"The learner and actors will contend.")
+
     def get_batch(
             self,
             flags,
@@ -338,11 +570,12 @@ class Monobeast():
         timings.time("device")
         return batch, initial_agent_state
 
-    def compute_loss(self, model_flags, task_flags, learner_model, batch, initial_agent_state, with_custom_loss=True):
-        # Note the action_space_id isn't really used - it's used to generate an action, but we use the action that
-        # was already computed and executed
-        learner_outputs, unused_state = learner_model(batch, task_flags.action_space_id, initial_agent_state)
-
+    def compute_impala_losses(self, model_flags, learner_model, batch, learner_outputs):
+        """
+        The standard IMPALA losses, given the learner's outputs on the (full, [T+1, B, ...]) batch. Kept free of
+        side-channel outputs (e.g. .item()) so it can also be run under torch.func transforms.
+        :return: (vtrace_returns, pg_loss, baseline_loss, entropy_loss)
+        """
         # Take final value function slice for bootstrapping.
         bootstrap_value = learner_outputs["baseline"][-1]
 
@@ -386,6 +619,15 @@ class Monobeast():
             learner_outputs["policy_logits"]
         )
 
+        return vtrace_returns, pg_loss, baseline_loss, entropy_loss
+
+    def compute_loss(self, model_flags, task_flags, learner_model, batch, initial_agent_state, with_custom_loss=True):
+        # Note the action_space_id isn't really used - it's used to generate an action, but we use the action that
+        # was already computed and executed
+        learner_outputs, unused_state = learner_model(batch, task_flags.action_space_id, initial_agent_state)
+        vtrace_returns, pg_loss, baseline_loss, entropy_loss = self.compute_impala_losses(
+            model_flags, learner_model, batch, learner_outputs)
+
         total_loss = pg_loss + baseline_loss + entropy_loss
         stats = {
             "pg_loss": pg_loss.item(),
@@ -395,7 +637,9 @@ class Monobeast():
         }
 
         if with_custom_loss: # auxilary terms for continual learning
-            custom_loss, custom_stats = self.custom_loss(task_flags, learner_model, initial_agent_state, batch, vtrace_returns)
+            replay_mask = batch["replay_mask"][0] if "replay_mask" in batch else None
+            custom_loss, custom_stats = self.custom_loss(task_flags, learner_model, initial_agent_state, batch,
+                                                         vtrace_returns, learner_outputs, replay_mask)
             total_loss += custom_loss
             stats.update(custom_stats)
 
@@ -435,6 +679,7 @@ class Monobeast():
 
             optimizer.zero_grad()
             total_loss.backward()
+            self.custom_gradients(task_flags, learner_model)
 
             norm = nn.utils.clip_grad_norm_(learner_model.parameters(), model_flags.grad_norm_clipping)
             stats["total_norm"] = norm.item()
@@ -443,6 +688,7 @@ class Monobeast():
             if scheduler is not None:
                 scheduler.step()
             actor_model.load_state_dict(learner_model.state_dict())
+            self._actor_model_version += 1
             return stats
 
     def create_buffer_specs(self, unroll_length, obs_shape, num_actions):
@@ -469,6 +715,22 @@ class Monobeast():
                 buffers[key].append(torch.empty(**specs[key]).share_memory_())
         return buffers
 
+    def _stop_learner_threads(self, threads, learner_thread_states):
+        """
+        Request that each running learner thread stop, then wait for them. All stops are requested before waiting, so
+        they happen concurrently.
+        """
+        self.logger.info("Stopping learners")
+        states_to_wait_for = []
+        for thread, thread_state in zip(threads, learner_thread_states):
+            with thread_state.lock:
+                if thread_state.state != LearnerThreadState.STOPPED and thread.is_alive():
+                    thread_state.state = LearnerThreadState.STOP_REQUESTED
+                    states_to_wait_for.append(thread_state)
+
+        for thread_state in states_to_wait_for:
+            thread_state.wait_for([LearnerThreadState.STOPPED], timeout=30)
+
     def create_learn_threads(self, batch_and_learn, stats_lock, thread_free_queue, thread_full_queue):
         learner_thread_states = [LearnerThreadState() for _ in range(self._model_flags.num_learner_threads)]
         batch_lock = threading.Lock()
@@ -482,6 +744,40 @@ class Monobeast():
             threads.append(thread)
         return threads, learner_thread_states
 
+    def _on_remote_unroll_complete(self, task_flags, actor_index, new_buffers):
+        # The final outputs of the unroll are the last row of the buffers
+        agent_output = {key: new_buffers[key][-1:] for key in ("policy_logits", "baseline", "action")}
+        env_output = {key: new_buffers[key][-1:] for key in ("frame", "reward", "done", "episode_return",
+                                                             "episode_step", "last_action")}
+        self.on_act_unroll_complete(task_flags, actor_index, agent_output, env_output, new_buffers)
+
+    def _create_remote_actor_server(self, task_flags, initial_agent_state_buffers):
+        num_local_actors = self._model_flags.num_actors - self._model_flags.num_remote_actors
+        buffer_specs = {key: dict(size=self.buffers[key][0].shape, dtype=self.buffers[key][0].dtype)
+                        for key in self.buffers}
+        setup_payload = dict(model_flags=self._model_flags, task_flags=task_flags,
+                             observation_space=self._observation_space, action_spaces=self._action_spaces,
+                             policy_class=self._policy_class, buffer_specs=buffer_specs)
+
+        server = RemoteActorServer(
+            address=self._model_flags.remote_actor_address,
+            authkey=self._model_flags.remote_actor_authkey.encode(),
+            actor_indices=range(num_local_actors, self._model_flags.num_actors),
+            setup_payload=setup_payload,
+            buffers=self.buffers,
+            initial_agent_state_buffers=initial_agent_state_buffers,
+            free_queue=self.free_queue,
+            full_queue=self.full_queue,
+            get_weights_version=lambda: self._actor_model_version.item(),
+            get_weights=lambda: self.actor_model.state_dict(),
+            on_unroll_complete=lambda actor_index, new_buffers: self._on_remote_unroll_complete(
+                task_flags, actor_index, new_buffers),
+            logger=self.logger,
+            compression_level=self._model_flags.remote_actor_compression_level,
+        )
+        server.start()
+        return server
+
     def cleanup(self):
         # We've finished the task, so reset the appropriate counter
         self.logger.info("Finishing task, setting timestep_returned to 0")
@@ -489,12 +785,42 @@ class Monobeast():
 
         # Ensure the training loop will end
         self._train_loop_id_running = None
+        self._train_loop_wakeup.set()
 
         self._cleanup_parallel_workers()
+        env_fork_server.clear_template_env()
+
+    def shutdown(self):
+        """
+        Stops what lives across tasks (cleanup only handles each task's workers).
+        """
+        if self._env_fork_server is not None:
+            self._env_fork_server.stop()
+            self._env_fork_server = None
+
+    def _create_env_template(self, task_flags):
+        """
+        Build the task's env once in this process (or in the fork server, for workers forked from it), so each worker
+        forked afterwards can take a copy instead of building its own.
+        """
+        if not self._model_flags.warm_env_template:
+            return
+
+        if self._env_fork_server is not None:
+            template_seconds = self._env_fork_server.set_template_env(task_flags.env_spec, task_flags.task_id)
+        else:
+            template_seconds = env_fork_server.set_template_env(task_flags.env_spec, task_flags.task_id)
+
+        self.logger.info(f"Env template for task {task_flags.task_id} built in {template_seconds:.2f}s")
 
     def _cleanup_parallel_workers(self):
         self.logger.info("Cleaning up actors")
 
+        # Stop the remote actor sessions first, so the Nones below are all left for the forked actors
+        if self._remote_actor_server is not None:
+            self._remote_actor_server.stop()
+            self._remote_actor_server = None
+
         # Send the signal to the actors to die, and resume them so they can (if they're not already dead)
         for actor_index, actor in enumerate(self._actor_processes):
             self.free_queue.put(None)
@@ -527,6 +853,24 @@ class Monobeast():
 
         self.logger.info("Cleaning up parallel workers complete")
 
+    def _record_learner_transition_latencies(self, learner_thread_states):
+        """
+        Collect the slowest learner start (STARTING -> RUNNING) and stop (STOP_REQUESTED -> STOPPED) latencies.
+        """
+        start_latencies = [state.get_transition_latency(LearnerThreadState.STARTING, LearnerThreadState.RUNNING)
+                           for state in learner_thread_states]
+        stop_latencies = [state.get_transition_latency(LearnerThreadState.STOP_REQUESTED, LearnerThreadState.STOPPED)
+                          for state in learner_thread_states]
+
+        start_latencies = [latency for latency in start_latencies if latency is not None]
+        stop_latencies = [latency for latency in stop_latencies if latency is not None]
+
+        if len(start_latencies) > 0:
+            self._transition_latencies["learner_start_latency"] = max(start_latencies)
+
+        if len(stop_latencies) > 0:
+            self._transition_latencies["learner_stop_latency"] = max(stop_latencies)
+
     def resume_actor_processes(self, ctx, task_flags, actor_processes, free_queue, full_queue, initial_agent_state_buffers):
         # Copy, so iterator and what's being updated are separate
         actor_processes_copy = actor_processes.copy()
@@ -661,13 +1005,19 @@ class Monobeast():
 
         # Setup actor processes and kick them off
         self._actor_processes = []
+        self._create_env_template(task_flags)
         ctx = mp.get_context("fork")
 
         # See: https://stackoverflow.com/questions/47085458/why-is-multiprocessing-queue-get-so-slow for why Manager
         self.free_queue = py_mp.Manager().Queue()
         self.full_queue = py_mp.Manager().Queue()
 
-        for i in range(self._model_flags.num_actors):
+        # The remote actors take the last num_remote_actors actor indices, and connect to us via this server
+        num_local_actors = self._model_flags.num_actors - self._model_flags.num_remote_actors
+        if self._model_flags.num_remote_actors > 0:
+            self._remote_actor_server = self._create_remote_actor_server(task_flags, initial_agent_state_buffers)
+
+        for i in range(num_local_actors):
             actor = ctx.Process(
                 target=self.act,
                 args=(
@@ -743,6 +1093,9 @@ class Monobeast():
                                 collected_stats[key].append(stats[key])
             except Exception as e:
                 self.logger.error(f"Learner thread failed with exception {e}")
+                self._learner_exception = e
+                thread_state.state = LearnerThreadState.STOPPED
+                self._train_loop_wakeup.set()
                 raise e
 
             if i == 0:
@@ -753,6 +1106,7 @@ class Monobeast():
         for m in range(self._model_flags.num_buffers):
             self.free_queue.put(m)
 
+        self._learner_exception = None  # Set by a learner thread that fails, to end the train loop
         threads, self._learner_thread_states = self.create_learn_threads(batch_and_learn, self._stats_lock, self.free_queue, self.full_queue)
 
         # Create the id for this train loop, and only loop while it is the active id
@@ -763,11 +1117,20 @@ class Monobeast():
         self.logger.info(f"Starting train loop id {train_loop_id}")
 
         timer = timeit.default_timer
+        self._train_loop_wakeup.clear()
         try:
             while self._train_loop_id_running == train_loop_id:
                 start_step = step
                 start_time = timer()
-                time.sleep(self._model_flags.seconds_between_yields)
+
+                # Woken early if the loop needs to end (e.g. a learner died), instead of sleeping out the full interval
+                if self._train_loop_wakeup.wait(timeout=self._model_flags.seconds_between_yields):
+                    self._train_loop_wakeup.clear()
+
+                # Rather than carry on with a dead learner, stop the rest and end the loop with its exception
+                if self._learner_exception is not None:
+                    self._stop_learner_threads(threads, self._learner_thread_states)
+                    raise self._learner_exception
 
                 # Copy right away, because there's a race where stats can get re-set and then certain things set below
                 # will be missing (eg "step")
@@ -816,23 +1179,27 @@ class Monobeast():
 
                     # Stop learn threads, they are recreated after yielding. 
                     # Do this before the actors in case we need to do a last batch
-                    self.logger.info("Stopping learners")
-                    for thread_id, thread_state in enumerate(self._learner_thread_states):
-                        wait = False
-                        with thread_state.lock:
-                            if thread_state.state != LearnerThreadState.STOPPED and threads[thread_id].is_alive():
-                                thread_state.state = LearnerThreadState.STOP_REQUESTED
-                                wait = True
-
-                        # Wait for it to stop, otherwise we have training overlapping with eval, and possibly
-                        # the thread creation below
-                        if wait:
-                            thread_state.wait_for([LearnerThreadState.STOPPED], timeout=30)
+                    # Wait for them to stop, otherwise we have training overlapping with eval, and possibly
+                    # the thread creation below.
+                    self._stop_learner_threads(threads, self._learner_thread_states)
+                    self._record_learner_transition_latencies(self._learner_thread_states)
 
                     # The actors will keep going unless we pause them, so...do that.
                     if self._model_flags.pause_actors_during_yield:
+                        pause_start_time = timer()
                         for actor in self._actor_processes:
                             psutil.Process(actor.pid).suspend()
+                        self._transition_latencies["actor_pause_latency"] = timer() - pause_start_time
+
+                    if self._remote_actor_server is not None:
+                        self._remote_actor_server.pause()
+
+                    # Report the latencies collected since the last yield (the resume ones are from the previous yield)
+                    stats_to_return.update(self._transition_latencies)
+                    self._transition_latencies = {}
+                    stats_to_return.update(self._collect_actor_quantization_stats())
+                    stats_to_return.update(self._collect_actor_throughput_stats())
+                    stats_to_return.update(self.collect_custom_stats())
 
                     # Make sure the queue is empty (otherwise things can get dropped in the shuffle)
                     # (Not 100% sure relevant but:) https://stackoverflow.com/questions/19257375/python-multiprocessing-queue-put-not-working-for-semi-large-data
@@ -858,8 +1225,13 @@ class Monobeast():
 
                     # Resume the actors. If one is dead, replace it with a new one
                     if self._model_flags.pause_actors_during_yield:
+                        resume_start_time = timer()
                         self.resume_actor_processes(ctx, task_flags, self._actor_processes, self.free_queue, self.full_queue,
                                                     initial_agent_state_buffers)
+                        self._transition_latencies["actor_resume_latency"] = timer() - resume_start_time
+
+                    if self._remote_actor_server is not None:
+                        self._remote_actor_server.resume()
 
                     # Resume the learners by creating new ones
                     self.logger.info("Restarting learners")
@@ -881,9 +1253,10 @@ class Monobeast():
 
     @staticmethod
     def _collect_test_episode(pickled_args):
-        task_flags, logger, model = cloudpickle.loads(pickled_args)
+        task_flags, logger, model, thread_budget = cloudpickle.loads(pickled_args)
+        cpu_layout.apply_thread_budget(*thread_budget)
 
-        gym_env, seed = Utils.make_env(task_flags.env_spec, create_seed=True)
+        gym_env, seed = env_fork_server.make_env(task_flags.env_spec, template_key=task_flags.task_id, create_seed=True)
         logger.info(f"Environment and libraries setup with seed {seed}")
         env = environment.Environment(gym_env)
         observation = env.initial()
@@ -912,29 +1285,61 @@ class Monobeast():
         env.close()
         return step, returns
 
+    @staticmethod
+    def _send_test_episode(connection, pickled_args):
+        connection.send(Monobeast._collect_test_episode(pickled_args))
+
+    def _collect_test_episodes_from_fork_server(self, task_flags, num_episodes):
+        connections = []
+        processes = []
+        for episode_id in range(num_episodes):
+            local_connection, remote_connection = mp.Pipe()
+            thread_budget = self._get_actor_thread_budget(self._model_flags, episode_id)
+            pickled_args = cloudpickle.dumps((task_flags, self.logger, self.actor_model, thread_budget))
+            process = self._env_fork_server.Process(target=self._send_test_episode,
+                                                    args=(remote_connection, pickled_args))
+            process.start()
+            remote_connection.close()
+
+            connections.append(local_connection)
+            processes.append(process)
+
+        episode_results = [connection.recv() for connection in connections]
+
+        for process in processes:
+            process.join()
+
+        return episode_results
+
     def test(self, task_flags, num_episodes: int = 10):
         if not self._model_flags.no_eval_mode:
             self.actor_model.eval()
 
         returns = []
         step = 0
+        self._create_env_template(task_flags)
 
         # Break the number of episodes we need to run up into batches of num_parallel, which get run concurrently
         for batch_start_id in range(0, num_episodes, self._model_flags.eval_episode_num_parallel):
             # If we are in the last batch, only do the necessary number, otherwise do the max num in parallel
             batch_num_episodes = min(num_episodes - batch_start_id, self._model_flags.eval_episode_num_parallel)
 
-            with Pool(processes=batch_num_episodes) as pool:
-                async_objs = []
-                for episode_id in range(batch_num_episodes):
-                    pickled_args = cloudpickle.dumps((task_flags, self.logger, self.actor_model))
-                    async_obj = pool.apply_async(self._collect_test_episode, (pickled_args,))
-                    async_objs.append(async_obj)
-
-                for async_obj in async_objs:
-                    episode_step, episode_returns = async_obj.get()
-                    step += episode_step
-                    returns.extend(episode_returns)
+            if self._env_fork_server is not None:
+                episode_results = self._collect_test_episodes_from_fork_server(task_flags, batch_num_episodes)
+            else:
+                with Pool(processes=batch_num_episodes) as pool:
+                    async_objs = []
+                    for episode_id in range(batch_num_episodes):
+                        thread_budget = self._get_actor_thread_budget(self._model_flags, episode_id)
+                        pickled_args = cloudpickle.dumps((task_flags, self.logger, self.actor_model, thread_budget))
+                        async_obj = pool.apply_async(self._collect_test_episode, (pickled_args,))
+                        async_objs.append(async_obj)
+
+                    episode_results = [async_obj.get() for async_obj in async_objs]
+
+            for episode_step, episode_returns in episode_results:
+                step += episode_step
+                returns.extend(episode_returns)
 
         self.logger.info(
             "Average returns over %i episodes: %.1f", len(returns), sum(returns) / len(returns)
@@ -0,0 +1,395 @@
+"""
+Actors that run in their own processes (possibly on other hosts) and connect to the learner over a TCP or Unix
+socket, in the spirit of torchbeast's polybeast. The learner runs a RemoteActorServer; each remote actor receives the
+experiment setup and the latest weights from it, and streams compressed unrolls back into the learner's buffers.
+
+To start a remote actor (once the learner is listening on remote_actor_address):
+    python -m continual_rl.policies.impala.torchbeast.remote_actor --address <host>:<port> --authkey <key>
+"""
+import argparse
+import io
+import logging
+import queue
+import threading
+import time
+import traceback
+import zlib
+import cloudpickle
+import torch
+from multiprocessing.connection import Listener, Client
+
+from continual_rl.policies.impala.torchbeast.core import environment
+from continual_rl.policies.impala.torchbeast.core import prof
+from continual_rl.policies.impala.actor_quantization import create_quantized_actor_model
+from continual_rl.utils import env_fork_server
+
+
+def parse_address(address):
+    """
+    Addresses are either "host:port" (TCP) or "unix:/path/to/socket" (Unix domain socket).
+    """
+    if address.startswith("unix:"):
+        return address[len("unix:"):]
+
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def pack_message(message, compression_level):
+    """
+    Messages may contain tensors, so serialize with torch, then compress (unrolls of frames compress very well).
+    """
+    message_bytes = io.BytesIO()
+    torch.save(message, message_bytes)
+    return zlib.compress(message_bytes.getvalue(), compression_level)
+
+
+def unpack_message(message_bytes):
+    return torch.load(io.BytesIO(zlib.decompress(message_bytes)))
+
+
+class RemoteActorServer(object):
+    """
+    Runs in the learner process. Each connected remote actor gets a thread that takes indices off the free_queue,
+    requests an unroll from the remote actor (sending new weights if they have changed since its last unroll), writes
+    the result into the shared buffers, and puts the index on the full_queue - the same contract the forked actors
+    follow.
+    """
+
+    def __init__(self, address, authkey, actor_indices, setup_payload, buffers, initial_agent_state_buffers,
+                 free_queue, full_queue, get_weights_version, get_weights, on_unroll_complete, logger,
+                 compression_level=1):
+        """
+        :param actor_indices: The actor indices available to remote actors, assigned in order of connection
+        :param setup_payload: A dict (cloudpickle-able) of everything a remote actor needs to build its model and env
+        :param get_weights_version: Callable returning an int that changes whenever the weights are published
+        :param get_weights: Callable returning the state_dict to send to remote actors
+        :param on_unroll_complete: Callable taking (actor_index, new_buffers), called after an unroll is written
+        """
+        self._listener = Listener(parse_address(address), authkey=authkey)
+        self._available_actor_indices = list(actor_indices)
+        self._setup_payload = cloudpickle.dumps(setup_payload)
+        self._buffers = buffers
+        self._initial_agent_state_buffers = initial_agent_state_buffers
+        self._free_queue = free_queue
+        self._full_queue = full_queue
+        self._get_weights_version = get_weights_version
+        self._get_weights = get_weights
+        self._on_unroll_complete = on_unroll_complete
+        self._logger = logger
+        self._compression_level = compression_level
+
+        # Serializing the weights is not free, so share one copy per version between all connections
+        self._weights_lock = threading.Lock()
+        self._packed_weights = (None, None)
+
+        # The queues are reset across pauses, so pause() waits for every session to hand back (or finish with) the
+        # index it holds. A session counts as active from when it starts waiting on the free_queue until then.
+        self._running = threading.Event()
+        self._running.set()
+        self._session_state_condition = threading.Condition()
+        self._num_active_sessions = 0
+        self._pause_generation = 0
+        self._stopping = False
+
+        self._session_threads = []
+        self._accept_thread = threading.Thread(target=self._accept_loop, name="remote-actor-accept", daemon=True)
+
+    @property
+    def num_sessions(self):
+        return len([thread for thread in self._session_threads if thread.is_alive()])
+
+    def start(self):
+        self._logger.info(f"Listening for remote actors on {self._listener.address}")
+        self._accept_thread.start()
+
+    def pause(self, timeout=60):
+        """
+        Returns once no session is holding an index, so the caller can safely reset the queues. A session whose
+        remote actor doesn't return its unroll within the timeout has its result dropped when it does come in.
+        """
+        with self._session_state_condition:
+            self._running.clear()
+
+            if not self._session_state_condition.wait_for(lambda: self._num_active_sessions == 0, timeout):
+                self._logger.warning(f"{self._num_active_sessions} remote actor sessions still busy after {timeout}s")
+                self._pause_generation += 1
+
+    def resume(self):
+        self._running.set()
+
+    def stop(self):
+        """
+        Sessions stop on this, not on a None in the free_queue (which they share with the forked actors): each one
+        finishes the unroll it's on, if any, tells its remote actor to stop, and ends.
+        """
+        self._stopping = True
+        self._running.set()
+
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+
+        for thread in self._session_threads:
+            thread.join(30)
+
+    def _accept_loop(self):
+        while not self._stopping:
+            try:
+                connection = self._listener.accept()
+            except (OSError, EOFError) as e:
+                if not self._stopping:
+                    self._logger.warning(f"Remote actor failed to connect: {e}")
+                    continue
+                break
+
+            if len(self._available_actor_indices) == 0:
+                self._logger.warning("Remote actor connected but all remote actor indices are in use. Closing.")
+                connection.send_bytes(pack_message({"type": "stop"}, self._compression_level))
+                connection.close()
+                continue
+
+            actor_index = self._available_actor_indices.pop(0)
+            self._logger.info(f"Remote actor connected from {self._listener.last_accepted} as actor {actor_index}")
+            session_thread = threading.Thread(target=self._session, args=(connection, actor_index),
+                                              name=f"remote-actor-{actor_index}", daemon=True)
+            session_thread.start()
+            self._session_threads.append(session_thread)
+
+    def _get_packed_weights(self, version):
+        with self._weights_lock:
+            packed_version, packed_weights = self._packed_weights
+            if packed_version != version:
+                packed_weights = pack_message(self._get_weights(), self._compression_level)
+                self._packed_weights = (version, packed_weights)
+
+        return packed_weights
+
+    def _activate_session(self):
+        """
+        Returns the pause generation the session is now active in, or None if the server was paused in the meantime.
+        """
+        with self._session_state_condition:
+            if not self._running.is_set():
+                return None
+
+            self._num_active_sessions += 1
+            return self._pause_generation
+
+    def _deactivate_session(self):
+        with self._session_state_condition:
+            self._num_active_sessions -= 1
+            self._session_state_condition.notify_all()
+
+    def _get_free_index(self):
+        """
+        Polls, rather than blocking on, the free_queue so a pause or stop isn't held up by sessions waiting for an
+        index. Returns None if the server gets paused or stopped first.
+        """
+        while self._running.is_set() and not self._stopping:
+            try:
+                index = self._free_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if index is None:
+                # Meant for a forked actor, so leave it for one
+                self._free_queue.put(index)
+                time.sleep(0.1)
+                continue
+
+            if not self._running.is_set() or self._stopping:
+                # Paused while we were taking it: hand it back before pause() returns, so the reset sees it
+                self._free_queue.put(index)
+                return None
+
+            return index
+
+        return None
+
+    def _session(self, connection, actor_index):
+        sent_weights_version = None
+        session_generation = None
+        held_index = None
+
+        try:
+            connection.send_bytes(self._setup_payload)
+            connection.send_bytes(pack_message({"actor_index": actor_index}, self._compression_level))
+
+            while True:
+                self._running.wait()
+                if self._stopping:
+                    connection.send_bytes(pack_message({"type": "stop"}, self._compression_level))
+                    break
+
+                session_generation = self._activate_session()
+                if session_generation is None:
+                    continue
+
+                held_index = self._get_free_index()
+
+                if self._stopping:
+                    connection.send_bytes(pack_message({"type": "stop"}, self._compression_level))
+                    break
+
+                if held_index is None:
+                    self._deactivate_session()
+                    session_generation = None
+                    continue
+
+                # Only send the weights if they've changed since this actor last got them
+                weights = None
+                weights_version = self._get_weights_version()
+                if weights_version != sent_weights_version:
+                    weights = self._get_packed_weights(weights_version)
+                    sent_weights_version = weights_version
+
+                connection.send_bytes(pack_message({"type": "unroll"}, self._compression_level))
+                connection.send_bytes(weights if weights is not None else b"")
+
+                result = unpack_message(connection.recv_bytes())
+
+                # If pause() gave up waiting for this unroll, the queues have since been reset: drop the unroll, and
+                # the index along with it
+                if session_generation == self._pause_generation:
+                    new_buffers = {key: self._buffers[key][held_index] for key in self._buffers.keys()}
+                    for key, value in result["buffers"].items():
+                        new_buffers[key][...] = value
+
+                    for i, tensor in enumerate(result["initial_agent_state"]):
+                        self._initial_agent_state_buffers[held_index][i][...] = tensor
+
+                    self._on_unroll_complete(actor_index, new_buffers)
+                    self._full_queue.put(held_index)
+
+                held_index = None
+                self._deactivate_session()
+                session_generation = None
+
+        except (EOFError, ConnectionResetError, BrokenPipeError) as e:
+            self._logger.warning(f"Remote actor {actor_index} disconnected: {e}")
+
+            # Let another actor fill the index this one was working on, unless the queues were reset since
+            if held_index is not None and session_generation == self._pause_generation:
+                self._free_queue.put(held_index)
+        finally:
+            connection.close()
+
+            if session_generation is not None:
+                self._deactivate_session()
+
+            # Let a new remote actor take over this index
+            self._available_actor_indices.append(actor_index)
+
+
+def run_remote_actor_session(connection, logger):
+    """
+    Runs one task's worth of unrolls against a RemoteActorServer. Returns when the server tells us to stop.
+    """
+    setup = cloudpickle.loads(connection.recv_bytes())
+    actor_index = unpack_message(connection.recv_bytes())["actor_index"]
+
+    model_flags = setup["model_flags"]
+    task_flags = setup["task_flags"]
+    compression_level = model_flags.remote_actor_compression_level
+    torch.set_num_threads(model_flags.actor_num_threads)
+
+    # Imported here to avoid the circular import (monobeast imports this module)
+    from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
+
+    model = setup["policy_class"](setup["observation_space"], setup["action_spaces"], model_flags)
+    unroll_buffers = {key: torch.empty(**spec) for key, spec in setup["buffer_specs"].items()}
+    timings = prof.Timings()
+
+    # Remote actors aren't forked from the learner, so they import the simulator modules themselves (once, across
+    # sessions). As with the forked actors, the env is the template's copy, if forked from a process holding one.
+    env_fork_server.preload_modules(model_flags.env_preload_modules)
+    gym_env, seed = env_fork_server.make_env(task_flags.env_spec, template_key=task_flags.task_id, create_seed=True)
+    logger.info(f"Remote actor {actor_index} environment setup with seed {seed}")
+    env = environment.Environment(gym_env)
+
+    try:
+        env_output = env.initial()
+        agent_state = model.initial_state(batch_size=1)
+        agent_output, unused_state = model(env_output, task_flags.action_space_id, agent_state)
+        inference_model = model
+        last_rebuild_time = None
+        calibration_inputs = env_output
+
+        while True:
+            request = unpack_message(connection.recv_bytes())
+            if request["type"] == "stop":
+                break
+
+            weights = connection.recv_bytes()
+            if len(weights) > 0:
+                model.load_state_dict(unpack_message(weights))
+
+                # Rate-limited as for the forked actors: the learner publishes new weights every step
+                if model_flags.actor_quantization is not None and \
+                        (last_rebuild_time is None or
+                         time.time() - last_rebuild_time >= model_flags.actor_requantize_interval_seconds):
+                    inference_model = create_quantized_actor_model(model, model_flags.actor_quantization,
+                                                                   calibration_inputs=calibration_inputs,
+                                                                   backend=model_flags.actor_quantization_backend)
+                    last_rebuild_time = time.time()
+
+            initial_agent_state = agent_state
+            env_output, agent_output, agent_state = Monobeast.run_unroll(
+                model_flags, task_flags, inference_model, env, env_output, agent_output, agent_state, unroll_buffers,
+                timings)
+            calibration_inputs = {key: tensor.unsqueeze(1) for key, tensor in unroll_buffers.items()}
+
+            connection.send_bytes(pack_message({"buffers": unroll_buffers, "initial_agent_state": initial_agent_state},
+                                               compression_level))
+    finally:
+        logger.info(f"Remote actor {actor_index}: {timings.summary()}")
+        env.close()
+
+
+def run_remote_actor(address, authkey, reconnect=True, connect_timeout=300):
+    """
+    Connect to the learner and run sessions (one per task). If reconnect is True, keep trying to connect to the next
+    session until connect_timeout seconds pass without a learner listening.
+    """
+    logger = logging.getLogger("remote_actor")
+    last_connected_time = time.time()
+
+    while True:
+        try:
+            connection = Client(parse_address(address), authkey=authkey)
+        except (ConnectionRefusedError, FileNotFoundError):
+            if not reconnect or time.time() - last_connected_time > connect_timeout:
+                break
+
+            time.sleep(1)
+            continue
+
+        try:
+            run_remote_actor_session(connection, logger)
+        except (EOFError, ConnectionResetError, BrokenPipeError) as e:
+            logger.warning(f"Lost connection to the learner: {e}")
+        except Exception as e:
+            logger.error(f"Exception in remote actor: {e}")
+            traceback.print_exc()
+            raise e
+        finally:
+            connection.close()
+
+        last_connected_time = time.time()
+        if not reconnect:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an IMPALA actor that connects to a remote learner.")
+    parser.add_argument("--address", type=str, required=True, help="host:port or unix:/path/to/socket")
+    parser.add_argument("--authkey", type=str, required=True, help="Must match the learner's remote_actor_authkey")
+    parser.add_argument("--no-reconnect", action="store_true", help="Exit after the first session ends")
+    parser.add_argument("--connect-timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run_remote_actor(args.address, args.authkey.encode(), reconnect=not args.no_reconnect,
+                     connect_timeout=args.connect_timeout)
@@ -7,6 +7,7 @@ from continual_rl.policies.ppo.a2c_ppo_acktr_gail.ppo import PPO
 from continual_rl.policies.ppo.a2c_ppo_acktr_gail.model import Policy
 from continual_rl.policies.ppo.a2c_ppo_acktr_gail.storage import RolloutStorage
 from continual_rl.experiments.environment_runners.environment_runner_batch import EnvironmentRunnerBatch
+from continual_rl.utils.env_fork_server import EnvForkServer
 from continual_rl.utils.utils import Utils
 import continual_rl.policies.ppo.a2c_ppo_acktr_gail.utils as utils
 
@@ -24,6 +25,13 @@ class PPOPolicy(PolicyBase):
     """
     def __init__(self, config: PPOPolicyConfig, observation_space, action_spaces):  # Switch to your config type
         super().__init__(config)
+
+        # Started before the model exists, so the env workers it forks start small
+        self._env_fork_server = None
+        if config.use_env_fork_server:
+            self._env_fork_server = EnvForkServer(preload_modules=config.env_preload_modules)
+            self._env_fork_server.start()
+
         max_action_space = Utils.get_max_discrete_action_space(action_spaces)
         self._action_spaces = action_spaces
 
@@ -67,9 +75,17 @@ class PPOPolicy(PolicyBase):
         runner = EnvironmentRunnerBatch(policy=self, num_parallel_envs=num_parallel_envs,
                                         timesteps_per_collection=self._config.num_steps,
                                         render_collection_freq=self._config.render_collection_freq,
-                                        output_dir=self._config.output_dir)
+                                        output_dir=self._config.output_dir,
+                                        fork_server=self._env_fork_server,
+                                        env_preload_modules=self._config.env_preload_modules,
+                                        warm_env_template=self._config.warm_env_template)
         return runner
 
+    def shutdown(self):
+        if self._env_fork_server is not None:
+            self._env_fork_server.stop()
+            self._env_fork_server = None
+
     def _update_rollout_storage(self, observation, last_timestep_data):
         masks = torch.FloatTensor([[0.0] if done_ else [1.0] for done_ in last_timestep_data.done])
 
@@ -28,6 +28,11 @@ class PPOPolicyConfig(ConfigBase):
         self.comment = ""  # For experiment-writers to leave a comment for themselves, not used in PPO
         self.clip_reward = True
 
+        # Simulator libraries (e.g. "ale_py", "procgen", "nle") imported once, before any env workers are forked
+        self.env_preload_modules = []
+        self.use_env_fork_server = False  # Fork env workers from a small, preloaded server process
+        self.warm_env_template = False  # Build each task's env once, and give each forked worker a copy of it
+
     def _load_from_dict_internal(self, config_dict):
         loaded_policy_config = self._auto_load_class_parameters(config_dict)
         return loaded_policy_config
@@ -46,15 +46,16 @@ class ProgressAndCompressMonobeast(EWCMonobeast):
         return kl_loss
 
     def knowledge_base_loss(self, task_flags, model, initial_agent_state):
-        # EWC not using batch, vtrace_returns, so not bothering to pass them through
-        ewc_loss, ewc_stats = super().custom_loss(task_flags, model.knowledge_base, initial_agent_state, None, None)
+        # EWC not using batch, vtrace_returns, learner_outputs, or replay_mask, so not bothering to pass them through
+        ewc_loss, ewc_stats = super().custom_loss(task_flags, model.knowledge_base, initial_agent_state, None, None,
+                                                  None, None)
 
         # Additionally, minimize KL divergence between KB and active column (only updating KB)
-        replay_buffer_subset = self._sample_from_task_replay_buffer(task_flags.task_id, self._model_flags.batch_size)
-        with torch.no_grad():
-            targets, _ = model(replay_buffer_subset, task_flags.action_space_id)
-
-        knowledge_base_outputs, _ = model.knowledge_base(replay_buffer_subset, task_flags.action_space_id)
+        replay_buffer_subset = self._sample_from_task_replay_buffer(task_flags.task_id, self._model_flags.batch_size,
+                                                                    reuse_batch=True)
+        # The KB is only run once, both as the input to the KL and for the active column that's the target
+        (knowledge_base_outputs, _), (targets, _) = model.forward_with_knowledge_base(replay_buffer_subset,
+                                                                                     task_flags.action_space_id)
         kl_div_loss = self._compute_kl_div_loss(input=knowledge_base_outputs['policy_logits'],
                                                 target=targets['policy_logits'].detach())
 
@@ -78,7 +79,7 @@ class ProgressAndCompressMonobeast(EWCMonobeast):
         # Because we're not going through the normal EWC path
         # self._prev_task_id doesn't get initialized early enough, so force it here
         if self._prev_task_id is None:
-            super().custom_loss(task_flags, learner_model.knowledge_base, initial_agent_state, None, None)
+            super().custom_loss(task_flags, learner_model.knowledge_base, initial_agent_state, None, None, None, None)
 
         # Only kick off KB training after we switch to a new task, not including the first one. This is
         # being used as boundary detection.
@@ -1,7 +1,7 @@
 import torch
 import copy
 from torch import nn
-from continual_rl.utils.common_nets import get_network_for_size, CommonConv
+from continual_rl.utils.common_nets import get_network_for_size, CommonConv, ResidualBlock
 from continual_rl.policies.impala.nets import ImpalaNet
 from continual_rl.policies.ewc.ewc_policy import EWCPolicy
 from continual_rl.policies.progress_and_compress.progress_and_compress_monobeast import ProgressAndCompressMonobeast
@@ -13,13 +13,57 @@ class ModuleNotAdaptedException(Exception):
     pass
 
 
+def create_lateral_adaptor(module):
+    """
+    This is adapting the previous layer of the KB to be merge-able into the next layer of the active column.
+    The description of eqn (1) in the paper is a little vague. In particular, it is not very clear where, say,
+    a convolution with stride > 1 would be applied. The way I'm interpreting it is that W_i and V_i are both
+    convolutions that do the work of changing size (e.g. from 20x20x32 to 9x9x64), and U_i is just 1x1 on top.
+    """
+
+    # Section 2.1 of P&C, this is σ in equation (1) but not specified. Assuming ReLU as that is used in IMPALA.
+    nonlinearity = nn.ReLU()
+
+    if isinstance(module, nn.Conv2d):
+        # Copy the module, so we have an adaptor that does the right input->output conversion
+        cloned_module = copy.deepcopy(module)
+        cloned_module.reset_parameters()
+
+        full_adaptor = nn.Sequential(
+            cloned_module,  # V_i, c_i. V_i can't simply be a 1x1, since someone needs to actually do the "real" conv
+            nonlinearity,
+            nn.Conv2d(kernel_size=(1, 1),  # Conv2d here represents U_i, a_i
+                      in_channels=module.out_channels,
+                      out_channels=module.out_channels, bias=True)
+        )
+
+    elif isinstance(module, nn.Linear):
+        full_adaptor = nn.Sequential(
+            nn.Linear(in_features=module.in_features, out_features=module.out_features, bias=True),  # V_i, c_i
+            nonlinearity,
+            nn.Linear(in_features=module.out_features, out_features=module.out_features, bias=True),  # U_i, a_i
+        )
+
+    elif isinstance(module, nn.ReLU) or isinstance(module, nn.Flatten) or isinstance(module, CommonConv) or \
+            isinstance(module, nn.Sequential) or isinstance(module, ImpalaNet) or isinstance(module, nn.MaxPool2d):
+        # Capture everything we know should no-op. This is so if we do add another new layer, we know to adapt it too
+        # CommonConv and Sequential are both wrappers; the actual adaptors will be created for their inner modules
+        full_adaptor = None  # Don't add in the KB at this point
+
+    else:
+        raise ModuleNotAdaptedException(f"Module of type {type(module)} not adapted. Add the intended adaption method to create_lateral_adaptor")
+
+    return full_adaptor
+
+
 class ActiveColumnNet(ImpalaNet):
     """
     This network not only has a column of its own, it also incorporates the layer-wise results from the KB column
     into itself.
     Here's how it does it:
     1. Knowledge base is its own network, run separately (KnowledgeBaseColumnNet)
-    2. When it's run, the KB column saves off its intermediate values (via a forward hook)
+    2. When it's run for this column, the KB column saves off the intermediate values this column uses (via forward
+    hooks)
     3. When this module (ActiveColumnNet) is run, at each layer (via a forward hook) we look up the corresponding
     layer in the KB, run an adaptor on it, and add it in to this column's result
     All variable references are to eqn (1) in the P&C paper: https://arxiv.org/pdf/1805.06370.pdf
@@ -41,7 +85,7 @@ class ActiveColumnNet(ImpalaNet):
             if len(list(module.children())) == 0:
                 if first_skipped:
                     # Create the adaptor and ensure its parameters get properly registered
-                    adaptor = self._create_adaptor(module)
+                    adaptor = create_lateral_adaptor(module)
                     self._adaptors[module_name] = adaptor  # If it's None, save it anyway so we know to no-op
                     if adaptor is not None:
                         self._adaptor_params.extend(adaptor.parameters())
@@ -56,6 +100,8 @@ class ActiveColumnNet(ImpalaNet):
 
         # Also, assign knowledge base after creating hooks, so we're not adding hooks to it
         self._knowledge_base = knowledge_base_column
+        self._knowledge_base.record_layerwise_inputs_of(
+            [module_name for module_name, adaptor in self._adaptors.items() if adaptor is not None])
 
     def _reset_layer(self, module):
         # Don't reset knowledge base modules
@@ -90,49 +136,10 @@ class ActiveColumnNet(ImpalaNet):
 
         return hook
 
-    def _create_adaptor(self, module):
-        """
-        This is adapting the previous layer of the KB to be merge-able into the next layer of the active column.
-        The description of eqn (1) in the paper is a little vague. In particular, it is not very clear where, say,
-        a convolution with stride > 1 would be applied. The way I'm interpreting it is that W_i and V_i are both
-        convolutions that do the work of changing size (e.g. from 20x20x32 to 9x9x64), and U_i is just 1x1 on top.
-        """
-
-        # Section 2.1 of P&C, this is σ in equation (1) but not specified. Assuming ReLU as that is used in IMPALA.
-        nonlinearity = nn.ReLU()
-
-        if isinstance(module, nn.Conv2d):
-            # Copy the module, so we have an adaptor that does the right input->output conversion
-            cloned_module = copy.deepcopy(module)
-            cloned_module.reset_parameters()
-
-            full_adaptor = nn.Sequential(
-                cloned_module,  # V_i, c_i. V_i can't simply be a 1x1, since someone needs to actually do the "real" conv
-                nonlinearity,
-                nn.Conv2d(kernel_size=(1, 1),  # Conv2d here represents U_i, a_i
-                          in_channels=module.out_channels,
-                          out_channels=module.out_channels, bias=True)
-            )
-
-        elif isinstance(module, nn.Linear):
-            full_adaptor = nn.Sequential(
-                nn.Linear(in_features=module.in_features, out_features=module.out_features, bias=True),  # V_i, c_i
-                nonlinearity,
-                nn.Linear(in_features=module.out_features, out_features=module.out_features, bias=True),  # U_i, a_i
-            )
-
-        elif isinstance(module, nn.ReLU) or isinstance(module, nn.Flatten) or isinstance(module, CommonConv) or \
-                isinstance(module, nn.Sequential) or isinstance(module, ImpalaNet) or isinstance(module, nn.MaxPool2d):
-            # Capture everything we know should no-op. This is so if we do add another new layer, we know to adapt it too
-            # CommonConv and Sequential are both wrappers; the actual adaptors will be created for their inner modules
-            full_adaptor = None  # Don't add in the KB at this point
-
-        else:
-            raise ModuleNotAdaptedException(f"Module of type {type(module)} not adapted. Add the intended adaption method to _create_adaptor")
-
-        return full_adaptor
-
     def forward(self, input, action_space_id, core_state=()):
+        # Note that during eval we only look at the output of the KB
+        use_active_column = self.training or not self.eval_on_kb
+
         with torch.no_grad():
             # PnC uses the training flag to say whether we should be using AC. However, in some cases we want the eval
             # to be non-deterministic (sometimes policies perform significantly better with a bit of randomness)
@@ -142,34 +149,68 @@ class ActiveColumnNet(ImpalaNet):
                 false_train_mode_on = True
                 self.train()
 
-            # This will cause the knowledge base to update its layerwise computations, in latest_layerwise_outputs,
-            # which gets incorporated in the active column's forward hook
-            column_output = self._knowledge_base(input, action_space_id)
+            # This will cause the knowledge base to update its layerwise computations, in latest_layerwise_inputs,
+            # which gets incorporated in the active column's forward hook. If only the KB's output is used, it skips
+            # saving them.
+            column_output = self._knowledge_base(input, action_space_id, record_layerwise_inputs=use_active_column)
 
             if false_train_mode_on:
                 self.eval()
 
-        # Note that during eval we only look at the output of the KB
-        if self.training or not self.eval_on_kb:
+        if use_active_column:
             column_output = super().forward(input, action_space_id, core_state)
 
         return column_output
 
+    def forward_with_knowledge_base(self, input, action_space_id, core_state=()):
+        """
+        For distilling this column into the KB: the KB's output, differentiable with respect to its parameters, and
+        this column's output, without gradients. The KB is only run once, for both.
+        :return: (KB output, active column output), each as returned by forward
+        """
+        knowledge_base_output = self._knowledge_base(input, action_space_id, record_layerwise_inputs=True)
+
+        with torch.no_grad():
+            column_output = super().forward(input, action_space_id, core_state)
+
+        # Otherwise the saved inputs would keep the KB's graph alive until the next forward
+        self._knowledge_base.latest_layerwise_inputs.clear()
+
+        return knowledge_base_output, column_output
+
 
 class KnowledgeBaseColumnNet(ImpalaNet):
     def __init__(self, observation_space, action_spaces, model_flags):
         super().__init__(observation_space, action_spaces, model_flags)
         self.latest_layerwise_inputs = {}
+        self._record_layerwise_inputs = False
 
+    def record_layerwise_inputs_of(self, module_names):
+        """
+        Save the inputs to these modules into latest_layerwise_inputs, on forwards that ask for it (see forward).
+        """
         for module_name, module in self.named_modules():
-            module.register_forward_hook(self.create_save_output_hook(module_name))
+            if module_name in module_names:
+                module.register_forward_hook(self.create_save_output_hook(module_name))
 
     def create_save_output_hook(self, module_name):
         def hook(module, input, output):
-            self.latest_layerwise_inputs[module_name] = input
+            if self._record_layerwise_inputs:
+                self.latest_layerwise_inputs[module_name] = input
 
         return hook
 
+    def forward(self, inputs, action_space_id, core_state=(), record_layerwise_inputs=False):
+        """
+        :param record_layerwise_inputs: Whether to save the layerwise inputs, for the active column. Otherwise (e.g.
+        when the KB is being run on its own), there's no bookkeeping.
+        """
+        self._record_layerwise_inputs = record_layerwise_inputs
+        try:
+            return super().forward(inputs, action_space_id, core_state)
+        finally:
+            self._record_layerwise_inputs = False
+
 
 class ProgressAndCompressNet(nn.Module):
     """
@@ -189,18 +230,180 @@ class ProgressAndCompressNet(nn.Module):
         parameters.extend(self.knowledge_base.parameters())
         return parameters
 
+    def configure_eval(self, eval_on_kb, eval_is_stochastic):
+        self._active_column.eval_on_kb = eval_on_kb
+        self._active_column.eval_is_stochastic = eval_is_stochastic
+
     def reset_active_column(self):
         self._active_column.reset()
 
     def forward(self, inputs, action_space_id, core_state=()):
         return self._active_column(inputs, action_space_id, core_state)
 
+    def forward_with_knowledge_base(self, inputs, action_space_id, core_state=()):
+        return self._active_column.forward_with_knowledge_base(inputs, action_space_id, core_state)
+
     def initial_state(self, batch_size):
         assert not self.use_lstm, "LSTM not currently implemented. Ensure this gets initialized correctly when it is" \
                                   "implemented."
         return tuple()
 
 
+class FusedProgressAndCompressNet(nn.Module):
+    """
+    The same two columns as ProgressAndCompressNet, with the same adaptors (so given the same weights, the outputs
+    match), but with the lateral connections made explicit: both columns are run together, layer by layer, and the
+    KB's input to each adapted layer is passed straight to that layer's adaptor. No forward hooks, and no state kept
+    between forwards, so it can be compiled, or dynamically quantized, like an ImpalaNet.
+    """
+    supports_dynamic_quantization = True
+
+    def __init__(self, observation_space, action_spaces, model_flags):
+        super().__init__()
+        assert not model_flags.use_lstm, "LSTM not currently implemented."
+        self.use_lstm = model_flags.use_lstm
+        self.num_actions = Utils.get_max_discrete_action_space(action_spaces).n
+        self.knowledge_base = ImpalaNet(observation_space, action_spaces, model_flags)
+        self._active_column = ImpalaNet(observation_space, action_spaces, model_flags)
+        self.eval_on_kb = None
+        self.eval_is_stochastic = None
+
+        # Adaptors for the same layers as ActiveColumnNet's: every leaf but the first (whose input is the observation)
+        self._adaptors = nn.ModuleDict()
+        self._adaptor_keys = {}  # Active column module name: key into _adaptors (which can't contain ".")
+        first_skipped = False
+        for module_name, module in self._active_column.named_modules():
+            if len(list(module.children())) == 0:
+                if first_skipped:
+                    adaptor = create_lateral_adaptor(module)
+                    if adaptor is not None:
+                        self._adaptor_keys[module_name] = module_name.replace(".", "-")
+                        self._adaptors[self._adaptor_keys[module_name]] = adaptor
+                else:
+                    first_skipped = True
+
+    def configure_eval(self, eval_on_kb, eval_is_stochastic):
+        self.eval_on_kb = eval_on_kb
+        self.eval_is_stochastic = eval_is_stochastic
+
+    def reset_active_column(self):
+        # Note: reset is only applied to Linear and Conv2D layers, including adaptors
+        for module in list(self._active_column.modules()) + list(self._adaptors.modules()):
+            if isinstance(module, nn.Conv2d) or isinstance(module, nn.Linear):
+                module.reset_parameters()
+
+    def _run_columns(self, module_name, module, knowledge_base_module, x, knowledge_base_x, column_grad,
+                     knowledge_base_grad):
+        """
+        Run the active column's module on x and the KB's corresponding module on knowledge_base_x, leaf by leaf,
+        adding the adapted KB input into each adapted leaf's output (eqn (1) in the P&C paper).
+        :return: (active column output, KB output)
+        """
+        if isinstance(module, nn.Sequential):
+            # Not named_children, which skips repeats of the same module (e.g. a shared nonlinearity)
+            for (child_name, child), knowledge_base_child in zip(module._modules.items(),
+                                                                 knowledge_base_module._modules.values()):
+                x, knowledge_base_x = self._run_columns(f"{module_name}.{child_name}", child, knowledge_base_child,
+                                                        x, knowledge_base_x, column_grad, knowledge_base_grad)
+            return x, knowledge_base_x
+
+        if isinstance(module, ResidualBlock):
+            out, knowledge_base_out = self._run_columns(f"{module_name}._res_block", module._res_block,
+                                                        knowledge_base_module._res_block, x, knowledge_base_x,
+                                                        column_grad, knowledge_base_grad)
+            return x + out, knowledge_base_x + knowledge_base_out
+
+        if isinstance(module, CommonConv):
+            x, knowledge_base_x = self._run_columns(f"{module_name}._conv_net", module._conv_net,
+                                                    knowledge_base_module._conv_net, x.float(),
+                                                    knowledge_base_x.float(), column_grad, knowledge_base_grad)
+            return self._run_columns(f"{module_name}._post_flatten", module._post_flatten,
+                                     knowledge_base_module._post_flatten, x, knowledge_base_x, column_grad,
+                                     knowledge_base_grad)
+
+        # Anything else is run as a whole, so it can't contain adapted layers (but it can be e.g. a quantized Linear)
+        if len(module._modules) > 0 and any(name.startswith(f"{module_name}.") for name in self._adaptor_keys):
+            raise ModuleNotAdaptedException(f"Module of type {type(module)} not supported by "
+                                            f"FusedProgressAndCompressNet. Add how to run it to _run_columns")
+
+        with torch.set_grad_enabled(knowledge_base_grad):
+            knowledge_base_out = knowledge_base_module(knowledge_base_x)
+
+        with torch.set_grad_enabled(column_grad):
+            out = module(x)
+            adaptor_key = self._adaptor_keys.get(module_name, None)
+            if adaptor_key is not None:
+                out = out + self._adaptors[adaptor_key](knowledge_base_x)
+
+        return out, knowledge_base_out
+
+    def _forward_columns(self, inputs, action_space_id, column_grad, knowledge_base_grad,
+                         include_knowledge_base_output=False):
+        """
+        :return: (active column output dict, KB output dict, or None if not include_knowledge_base_output)
+        """
+        T, B, *_ = inputs["frame"].shape
+        frames = self._active_column.preprocess_frames(inputs)
+        x, knowledge_base_x = self._run_columns("_conv_net", self._active_column._conv_net,
+                                                self.knowledge_base._conv_net, frames, frames, column_grad,
+                                                knowledge_base_grad)
+
+        with torch.set_grad_enabled(knowledge_base_grad):
+            knowledge_base_core = self.knowledge_base.create_core_input(knowledge_base_x, inputs)
+
+        with torch.set_grad_enabled(column_grad):
+            core = self._active_column.create_core_input(x, inputs)
+
+        policy_logits, knowledge_base_policy_logits = self._run_columns(
+            "policy", self._active_column.policy, self.knowledge_base.policy, core, knowledge_base_core,
+            column_grad, knowledge_base_grad)
+        baseline, knowledge_base_baseline = self._run_columns(
+            "baseline", self._active_column.baseline, self.knowledge_base.baseline, core, knowledge_base_core,
+            column_grad, knowledge_base_grad)
+
+        with torch.set_grad_enabled(column_grad):
+            output_dict = self._active_column.create_output_dict(policy_logits, baseline, action_space_id, T, B)
+
+        knowledge_base_output_dict = None
+        if include_knowledge_base_output:
+            with torch.set_grad_enabled(knowledge_base_grad):
+                knowledge_base_output_dict = self.knowledge_base.create_output_dict(
+                    knowledge_base_policy_logits, knowledge_base_baseline, action_space_id, T, B)
+
+        return output_dict, knowledge_base_output_dict
+
+    def forward(self, inputs, action_space_id, core_state=()):
+        # Note that during eval we only look at the output of the KB
+        if self.training or not self.eval_on_kb:
+            output_dict, _ = self._forward_columns(inputs, action_space_id, column_grad=torch.is_grad_enabled(),
+                                                   knowledge_base_grad=False)
+            return output_dict, ()
+
+        with torch.no_grad():
+            # As in ActiveColumnNet: the train flag is only set during the forward, so the action is sampled
+            if self.eval_is_stochastic:
+                self.knowledge_base.train()
+
+            try:
+                return self.knowledge_base(inputs, action_space_id)
+            finally:
+                self.knowledge_base.train(self.training)
+
+    def forward_with_knowledge_base(self, inputs, action_space_id, core_state=()):
+        """
+        For distilling the active column into the KB: the KB's output, differentiable with respect to its
+        parameters, and the active column's output, without gradients, from one run of the two.
+        :return: (KB output, active column output), each as returned by forward
+        """
+        output_dict, knowledge_base_output_dict = self._forward_columns(
+            inputs, action_space_id, column_grad=False, knowledge_base_grad=torch.is_grad_enabled(),
+            include_knowledge_base_output=True)
+        return (knowledge_base_output_dict, ()), (output_dict, ())
+
+    def initial_state(self, batch_size):
+        return tuple()
+
+
 class ProgressAndCompressPolicy(EWCPolicy):
     """
     Based on Progress & Compress, as described here: https://arxiv.org/pdf/1805.06370.pdf
@@ -212,8 +415,8 @@ class ProgressAndCompressPolicy(EWCPolicy):
     """
 
     def __init__(self, config: ProgressAndCompressPolicyConfig, observation_space, action_spaces):
-        super().__init__(config, observation_space, action_spaces, policy_net_class=ProgressAndCompressNet,
+        policy_net_class = FusedProgressAndCompressNet if config.fused_lateral_network else ProgressAndCompressNet
+        super().__init__(config, observation_space, action_spaces, policy_net_class=policy_net_class,
                          impala_class=ProgressAndCompressMonobeast)
         # Rather than piping it all the way through, set it here
-        self.impala_trainer.actor_model._active_column.eval_on_kb = config.eval_on_kb
-        self.impala_trainer.actor_model._active_column.eval_is_stochastic = config.eval_is_stochastic
+        self.impala_trainer.actor_model.configure_eval(config.eval_on_kb, config.eval_is_stochastic)
@@ -11,3 +11,8 @@ class ProgressAndCompressPolicyConfig(OnlineEWCPolicyConfig):
         self.use_collection_pause = False
         self.eval_on_kb = True
         self.eval_is_stochastic = False
+
+        # Use FusedProgressAndCompressNet, which passes the KB's layer inputs to the active column's adaptors
+        # explicitly instead of through forward hooks, so it can be compiled or quantized. Its checkpoints aren't
+        # interchangeable with the hook-based net's.
+        self.fused_lateral_network = False
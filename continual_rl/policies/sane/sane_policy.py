@@ -81,13 +81,13 @@ class SanePolicy(PolicyBase):
         return obs
 
     def _add_replay_buffer(self, source_node, target_node):
-        num_actors = len(source_node.impala_trainer._replay_buffers['frame'])
-        num_buffers = len(source_node.impala_trainer._replay_buffers['frame'][0])
+        reservoir_vals = source_node.impala_trainer.get_replay_buffer('reservoir_val')
+        num_actors = len(reservoir_vals)
+        num_buffers = len(reservoir_vals[0])
         for actor_index in range(num_actors):
             for buffer_id in range(num_buffers):
-                new_buffers = source_node.impala_trainer._replay_buffers
-                if new_buffers['reservoir_val'][actor_index][buffer_id] > 0:
-                    actor_buffers = {key: new_buffers[key][actor_index][buffer_id] for key in new_buffers.keys()}
+                if reservoir_vals[actor_index][buffer_id] > 0:
+                    actor_buffers = source_node.impala_trainer.get_replay_entry(actor_index, buffer_id)
                     target_node.impala_trainer.on_act_unroll_complete(task_flags=None, actor_index=actor_index, agent_output=None,
                                                                       env_output=None, new_buffers=actor_buffers)
 
@@ -323,10 +323,11 @@ class SanePolicy(PolicyBase):
 
 
 class SaneMonobeast(ClearMonobeast):
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
-        clear_loss, stats = super().custom_loss(task_flags, model, initial_agent_state, batch, vtrace_returns)
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs, replay_mask):
+        clear_loss, stats = super().custom_loss(task_flags, model, initial_agent_state, batch, vtrace_returns,
+                                                learner_outputs, replay_mask)
 
-        model_outputs, unused_state = model(batch, task_flags.action_space_id, initial_agent_state)
+        model_outputs = {key: tensor[1:] for key, tensor in learner_outputs.items()}
         uncertainties = torch.abs(model_outputs['baseline'] - vtrace_returns.vs)
         uncertainty_loss = ((model_outputs['uncertainty'] - uncertainties.detach())**2).mean()
         total_loss = self._model_flags.clear_loss_coeff * clear_loss
@@ -394,17 +395,16 @@ class SaneNode(ImpalaPolicy):
                                                                  replay_entry_scale=self._config.merge_batch_scale)
 
         if buffers is None:
-            buffers = self.impala_trainer._replay_buffers  # Will possibly include unfilled entries
+            # Will possibly include unfilled entries. Put into the batch layout: [actors, entries, T+1, ...] to
+            # [T+1, actors * entries, ...]
+            key = 'frame' if self._config.merge_by_frame else 'policy_logits'
+            buffers = {key: self.impala_trainer.get_replay_buffer(key).flatten(0, 1).transpose(0, 1)}
 
         if self._config.merge_by_frame:
             metric = buffers['frame']
-            if not isinstance(metric, torch.Tensor):  # The batch returns it pre-stacked, don't re-stack in that case
-                metric = torch.stack(metric).float().mean(dim=0)
             metric = metric.float().mean(dim=0).mean(dim=0).mean(dim=0).view(-1)
         else:
             policies = buffers['policy_logits']
-            if not isinstance(policies, torch.Tensor):
-                policies = torch.stack(policies).mean(dim=0)
             metric = policies.mean(dim=0).mean(dim=0)
 
         return metric.cpu()
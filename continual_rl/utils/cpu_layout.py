@@ -0,0 +1,92 @@
+"""
+Helpers for giving the learner and the actors their own thread budgets and (optionally) their own CPUs.
+CPU affinity and NUMA nodes are only supported on Linux.
+"""
+import os
+import torch
+
+
+class CpuLayoutException(Exception):
+    pass
+
+
+def parse_cpu_list(cpu_list):
+    """
+    Parse the Linux cpulist format (e.g. "0-3,8,10-11") into a list of CPU ids.
+    """
+    cpus = []
+    for cpu_range in cpu_list.strip().split(","):
+        if cpu_range == "":
+            continue
+
+        if "-" in cpu_range:
+            start, end = cpu_range.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(cpu_range))
+
+    return cpus
+
+
+def get_numa_node_cpus(numa_node):
+    cpulist_path = f"/sys/devices/system/node/node{numa_node}/cpulist"
+
+    if not os.path.exists(cpulist_path):
+        raise CpuLayoutException(f"NUMA node {numa_node} not found (no {cpulist_path})")
+
+    with open(cpulist_path, "r") as cpulist_file:
+        return parse_cpu_list(cpulist_file.read())
+
+
+def get_num_numa_nodes():
+    node_path = "/sys/devices/system/node"
+    if not os.path.exists(node_path):
+        return 1
+
+    return len([name for name in os.listdir(node_path) if name.startswith("node") and name[4:].isdigit()])
+
+
+def get_available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count()))
+
+
+def resolve_cpus(cpus, numa_node):
+    """
+    An explicit list of CPUs takes precedence over a NUMA node. Returns None if neither is specified.
+    """
+    if cpus is not None and len(cpus) > 0:
+        return list(cpus)
+
+    if numa_node is not None:
+        return get_numa_node_cpus(numa_node)
+
+    return None
+
+
+def get_actor_cpus(actor_cpus, actor_index, num_threads):
+    """
+    Actors are assigned num_threads consecutive CPUs from actor_cpus each, wrapping around if there are more actors
+    than CPUs.
+    """
+    if actor_cpus is None:
+        return None
+
+    start = (actor_index * num_threads) % len(actor_cpus)
+    return [actor_cpus[(start + offset) % len(actor_cpus)] for offset in range(min(num_threads, len(actor_cpus)))]
+
+
+def apply_thread_budget(num_threads, cpus=None):
+    """
+    Set the number of intra-op threads torch uses in this process, and pin the calling thread (and so any threads it
+    creates afterwards, such as torch's pool) to the given CPUs, if any.
+    """
+    torch.set_num_threads(num_threads)
+
+    if cpus is not None:
+        if not hasattr(os, "sched_setaffinity"):
+            raise CpuLayoutException("CPU affinity is not supported on this platform")
+
+        os.sched_setaffinity(0, cpus)
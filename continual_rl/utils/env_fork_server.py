@@ -0,0 +1,283 @@
+"""
+Every worker that runs an environment (IMPALA actors, ParallelEnv workers, test episode workers) otherwise imports the
+simulator libraries and builds its environment from scratch, which can take minutes across many workers on a cold node.
+This module provides three ways to pay those costs once:
+
+1. preload_modules: import the simulator libraries in a process before it forks its workers, so they inherit them.
+2. set_template_env: build (and reset) an environment in a process before it forks its workers. The first make_env in
+   each forked worker with a matching template_key takes that worker's (copy-on-write) copy of the template and reseeds
+   it, instead of constructing a new one. Only use this for environments that survive a fork (no threads or GL
+   contexts created at construction).
+3. EnvForkServer: a process started early (before the models, CUDA and threads exist), that preloads the modules,
+   optionally holds a template, and forks workers from itself on request. Workers are sent over a pipe, so their
+   target must be picklable by reference and their arguments picklable (lambdas should be cloudpickled by the caller,
+   as the runners already do). Connections and shared-memory tensors are transferred the same way multiprocessing does.
+"""
+import importlib
+import os
+import pickle
+import signal
+import sys
+import threading
+import time
+import timeit
+import traceback
+import multiprocessing
+import cloudpickle
+import psutil
+import torch.multiprocessing  # Registers torch's reductions, so shared-memory tensors can be sent to the workers
+from multiprocessing.reduction import ForkingPickler
+from continual_rl.utils.utils import Utils
+
+
+_template_env = None  # (key, env, pid of the process that created it)
+
+
+def preload_modules(module_names):
+    """
+    Import the given modules into this process.
+    :return: A dict of module name to the seconds it took to import (0 if it was already imported)
+    """
+    import_seconds = {}
+    for module_name in module_names:
+        start_time = timeit.default_timer()
+        importlib.import_module(module_name)
+        import_seconds[module_name] = timeit.default_timer() - start_time
+
+    return import_seconds
+
+
+def set_template_env(env_spec, key):
+    """
+    Build the template environment in this process, for processes forked from it later to take (see make_env).
+    :return: The seconds it took to build the template (0 if the template for this key already exists)
+    """
+    global _template_env
+
+    if _template_env is not None:
+        template_key, _, creator_pid = _template_env
+        if template_key == key and creator_pid == os.getpid():
+            return 0
+
+    clear_template_env()
+
+    start_time = timeit.default_timer()
+    env, _ = Utils.make_env(env_spec)
+    env.reset()  # Some environments finish loading (e.g. ROMs, levels) on the first reset
+    _template_env = (key, env, os.getpid())
+
+    return timeit.default_timer() - start_time
+
+
+def clear_template_env():
+    global _template_env
+
+    if _template_env is not None:
+        _, env, creator_pid = _template_env
+        if creator_pid == os.getpid():
+            env.close()
+
+        _template_env = None
+
+
+def make_env(env_spec, template_key=None, create_seed=False, seed_to_set=None):
+    """
+    Drop-in replacement for Utils.make_env. If this process was forked from one holding a template with the given
+    template_key, the first call takes this process's copy of the template (seeded as requested) instead of building a
+    new environment. The process that created the template never hands it out itself.
+    """
+    global _template_env
+
+    if template_key is not None and _template_env is not None:
+        key, env, creator_pid = _template_env
+        if key == template_key and creator_pid != os.getpid():
+            _template_env = None
+
+            seed = None
+            if create_seed or seed_to_set is not None:
+                assert not (create_seed and seed_to_set is not None), \
+                    "If create_seed is True and a seed_to_set is specified, it is unclear which is desired."
+                seed = Utils.seed(env, seed=seed_to_set)
+
+            return env, seed
+
+    return Utils.make_env(env_spec, create_seed=create_seed, seed_to_set=seed_to_set)
+
+
+def _get_exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def _run_forked_worker(payload):
+    exit_code = 0
+
+    try:
+        target, args, kwargs = pickle.loads(payload)
+        target(*args, **kwargs)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def _serve(connection, module_names):
+    # Interrupts are the parent's to handle; it will stop us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    connection.send(preload_modules(module_names))
+
+    exit_codes = {}
+    while True:
+        try:
+            command, payload = connection.recv()
+        except EOFError:
+            break
+
+        if command == "fork":
+            pid = os.fork()
+            if pid == 0:
+                connection.close()
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                _run_forked_worker(payload)
+
+            connection.send(pid)
+
+        elif command == "exit_code":
+            if payload not in exit_codes:
+                try:
+                    waited_pid, status = os.waitpid(payload, os.WNOHANG)
+                    if waited_pid != 0:
+                        exit_codes[payload] = _get_exit_code(status)
+                except ChildProcessError:
+                    exit_codes[payload] = None  # Not one of ours, or already reaped
+
+            connection.send(exit_codes.get(payload, None))
+
+        elif command == "template":
+            env_spec, key = cloudpickle.loads(payload)
+            connection.send(set_template_env(env_spec, key))
+
+        elif command == "stop":
+            break
+
+    clear_template_env()
+
+
+class ForkServerProcess(object):
+    """
+    A worker forked by an EnvForkServer. Supports the subset of the multiprocessing.Process interface the runners use.
+    """
+
+    def __init__(self, server, target, args=(), kwargs=None):
+        self._server = server
+        self._payload = bytes(ForkingPickler.dumps((target, args, kwargs or {})))
+        self._exit_code = None
+        self.pid = None
+
+    def start(self):
+        assert self.pid is None, "Process already started"
+        self.pid = self._server._request("fork", self._payload)
+        self._payload = None
+
+    @property
+    def exitcode(self):
+        if self.pid is not None and self._exit_code is None:
+            self._exit_code = self._server._request("exit_code", self.pid)
+
+        return self._exit_code
+
+    def is_alive(self):
+        if self.pid is None or self.exitcode is not None:
+            return False
+
+        try:
+            return psutil.Process(self.pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def join(self, timeout=None):
+        start_time = time.time()
+        while self.is_alive() and (timeout is None or time.time() - start_time < timeout):
+            time.sleep(0.01)
+
+    def _signal(self, signal_to_send):
+        if self.pid is not None:
+            try:
+                os.kill(self.pid, signal_to_send)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+    def close(self):
+        pass
+
+
+class EnvForkServer(object):
+    """
+    Forks workers from a process that has already imported the simulator libraries (and optionally built a template
+    environment). Start it as early as possible, so it forks from a small, single-threaded process.
+    """
+
+    def __init__(self, preload_modules=None, logger=None):
+        self._preload_modules = list(preload_modules or [])
+        self._logger = logger
+        self._process = None
+        self._connection = None
+        self._lock = threading.Lock()  # One request/response at a time on the connection
+
+    def start(self):
+        self._connection, server_connection = multiprocessing.Pipe()
+
+        start_time = timeit.default_timer()
+        ctx = multiprocessing.get_context("fork")
+        self._process = ctx.Process(target=_serve, args=(server_connection, self._preload_modules),
+                                    name="env-fork-server", daemon=True)
+        self._process.start()
+        server_connection.close()
+
+        import_seconds = self._connection.recv()
+        if self._logger is not None:
+            self._logger.info(f"Env fork server {self._process.pid} started in "
+                              f"{timeit.default_timer() - start_time:.2f}s. Preload seconds: {import_seconds}")
+
+    def stop(self):
+        if self._process is None:
+            return
+
+        try:
+            self._request("stop", None, expect_response=False)
+        except (BrokenPipeError, EOFError, OSError):
+            pass
+
+        self._process.join(30)
+        self._connection.close()
+        self._process = None
+
+    def _request(self, command, payload, expect_response=True):
+        assert self._process is not None, "The fork server has not been started"
+
+        with self._lock:
+            self._connection.send((command, payload))
+            return self._connection.recv() if expect_response else None
+
+    def set_template_env(self, env_spec, key):
+        """
+        Build a template environment in the server, for workers that call make_env with the same template_key.
+        :return: The seconds it took to build
+        """
+        return self._request("template", cloudpickle.dumps((env_spec, key)))
+
+    def Process(self, target, args=(), kwargs=None):
+        return ForkServerProcess(self, target, args=args, kwargs=kwargs)
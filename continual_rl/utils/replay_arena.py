@@ -0,0 +1,155 @@
+"""
+A replay store kept in a single memory-mapped file (the "arena"), instead of one file per buffer. Each buffer gets its
+own region of the file, aligned to the huge page size, and the file starts with a header describing the layout, so an
+existing arena is mapped back in (e.g. on resume) without touching its contents.
+
+The file is sized with ftruncate, so it's sparse: unwritten regions read as zeros and take no disk space, and nothing
+needs to be zeroed up front. Optionally the space can be reserved with fallocate instead, so running out of disk
+fails at creation rather than partway through training.
+"""
+import json
+import mmap
+import os
+import struct
+import numpy as np
+import torch
+
+
+class ReplayArenaException(Exception):
+    pass
+
+
+ARENA_MAGIC = b"CRLARENA"
+ARENA_VERSION = 1
+REGION_ALIGNMENT = 2 * 1024 * 1024  # The (x86) huge page size, so each region can be backed by huge pages
+
+# magic, version, length of the JSON layout that follows
+_HEADER_PREFIX = struct.Struct("<8sII")
+_HEADER_SIZE = REGION_ALIGNMENT  # Reserved for the header. Sparse, so the unused part costs nothing.
+
+_ACCESS_HINTS = {
+    "random": "MADV_RANDOM",
+    "sequential": "MADV_SEQUENTIAL",
+    "willneed": "MADV_WILLNEED",
+}
+
+
+def _align(value, alignment=REGION_ALIGNMENT):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _get_numpy_dtype(dtype):
+    return torch.empty((), dtype=dtype).numpy().dtype
+
+
+def compute_layout(specs):
+    """
+    :param specs: {key: dict(size=shape, dtype=torch dtype)}, with the full shape of each buffer
+    :return: {"regions": {key: {"offset", "shape", "dtype"}}, "size": total size of the arena in bytes}
+    """
+    regions = {}
+    offset = _HEADER_SIZE
+
+    for key, spec in specs.items():
+        shape = [int(dim) for dim in spec["size"]]
+        num_bytes = int(np.prod(shape)) * _get_numpy_dtype(spec["dtype"]).itemsize
+        regions[key] = {"offset": offset, "shape": shape, "dtype": str(spec["dtype"])}
+        offset = _align(offset + num_bytes)
+
+    return {"regions": regions, "size": offset}
+
+
+def _read_layout(file_handle, file_path):
+    prefix = file_handle.read(_HEADER_PREFIX.size)
+    if len(prefix) < _HEADER_PREFIX.size:
+        raise ReplayArenaException(f"{file_path} is too short to be a replay arena")
+
+    magic, version, layout_length = _HEADER_PREFIX.unpack(prefix)
+    if magic != ARENA_MAGIC:
+        raise ReplayArenaException(f"{file_path} is not a replay arena")
+
+    if version != ARENA_VERSION:
+        raise ReplayArenaException(f"{file_path} is a version {version} replay arena, expected {ARENA_VERSION}")
+
+    return json.loads(file_handle.read(layout_length).decode("utf-8"))
+
+
+def _create_arena_file(file_path, layout, preallocate):
+    layout_bytes = json.dumps(layout).encode("utf-8")
+    if _HEADER_PREFIX.size + len(layout_bytes) > _HEADER_SIZE:
+        raise ReplayArenaException(f"Replay arena layout is too large for the header ({len(layout_bytes)} bytes)")
+
+    # Written to a temporary file and renamed into place, so a partially created arena is never picked up on resume
+    temp_path = f"{file_path}.partial"
+    file_descriptor = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(file_descriptor, layout["size"])
+
+        if preallocate:
+            os.posix_fallocate(file_descriptor, 0, layout["size"])
+
+        os.pwrite(file_descriptor, _HEADER_PREFIX.pack(ARENA_MAGIC, ARENA_VERSION, len(layout_bytes)) + layout_bytes,
+                  0)
+    finally:
+        os.close(file_descriptor)
+
+    os.replace(temp_path, file_path)
+
+
+class ReplayArena(object):
+    """
+    Creates the arena file if it doesn't exist, otherwise maps in the existing one (which must have the same layout),
+    and exposes each region as a tensor, in self.tensors. The mapping is shared, so it's inherited by forked
+    processes, and writes go to the file.
+    """
+
+    def __init__(self, file_path, specs, preallocate=False, huge_pages=False, access_hint=None):
+        """
+        :param file_path: The arena file
+        :param specs: {key: dict(size=shape, dtype=torch dtype)}, with the full shape of each buffer
+        :param preallocate: Reserve the arena's disk space (with fallocate) when creating it, rather than leaving it
+        sparse
+        :param huge_pages: Ask for transparent huge pages (only effective on filesystems that support them for file
+        mappings, e.g. tmpfs with huge pages enabled)
+        :param access_hint: None, or one of "random", "sequential", "willneed", given to the kernel via madvise
+        """
+        if access_hint is not None and access_hint not in _ACCESS_HINTS:
+            raise ReplayArenaException(f"Unknown access hint {access_hint}. Options: {list(_ACCESS_HINTS.keys())}")
+
+        self.file_path = file_path
+        self.layout = compute_layout(specs)
+        self.created = not os.path.exists(file_path)
+
+        if self.created:
+            _create_arena_file(file_path, self.layout, preallocate)
+        else:
+            with open(file_path, "rb") as file_handle:
+                existing_layout = _read_layout(file_handle, file_path)
+
+            if existing_layout != self.layout:
+                raise ReplayArenaException(f"The replay arena at {file_path} has a different layout than requested. "
+                                           f"Existing: {existing_layout}, requested: {self.layout}")
+
+        with open(file_path, "r+b") as file_handle:
+            self._mmap = mmap.mmap(file_handle.fileno(), self.layout["size"], flags=mmap.MAP_SHARED,
+                                   prot=mmap.PROT_READ | mmap.PROT_WRITE)
+
+        self._advise(huge_pages, access_hint)
+
+        self.tensors = {}
+        for key, region in self.layout["regions"].items():
+            numpy_dtype = _get_numpy_dtype(specs[key]["dtype"])
+            array = np.frombuffer(self._mmap, dtype=numpy_dtype, count=int(np.prod(region["shape"])),
+                                  offset=region["offset"])
+            self.tensors[key] = torch.from_numpy(array.reshape(region["shape"]))
+
+    def _advise(self, huge_pages, access_hint):
+        # madvise is only available from Python 3.8, and the flags vary by platform. They're only hints, so do without.
+        if not hasattr(self._mmap, "madvise"):
+            return
+
+        if huge_pages and hasattr(mmap, "MADV_HUGEPAGE"):
+            self._mmap.madvise(mmap.MADV_HUGEPAGE)
+
+        if access_hint is not None and hasattr(mmap, _ACCESS_HINTS[access_hint]):
+            self._mmap.madvise(getattr(mmap, _ACCESS_HINTS[access_hint]))
@@ -0,0 +1,67 @@
+import numpy as np
+import torch
+from continual_rl.policies.clear.compressed_frame_store import CompressedFrameStore, FrameCodec
+
+
+def create_frame_store(num_actors, entries_per_buffer, frame_shape, cache_entries):
+    specs = CompressedFrameStore.get_arena_specs(num_actors, entries_per_buffer, frame_shape, torch.uint8)
+    tensors = {key: torch.zeros(spec["size"], dtype=spec["dtype"]) for key, spec in specs.items()}
+    counters = torch.zeros((num_actors, 4), dtype=torch.float64)
+
+    return CompressedFrameStore(tensors["frame_chunks"], tensors["frame_chunk_lengths"],
+                                tensors["frame_chunk_versions"], frame_shape, torch.uint8, FrameCodec("zlib"),
+                                cache_entries=cache_entries, counters=counters)
+
+
+class TestCompressedFrameStore(object):
+
+    def test_round_trip(self):
+        """
+        One entry compresses well, one (random noise) doesn't and is stored raw. Rewriting an entry replaces its
+        cached copy.
+        """
+        # Arrange
+        frame_shape = (5, 3, 16, 16)
+        frame_store = create_frame_store(num_actors=2, entries_per_buffer=3, frame_shape=frame_shape, cache_entries=4)
+        compressible_frames = torch.zeros(frame_shape, dtype=torch.uint8)
+        compressible_frames[:, :, 4:8] = 200
+        noise_frames = torch.from_numpy(np.random.RandomState(0).randint(0, 256, size=frame_shape).astype(np.uint8))
+
+        # Act
+        frame_store.write(1, 2, compressible_frames)
+        frame_store.write(0, 1, noise_frames)
+        first_read = frame_store.read(1 * 3 + 2).copy()
+        stats = frame_store.collect_stats()
+
+        frame_store.write(1, 2, noise_frames)
+        gathered = torch.zeros((3, *frame_shape), dtype=torch.uint8)
+        frame_store.gather(torch.tensor([5, 1, 0]), out=gathered)
+
+        # Assert
+        assert (first_read == compressible_frames.numpy()).all()
+        assert (gathered[0] == noise_frames).all()
+        assert (gathered[1] == noise_frames).all()
+        assert (gathered[2] == 0).all()
+        assert stats["replay_frame_compression_ratio"] > 1.5
+
+    def test_interrupted_write(self):
+        """
+        A writer killed partway through leaves the entry's version odd: reads give up (zeros), and the next write to
+        the entry recovers it.
+        """
+        # Arrange
+        frame_shape = (2, 8, 8)
+        frame_store = create_frame_store(num_actors=1, entries_per_buffer=2, frame_shape=frame_shape, cache_entries=4)
+        frames = torch.full(frame_shape, 7, dtype=torch.uint8)
+        frame_store.write(0, 1, frames)
+        frame_store._versions.begin_write(torch.tensor([1]))  # Never ended
+
+        # Act
+        interrupted_read = frame_store.read(1).copy()
+        frame_store.write(0, 1, frames + 1)
+        recovered_read = frame_store.read(1)
+
+        # Assert
+        assert (interrupted_read == 0).all()
+        assert (recovered_read == 8).all()
+        assert frame_store._versions.tensor[1] % 2 == 0
@@ -0,0 +1,69 @@
+import time
+import torch
+import torch.multiprocessing as mp
+from continual_rl.policies.clear.replay_entry_versions import ReplayEntryVersions
+
+
+def write_continuously(entry_versions, buffer, stop_flag):
+    value = 0
+    while stop_flag[0] == 0:
+        value += 1
+        flat_indices = torch.tensor([value % buffer.shape[0]])
+        versions = entry_versions.begin_write(flat_indices)
+        buffer[flat_indices[0]] = value  # Large enough that the write isn't atomic
+        entry_versions.end_write(flat_indices, versions)
+
+
+class TestReplayEntryVersions(object):
+
+    def test_reads_concurrent_with_writer_process_are_not_torn(self):
+        """
+        A writer process continually rewrites every entry with a single value, so an entry with mixed values was torn.
+        """
+        # Arrange
+        num_entries, entry_size = 4, 200000
+        buffer = torch.zeros((num_entries, entry_size), dtype=torch.float32).share_memory_()
+        entry_versions = ReplayEntryVersions(num_entries)
+        stop_flag = torch.zeros((1,), dtype=torch.uint8).share_memory_()
+        writer = mp.get_context("fork").Process(target=write_continuously, args=(entry_versions, buffer, stop_flag))
+        out = torch.zeros((num_entries, entry_size), dtype=torch.float32)
+        flat_indices = torch.arange(num_entries)
+        num_consistent = 0
+
+        def read_entries(positions, indices):
+            if positions is None:
+                torch.index_select(buffer, 0, indices, out=out)
+            else:
+                out[positions] = buffer[indices]
+
+        # Act
+        writer.start()
+        try:
+            end_time = time.time() + 2
+            while time.time() < end_time:
+                consistent = entry_versions.read(flat_indices, read_entries, max_attempts=100)
+
+                # Assert
+                consistent_out = out[consistent]
+                assert (consistent_out == consistent_out[:, :1]).all()
+                num_consistent += int(consistent.sum())
+        finally:
+            stop_flag[0] = 1
+            writer.join()
+
+        assert num_consistent > 0
+
+    def test_interrupted_write_is_reported_and_recovered(self):
+        # Arrange
+        entry_versions = ReplayEntryVersions(3)
+        entry_versions.begin_write(torch.tensor([1]))  # "Killed" before end_write
+
+        # Act
+        consistent = entry_versions.read(torch.tensor([0, 1, 2]), lambda positions, indices: None, max_attempts=3)
+        versions = entry_versions.begin_write(torch.tensor([1]))
+        entry_versions.end_write(torch.tensor([1]), versions)
+        consistent_after_rewrite = entry_versions.read(torch.tensor([1]), lambda positions, indices: None)
+
+        # Assert
+        assert consistent.tolist() == [True, False, True]
+        assert consistent_after_rewrite.tolist() == [True]
@@ -0,0 +1,42 @@
+import pytest
+import torch
+from continual_rl.policies.clear.replay_prefetcher import ReplayPrefetcher, ReplayPrefetchException
+
+
+class TestReplayPrefetcher(object):
+
+    def test_slots_cycle_between_sampler_and_learner(self):
+        # Arrange
+        fill_count = [0]
+
+        def fill_slot(slot):
+            fill_count[0] += 1
+            slot.fill_(fill_count[0])
+            return fill_count[0]
+
+        prefetcher = ReplayPrefetcher(create_slot=lambda: torch.zeros(3), fill_slot=fill_slot, num_slots=2)
+        prefetcher.start()
+
+        # Act
+        results = []
+        for _ in range(5):
+            slot, num_entries, _ = prefetcher.get()
+            results.append((num_entries, slot.tolist()))
+            prefetcher.release(slot)
+
+        prefetcher.stop()
+
+        # Assert
+        assert results == [(fill_id, [float(fill_id)] * 3) for fill_id in range(1, 6)]
+
+    def test_sampler_failure_raised_in_learner(self):
+        # Arrange
+        def fill_slot(slot):
+            raise ValueError("Bad replay buffer")
+
+        prefetcher = ReplayPrefetcher(create_slot=lambda: torch.zeros(3), fill_slot=fill_slot, num_slots=1)
+        prefetcher.start()
+
+        # Act, Assert
+        with pytest.raises(ReplayPrefetchException):
+            prefetcher.get()
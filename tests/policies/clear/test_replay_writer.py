@@ -0,0 +1,39 @@
+import torch
+from continual_rl.policies.clear.replay_writer import ReplayWriter
+
+
+class TestReplayWriter(object):
+
+    def test_submitted_entries_applied(self):
+        """
+        More entries are submitted than fit in the staging rings, so the later ones wait for the writer to free slots.
+        Everything submitted before stop() is applied, in order per actor.
+        """
+        # Arrange
+        num_actors, num_per_actor = 2, 10
+        applied = torch.zeros((num_actors, num_per_actor), dtype=torch.float32).share_memory_()
+        applied_counts = torch.zeros((num_actors,), dtype=torch.int64).share_memory_()
+
+        def apply_entries(entries):
+            for actor_index, new_buffers in entries:
+                applied[actor_index, applied_counts[actor_index]] = new_buffers["baseline"][0]
+                applied_counts[actor_index] += 1
+
+        writer = ReplayWriter({"baseline": dict(size=(3,), dtype=torch.float32)}, num_actors,
+                              staging_entries_per_actor=2, apply_entries=apply_entries, max_batch_entries=4)
+
+        # Act
+        writer.start()
+        for entry_id in range(num_per_actor):
+            for actor_index in range(num_actors):
+                writer.submit(actor_index, {"baseline": torch.full((3,), actor_index * 100 + entry_id)})
+
+        writer.stop()
+        stats = writer.collect_stats()
+
+        # Assert
+        assert applied_counts.tolist() == [num_per_actor] * num_actors
+        assert applied[0].tolist() == list(range(num_per_actor))
+        assert applied[1].tolist() == [100 + entry_id for entry_id in range(num_per_actor)]
+        assert 1 <= stats["replay_writer_batch_size"] <= 4
+        assert "replay_writer_stall_latency" in stats
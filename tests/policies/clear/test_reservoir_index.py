@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+from continual_rl.policies.clear.reservoir_index import ReservoirIndex
+
+
+def reference_insertion_index(reservoir_vals, new_val):
+    """
+    The scan-based reservoir sampling ClearMonobeast originally did on every insertion.
+    """
+    unfilled = np.flatnonzero(reservoir_vals == 0)
+    if len(unfilled) > 0:
+        return unfilled.min()
+
+    if new_val > reservoir_vals.min():
+        return np.argmin(reservoir_vals)
+
+    return None
+
+
+class TestReservoirIndex(object):
+
+    def test_matches_scan_based_reservoir_sampling(self):
+        """
+        Includes a rebuild partway through (as on resume), from a partially filled buffer.
+        """
+        # Arrange
+        num_entries = 37
+        reservoir_vals = torch.zeros((num_entries, 1))
+        random_state = np.random.RandomState(0)
+        new_vals = random_state.uniform(0.001, 1.0, size=500).astype(np.float32)
+        reservoir_index = ReservoirIndex(reservoir_vals)
+
+        for step, new_val in enumerate(new_vals):
+            if step == 20:
+                reservoir_index = ReservoirIndex(reservoir_vals)
+
+            # Act
+            expected_index = reference_insertion_index(reservoir_vals.squeeze(1).numpy(), new_val)
+            insertion_index = reservoir_index.get_insertion_index(new_val)
+
+            # Assert
+            assert insertion_index == expected_index, f"Mismatch at step {step}"
+            if insertion_index is not None:
+                reservoir_vals[insertion_index][0] = float(new_val)
+
+        assert reservoir_index.num_filled == num_entries
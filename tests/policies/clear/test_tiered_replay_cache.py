@@ -0,0 +1,47 @@
+import torch
+from continual_rl.policies.clear.tiered_replay_cache import TieredReplayCache
+
+
+class TestTieredReplayCache(object):
+
+    def test_hits_misses_and_promotion(self):
+        """
+        Entry 0 is in the insert region, entry 1 is only on "disk", and entry 2 was inserted but then overwritten
+        (e.g. by another process) without going through the tier, so its RAM copy is stale.
+        """
+        # Arrange
+        num_actors, entries_per_buffer = 1, 4
+        disk = torch.arange(num_actors * entries_per_buffer, dtype=torch.float32).view(-1, 1) * 10
+        entry_versions = torch.zeros(num_actors * entries_per_buffer, dtype=torch.int64)
+        tier = TieredReplayCache({"baseline": dict(size=(1,), dtype=torch.float32)}, num_actors, entries_per_buffer,
+                                 entry_versions, insert_entries_per_actor=2, sample_entries=2)
+
+        entry_versions[[0, 1, 2]] = 2
+        tier.on_insert(0, 0, {"baseline": disk[0]})
+        tier.on_insert(0, 2, {"baseline": disk[2]})
+        disk[2] = 25
+        entry_versions[2] = 4
+
+        disk_reads = []
+
+        def read_from_disk(positions, flat_indices):
+            disk_reads.append(flat_indices.tolist())
+            out["baseline"][positions] = disk[flat_indices]
+
+        # Act
+        out = {"baseline": torch.zeros((3, 1))}
+        tier.gather(torch.tensor([0, 1, 2]), out, read_from_disk)
+        first_out = out["baseline"].clone()
+
+        out = {"baseline": torch.zeros((3, 1))}
+        tier.gather(torch.tensor([0, 1, 2]), out, read_from_disk)
+        stats = tier.collect_stats()
+
+        # Assert
+        assert first_out.view(-1).tolist() == [0, 10, 25]
+        assert out["baseline"].view(-1).tolist() == [0, 10, 25]
+        assert disk_reads[0] == [1, 2]
+        assert len(disk_reads[1]) == 0  # Both promoted after the first read
+        assert stats["replay_ram_tier_promotions"] == 2
+        assert stats["replay_ram_tier_insert_hit_rate"] == 2 / 6
+        assert stats["replay_ram_tier_sample_hit_rate"] == 2 / 6
@@ -0,0 +1,62 @@
+import sys
+import torch
+from continual_rl.policies.ewc.batched_fisher import BatchedFisher
+
+
+def compute_sample_loss(model_fn, sample):
+    return ((model_fn(sample["x"]) - sample["y"]) ** 2).sum()
+
+
+class TestBatchedFisher(object):
+
+    def test_batched_matches_per_sample(self):
+        """
+        The last sample has a different shape, so it can't be batched with the rest.
+        """
+        # Arrange
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Tanh(), torch.nn.Linear(4, 2))
+        samples = [{"x": torch.randn(5, 3), "y": torch.randn(5, 2)} for _ in range(6)]
+        samples.append({"x": torch.randn(2, 3), "y": torch.randn(2, 2)})
+
+        expected_importance = {name: torch.zeros_like(param) for name, param in model.named_parameters()}
+        for sample in samples:
+            model.zero_grad()
+            compute_sample_loss(model, sample).backward()
+            for name, param in model.named_parameters():
+                expected_importance[name] += param.grad ** 2 / len(samples)
+
+        # Act
+        batched_fisher = BatchedFisher(model, compute_sample_loss, samples_per_pass=4)
+        batched_fisher.accumulate(samples)
+        batched_importance = batched_fisher.get_importance()
+
+        sequential_fisher = BatchedFisher(model, compute_sample_loss, samples_per_pass=1)
+        sequential_fisher.accumulate(samples)
+        sequential_importance = sequential_fisher.get_importance()
+
+        # Assert
+        assert batched_fisher.num_samples == len(samples)
+        for name, expected in expected_importance.items():
+            assert torch.allclose(batched_importance[name], expected, atol=1e-6)
+            assert torch.allclose(sequential_importance[name], expected, atol=1e-6)
+
+    def test_falls_back_without_torch_func(self, monkeypatch):
+        """
+        torch.func only exists in torch >= 2.0. Without it, each sample gets its own backward.
+        """
+        # Arrange
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Tanh(), torch.nn.Linear(4, 2))
+        samples = [{"x": torch.randn(5, 3), "y": torch.randn(5, 2)} for _ in range(4)]
+        expected_fisher = BatchedFisher(model, compute_sample_loss, samples_per_pass=1)
+        expected_fisher.accumulate(samples)
+        monkeypatch.setitem(sys.modules, "torch.func", None)  # Makes importing it raise ImportError
+
+        # Act
+        fisher = BatchedFisher(model, compute_sample_loss, samples_per_pass=4)
+        fisher.accumulate(samples)
+
+        # Assert
+        assert fisher.num_samples == len(samples)
+        assert torch.allclose(fisher.squared_grads, expected_fisher.squared_grads)
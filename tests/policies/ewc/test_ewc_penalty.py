@@ -0,0 +1,99 @@
+import pytest
+import torch
+from continual_rl.policies.ewc.ewc_penalty import EWCPenalty, sparsify_terms, densify_terms
+
+
+def compute_reference_penalty(model, task_terms, use_mean, scale):
+    """
+    The per-task, per-parameter penalty, as EWCMonobeast originally computed it.
+    """
+    penalty = 0
+    for task_params, importance in task_terms:
+        for name, param in model.named_parameters():
+            delta = importance[name] * (param - task_params[name]) ** 2
+            penalty = penalty + (delta.mean() if use_mean else delta.sum())
+
+    return scale * penalty
+
+
+class TestEWCPenalty(object):
+
+    @pytest.mark.parametrize("use_mean", [False, True])
+    def test_matches_per_task_penalty(self, use_mean):
+        """
+        The first task's Fisher is zero for some parameters, so they have no precision.
+        """
+        # Arrange
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+        task_terms = []
+        for task_index in range(3):
+            task_params = {name: torch.randn_like(param) for name, param in model.named_parameters()}
+            importance = {name: torch.rand_like(param) * (task_index > 0 or "bias" not in name)
+                          for name, param in model.named_parameters()}
+            task_terms.append((task_params, importance))
+
+        # Act
+        penalty = EWCPenalty(task_terms, use_mean=use_mean, scale=1 / 6).compute(model)
+        penalty.backward()
+        grads = [param.grad.clone() for param in model.parameters()]
+
+        model.zero_grad()
+        reference_penalty = compute_reference_penalty(model, task_terms, use_mean=use_mean, scale=1 / 6)
+        reference_penalty.backward()
+
+        # Assert
+        assert penalty.item() == pytest.approx(reference_penalty.item(), rel=1e-5)
+        for grad, param in zip(grads, model.parameters()):
+            assert torch.allclose(grad, param.grad, rtol=1e-4, atol=1e-6)
+
+    def test_graph_free_gradient_matches_autograd(self):
+        # Arrange
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+        task_terms = [({name: torch.randn_like(param) for name, param in model.named_parameters()},
+                       {name: torch.rand_like(param) for name, param in model.named_parameters()})]
+        ewc_penalty = EWCPenalty(task_terms, use_mean=True, scale=0.5)
+        model[0].weight.grad = torch.ones_like(model[0].weight)  # As though from the main loss
+
+        # Act
+        penalty, gradient = ewc_penalty.compute_with_gradient(model)
+        ewc_penalty.add_to_grads(model, gradient)
+        graph_free_grads = [param.grad.clone() for param in model.parameters()]
+
+        model.zero_grad()
+        reference_penalty = ewc_penalty.compute(model)
+        reference_penalty.backward()
+
+        # Assert
+        assert not penalty.requires_grad
+        assert penalty.item() == pytest.approx(reference_penalty.item(), rel=1e-6)
+        assert torch.allclose(graph_free_grads[0], model[0].weight.grad + 1)
+        for graph_free_grad, param in list(zip(graph_free_grads, model.parameters()))[1:]:
+            assert torch.allclose(graph_free_grad, param.grad)
+
+    def test_sparse_terms_match_densified(self):
+        """
+        Each task keeps a different top quarter of its Fisher, so the penalty is over the union of what they kept.
+        """
+        # Arrange
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+        sparse_task_terms = []
+        for _ in range(2):
+            task_params = {name: torch.randn_like(param) for name, param in model.named_parameters()}
+            importance = {name: torch.rand_like(param) for name, param in model.named_parameters()}
+            sparse_task_terms.append(sparsify_terms(task_params, importance, top_fraction=0.25))
+
+        # Act
+        sparse_penalty = EWCPenalty([terms for terms, _, _ in sparse_task_terms], use_mean=True, scale=0.5)
+        penalty = sparse_penalty.compute(model)
+        dense_task_terms = [densify_terms(terms) for terms, _, _ in sparse_task_terms]
+        reference_penalty = compute_reference_penalty(model, dense_task_terms, use_mean=True, scale=0.5)
+
+        # Assert
+        num_params = sum(param.numel() for param in model.parameters())
+        assert all(kept_fraction == pytest.approx(0.25, abs=0.05) for _, kept_fraction, _ in sparse_task_terms)
+        assert all(0 < error < 0.75 for _, _, error in sparse_task_terms)
+        assert len(sparse_penalty.indices) < num_params
+        assert penalty.item() == pytest.approx(reference_penalty.item(), rel=1e-5)
@@ -0,0 +1,58 @@
+import threading
+import torch
+from types import SimpleNamespace
+from continual_rl.policies.ewc.ewc_monobeast import EWCMonobeast
+
+
+def create_sampler(replay_buffer_counters, entries_per_buffer, unroll_length):
+    """
+    Just enough of an EWCMonobeast to sample from a task's replay buffers. Each entry is filled with a value
+    identifying it: actor_index * 100 + buffer_index.
+    """
+    num_actors = len(replay_buffer_counters)
+    values = torch.arange(num_actors)[:, None] * 100 + torch.arange(entries_per_buffer)[None, :]
+    frame = values[:, :, None, None].expand(num_actors, entries_per_buffer, unroll_length + 1, 2).contiguous()
+    task_info = SimpleNamespace(get_replay_buffers=lambda: {"frame": frame},
+                                replay_buffer_counters=torch.tensor(replay_buffer_counters, dtype=torch.int64))
+
+    sampler = EWCMonobeast.__new__(EWCMonobeast)
+    sampler._model_flags = SimpleNamespace(num_actors=num_actors, device=torch.device("cpu"), online_ewc=False)
+    sampler._entries_per_buffer = entries_per_buffer
+    sampler._sampling_thread_state = threading.local()
+    sampler._tasks = {"task": task_info}
+    return sampler
+
+
+class TestEWCReplaySampling(object):
+
+    def test_samples_only_filled_entries(self):
+        """
+        Actor 0's buffer has wrapped around, actor 1 has 2 entries, and actor 2 has none.
+        """
+        # Arrange
+        sampler = create_sampler([7, 2, 0], entries_per_buffer=4, unroll_length=3)
+
+        # Act
+        batch = sampler._sample_from_task_replay_buffer("task", batch_size=300)
+
+        # Assert
+        frame = batch["frame"]
+        assert frame.shape[0] == 4 and frame.shape[2] == 2
+        assert 150 <= frame.shape[1] < 300  # Roughly a third of the draws land on the empty actor
+        assert (frame == frame[:1, :, :1]).all()  # Each sampled column is one whole entry
+        sampled_entries = set(frame[0, :, 0].tolist())
+        assert sampled_entries == {0, 1, 2, 3, 100, 101}
+
+    def test_reused_batch(self):
+        # Arrange
+        sampler = create_sampler([5, 5], entries_per_buffer=4, unroll_length=3)
+
+        # Act
+        first_batch = sampler._sample_from_task_replay_buffer("task", batch_size=8, reuse_batch=True)
+        second_batch = sampler._sample_from_task_replay_buffer("task", batch_size=8, reuse_batch=True)
+        fresh_batch = sampler._sample_from_task_replay_buffer("task", batch_size=8)
+
+        # Assert
+        assert first_batch["frame"].data_ptr() == second_batch["frame"].data_ptr()
+        assert fresh_batch["frame"].data_ptr() != second_batch["frame"].data_ptr()
+        assert second_batch["frame"].is_contiguous()
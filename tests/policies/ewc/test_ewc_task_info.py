@@ -0,0 +1,56 @@
+import os
+import torch
+from types import SimpleNamespace
+from continual_rl.policies.ewc.ewc_monobeast import EWCTaskInfo
+
+
+class TestEWCTaskInfo(object):
+
+    def test_replay_created_on_first_use_and_discarded(self, tmp_path):
+        # Arrange
+        model_flags = SimpleNamespace(output_dir=str(tmp_path / "output"), large_file_path=str(tmp_path),
+                                      num_actors=2)
+        specs = {"frame": dict(size=(3, 4), dtype=torch.uint8)}
+        task_info = EWCTaskInfo(model_flags, specs, entries_per_buffer=5, task_name="task_0")
+        output_dir_str = os.path.normpath(model_flags.output_dir).replace(os.path.sep, "-")
+        replay_path = os.path.join(tmp_path, "file_backed", output_dir_str, "task_0", "replay_frame.fbt")
+        created_before_use = os.path.exists(replay_path)
+
+        # Act
+        task_info.get_replay_buffers()["frame"][1, 2] = 7
+        task_info.replay_buffer_counters[1] += 1
+        task_info.release_replay_buffers()
+        reopened_frame = task_info.get_replay_buffers()["frame"]
+        task_info.release_replay_buffers(discard=True)
+
+        # Assert
+        assert not created_before_use
+        assert reopened_frame.shape == (2, 5, 3, 4)
+        assert (reopened_frame[1, 2] == 7).all()
+        assert not os.path.exists(replay_path)
+        assert task_info.replay_buffer_counters.tolist() == [0, 0]
+
+    def test_counters_reset_without_replay_files(self, tmp_path):
+        """
+        Counters left over from replay that is no longer on disk (e.g. from an older file layout) are reset, while
+        counters for replay that is there are kept.
+        """
+        # Arrange
+        model_flags = SimpleNamespace(output_dir=str(tmp_path / "output"), large_file_path=str(tmp_path),
+                                      num_actors=2)
+        specs = {"frame": dict(size=(3, 4), dtype=torch.uint8)}
+        stale_task_info = EWCTaskInfo(model_flags, specs, entries_per_buffer=5, task_name="stale")
+        stale_task_info.replay_buffer_counters[0] = 3
+        stale_task_info.total_steps[0] = 10
+        kept_task_info = EWCTaskInfo(model_flags, specs, entries_per_buffer=5, task_name="kept")
+        kept_task_info.get_replay_buffers()
+        kept_task_info.replay_buffer_counters[0] = 3
+
+        # Act
+        reloaded_stale_task_info = EWCTaskInfo(model_flags, specs, entries_per_buffer=5, task_name="stale")
+        reloaded_kept_task_info = EWCTaskInfo(model_flags, specs, entries_per_buffer=5, task_name="kept")
+
+        # Assert
+        assert reloaded_stale_task_info.replay_buffer_counters.tolist() == [0, 0]
+        assert reloaded_stale_task_info.total_steps.tolist() == [10]
+        assert reloaded_kept_task_info.replay_buffer_counters.tolist() == [3, 0]
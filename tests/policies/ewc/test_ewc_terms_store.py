@@ -0,0 +1,29 @@
+import os
+import torch
+from continual_rl.policies.ewc.ewc_terms_store import EWCTermsStore
+
+
+class TestEWCTermsStore(object):
+
+    def test_terms_written_once_and_unreferenced_removed(self, tmp_path):
+        # Arrange
+        store = EWCTermsStore(str(tmp_path))
+        first_terms = ({"weight": torch.ones((2, 3))}, {"weight": torch.full((2, 3), 0.5)})
+        second_terms = ({"weight": torch.zeros((2, 3))}, {"weight": torch.full((2, 3), 0.25)})
+
+        # Act
+        first_file = store.put(first_terms)
+        first_modified_time = os.stat(os.path.join(tmp_path, first_file)).st_mtime_ns
+        first_file_again = store.put(first_terms)
+        rewritten = os.stat(os.path.join(tmp_path, first_file)).st_mtime_ns != first_modified_time
+        second_file = store.put(second_terms)
+        store.remove_unreferenced([second_file])
+        loaded_terms = EWCTermsStore(str(tmp_path)).get(second_file)
+
+        # Assert
+        assert first_file_again == first_file
+        assert not rewritten
+        assert second_file != first_file
+        assert sorted(os.listdir(tmp_path)) == [second_file]
+        assert torch.equal(loaded_terms[0]["weight"], second_terms[0]["weight"])
+        assert torch.equal(loaded_terms[1]["weight"], second_terms[1]["weight"])
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+import gym
+from dotmap import DotMap
+from continual_rl.policies.impala.nets import ImpalaNet
+from continual_rl.policies.impala.actor_quantization import create_quantized_actor_model, compare_actor_models, \
+    UnsupportedQuantizationException
+
+
+class TestActorQuantization(object):
+
+    def _create_model(self, conv_net_arch):
+        observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 1, 64, 64), dtype=np.uint8)
+        action_spaces = {0: gym.spaces.Discrete(5)}
+        model_flags = DotMap(use_lstm=False, conv_net_arch=conv_net_arch, baseline_includes_uncertainty=False,
+                             baseline_extended_arch=False)
+        return ImpalaNet(observation_space, action_spaces, model_flags)
+
+    def _create_inputs(self, time_steps):
+        return {"frame": torch.randint(0, 255, (time_steps, 1, 4, 1, 64, 64), dtype=torch.uint8),
+                "reward": torch.zeros((time_steps, 1)),
+                "done": torch.zeros((time_steps, 1), dtype=torch.bool),
+                "last_action": torch.zeros((time_steps, 1), dtype=torch.int64)}
+
+    @pytest.mark.parametrize("mode", ["dynamic", "static"])
+    def test_quantized_model_matches_reference(self, mode):
+        # Arrange
+        torch.manual_seed(0)
+        model = self._create_model("orig")
+        model.eval()
+        inputs = self._create_inputs(time_steps=6)
+
+        # Act
+        quantized_model = create_quantized_actor_model(model, mode, calibration_inputs=inputs)
+        comparison = compare_actor_models(model, quantized_model, inputs, action_space_id=0)
+
+        # Assert
+        assert comparison["action_agreement"] > 0.8
+        assert not quantized_model.training
+        assert any(param.dtype == torch.float32 for param in model.parameters()), "The original model was modified"
+
+    def test_static_quantization_rejects_residual_nets(self):
+        # Arrange
+        model = self._create_model("impala_res_cnn")
+        inputs = self._create_inputs(time_steps=2)
+
+        # Act & Assert
+        with pytest.raises(UnsupportedQuantizationException):
+            create_quantized_actor_model(model, "static", calibration_inputs=inputs)
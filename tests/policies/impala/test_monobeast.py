@@ -0,0 +1,115 @@
+import threading
+import time
+import torch
+from types import SimpleNamespace
+from continual_rl.policies.impala.torchbeast.monobeast import LearnerThreadState, Monobeast
+
+
+class TestLearnerThreadState(object):
+
+    def test_wait_for_wakes_on_transition(self):
+        """
+        The waiter should be woken by the state change, not by a polling interval or the timeout.
+        """
+        # Arrange
+        thread_state = LearnerThreadState()
+        thread_state.state = LearnerThreadState.STOP_REQUESTED
+
+        def stop_later():
+            time.sleep(0.05)
+            thread_state.state = LearnerThreadState.STOPPED
+
+        stopper = threading.Thread(target=stop_later)
+
+        # Act
+        start_time = time.monotonic()
+        stopper.start()
+        reached = thread_state.wait_for([LearnerThreadState.STOPPED], timeout=10)
+        elapsed = time.monotonic() - start_time
+        stopper.join()
+
+        # Assert
+        assert reached
+        assert elapsed < 5
+        latency = thread_state.get_transition_latency(LearnerThreadState.STOP_REQUESTED, LearnerThreadState.STOPPED)
+        assert latency is not None and 0 < latency < 5
+
+    def test_wait_for_timeout(self):
+        # Arrange
+        thread_state = LearnerThreadState()
+
+        # Act
+        reached = thread_state.wait_for([LearnerThreadState.STOPPED], timeout=0.01)
+
+        # Assert
+        assert not reached
+        assert thread_state.get_transition_latency(LearnerThreadState.STARTING, LearnerThreadState.STOPPED) is None
+
+    def test_repeated_state_does_not_reset_entry_time(self):
+        """
+        The learner sets RUNNING on every iteration; the start latency should still reflect the first entry.
+        """
+        # Arrange
+        thread_state = LearnerThreadState()
+        thread_state.state = LearnerThreadState.RUNNING
+        first_latency = thread_state.get_transition_latency(LearnerThreadState.STARTING, LearnerThreadState.RUNNING)
+
+        # Act
+        time.sleep(0.01)
+        thread_state.state = LearnerThreadState.RUNNING
+
+        # Assert
+        assert thread_state.get_transition_latency(LearnerThreadState.STARTING, LearnerThreadState.RUNNING) == first_latency
+
+
+class TestActorThroughputStats(object):
+
+    def test_steps_per_second_includes_rebuilds(self):
+        # Arrange
+        monobeast = Monobeast.__new__(Monobeast)
+        monobeast._model_flags = SimpleNamespace(actor_quantization="dynamic")
+        monobeast._actor_throughput_stats = torch.tensor([[100, 2.0, 0.5], [300, 2.0, 0.0]], dtype=torch.float64)
+
+        # Act
+        stats = monobeast._collect_actor_throughput_stats()
+        next_stats = monobeast._collect_actor_throughput_stats()
+
+        # Assert
+        assert stats["actor_steps_per_second"] == 100
+        assert stats["quantized_rebuild_time_fraction"] == 0.125
+        assert next_stats == {}
+
+
+class TestStopLearnerThreads(object):
+
+    def test_stops_live_learners_and_skips_stopped(self):
+        """
+        When a learner dies, the train loop stops the rest before ending, so none are left running.
+        """
+        # Arrange
+        monobeast = Monobeast.__new__(Monobeast)
+        monobeast.logger = SimpleNamespace(info=lambda message: None)
+        live_state = LearnerThreadState()
+        dead_state = LearnerThreadState()
+        dead_state.state = LearnerThreadState.STOPPED
+
+        def learn():
+            live_state.state = LearnerThreadState.RUNNING
+            live_state.wait_for([LearnerThreadState.STOP_REQUESTED], timeout=10)
+            live_state.state = LearnerThreadState.STOPPED
+
+        live_thread = threading.Thread(target=learn)
+        dead_thread = threading.Thread(target=lambda: None)
+        live_thread.start()
+        dead_thread.start()
+        dead_thread.join()
+        live_state.wait_for([LearnerThreadState.RUNNING], timeout=10)
+
+        # Act
+        monobeast._stop_learner_threads([live_thread, dead_thread], [live_state, dead_state])
+        live_thread.join(5)
+
+        # Assert
+        assert live_state.state == LearnerThreadState.STOPPED
+        assert not live_thread.is_alive()
+        assert dead_state.get_transition_latency(LearnerThreadState.STOPPED, LearnerThreadState.STOP_REQUESTED) is None
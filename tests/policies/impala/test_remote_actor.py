@@ -0,0 +1,242 @@
+import logging
+import os
+import queue
+import tempfile
+import threading
+import numpy as np
+import torch
+import gym
+from dotmap import DotMap
+from torch import multiprocessing as mp
+from continual_rl.policies.impala.nets import ImpalaNet
+from continual_rl.policies.impala.torchbeast.remote_actor import RemoteActorServer, run_remote_actor, pack_message, \
+    unpack_message
+
+
+class _LazyFrame(object):
+    """
+    Mimics the LazyFrames interface the torchbeast Environment expects.
+    """
+    def __init__(self, frame):
+        self._frame = frame
+
+    def to_tensor(self):
+        return torch.as_tensor(self._frame)
+
+
+class MockImageEnv(gym.Env):
+    def __init__(self):
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(1, 1, 7, 7), dtype=np.uint8)
+        self.action_space = gym.spaces.Discrete(3)
+        self._step = 0
+
+    def reset(self):
+        self._step = 0
+        return _LazyFrame(np.full((1, 1, 7, 7), 255, dtype=np.uint8))
+
+    def step(self, action):
+        self._step += 1
+        done = self._step >= 4
+        return _LazyFrame(np.full((1, 1, 7, 7), 255, dtype=np.uint8)), 1.0, done, {}
+
+    def seed(self, seed=None):
+        pass
+
+
+def make_mock_env():
+    return MockImageEnv()
+
+
+class MockConnection(object):
+    """
+    Stands in for the connection to a remote actor: each unroll request is answered once the test releases it.
+    """
+    def __init__(self, unroll_length):
+        self.sent_messages = []
+        self.unroll_released = threading.Event()
+        self.unroll_requested = threading.Event()
+        self.disconnect = False
+        self._result = pack_message({"buffers": {"reward": torch.ones(unroll_length + 1)},
+                                     "initial_agent_state": ()}, compression_level=1)
+
+    def send_bytes(self, message):
+        self.sent_messages.append(message)
+
+    def recv_bytes(self):
+        self.unroll_requested.set()
+        self.unroll_released.wait()
+        self.unroll_released.clear()
+
+        if self.disconnect:
+            raise EOFError("Mock disconnect")
+
+        return self._result
+
+    def close(self):
+        pass
+
+
+def create_server_session(free_queue, full_queue, num_buffers=2, unroll_length=3):
+    socket_dir = tempfile.mkdtemp()
+    buffers = {"reward": [torch.zeros(unroll_length + 1) for _ in range(num_buffers)]}
+    server = RemoteActorServer(f"unix:{os.path.join(socket_dir, 'actors.sock')}", b"test_key", actor_indices=[0],
+                               setup_payload={}, buffers=buffers,
+                               initial_agent_state_buffers=[() for _ in range(num_buffers)],
+                               free_queue=free_queue, full_queue=full_queue,
+                               get_weights_version=lambda: 0, get_weights=lambda: {},
+                               on_unroll_complete=lambda actor_index, _: None,
+                               logger=logging.getLogger("test_remote_actor"))
+    connection = MockConnection(unroll_length)
+    session_thread = threading.Thread(target=server._session, args=(connection, 0), daemon=True)
+    session_thread.start()
+    return server, connection, session_thread, buffers
+
+
+class TestRemoteActor(object):
+
+    def test_remote_actors_fill_buffers(self):
+        """
+        Two remote actor processes connect over a Unix socket, receive weights, and fill the learner's buffers.
+        """
+        # Arrange
+        unroll_length = 5
+        num_buffers = 4
+        observation_space = gym.spaces.Box(low=0, high=255, shape=(1, 1, 7, 7), dtype=np.uint8)
+        action_spaces = {0: gym.spaces.Discrete(3)}
+        model_flags = DotMap(use_lstm=False, conv_net_arch="orig", baseline_includes_uncertainty=False,
+                             baseline_extended_arch=False, unroll_length=unroll_length,
+                             remote_actor_compression_level=1, actor_quantization=None,
+                             actor_num_threads=1)
+        task_flags = DotMap(action_space_id=0, task_id=0, env_spec=make_mock_env)
+        model = ImpalaNet(observation_space, action_spaces, model_flags)
+
+        buffer_specs = dict(
+            frame=dict(size=(unroll_length + 1, 1, 1, 7, 7), dtype=torch.uint8),
+            reward=dict(size=(unroll_length + 1,), dtype=torch.float32),
+            done=dict(size=(unroll_length + 1,), dtype=torch.bool),
+            episode_return=dict(size=(unroll_length + 1,), dtype=torch.float32),
+            episode_step=dict(size=(unroll_length + 1,), dtype=torch.int32),
+            policy_logits=dict(size=(unroll_length + 1, 3), dtype=torch.float32),
+            baseline=dict(size=(unroll_length + 1,), dtype=torch.float32),
+            last_action=dict(size=(unroll_length + 1,), dtype=torch.int64),
+            action=dict(size=(unroll_length + 1,), dtype=torch.int64),
+        )
+        buffers = {key: [torch.zeros(**spec) for _ in range(num_buffers)] for key, spec in buffer_specs.items()}
+        setup_payload = dict(model_flags=model_flags, task_flags=task_flags, observation_space=observation_space,
+                             action_spaces=action_spaces, policy_class=ImpalaNet, buffer_specs=buffer_specs)
+
+        free_queue = queue.Queue()
+        full_queue = queue.Queue()
+        completed_actor_indices = []
+
+        socket_dir = tempfile.mkdtemp()
+        address = f"unix:{os.path.join(socket_dir, 'actors.sock')}"
+        authkey = b"test_key"
+
+        server = RemoteActorServer(address, authkey, actor_indices=[2, 3], setup_payload=setup_payload,
+                                   buffers=buffers, initial_agent_state_buffers=[() for _ in range(num_buffers)],
+                                   free_queue=free_queue, full_queue=full_queue,
+                                   get_weights_version=lambda: 0, get_weights=lambda: model.state_dict(),
+                                   on_unroll_complete=lambda actor_index, _: completed_actor_indices.append(actor_index),
+                                   logger=logging.getLogger("test_remote_actor"))
+        server.start()
+
+        ctx = mp.get_context("fork")
+        remote_actors = [ctx.Process(target=run_remote_actor, args=(address, authkey, False)) for _ in range(2)]
+
+        # Act
+        for remote_actor in remote_actors:
+            remote_actor.start()
+
+        for index in range(num_buffers):
+            free_queue.put(index)
+
+        filled_indices = sorted([full_queue.get(timeout=60) for _ in range(num_buffers)])
+
+        server.stop()
+
+        for remote_actor in remote_actors:
+            remote_actor.join(30)
+
+        # Assert
+        assert filled_indices == list(range(num_buffers))
+        assert set(completed_actor_indices).issubset({2, 3})
+        for index in range(num_buffers):
+            assert (buffers["frame"][index][1:] == 255).all(), "Frames were not written by the remote actor"
+            assert (buffers["reward"][index][1:] == 1.0).all()
+        for remote_actor in remote_actors:
+            assert remote_actor.exitcode == 0
+
+    def test_pause_waits_for_sessions(self):
+        """
+        A session waiting on the free_queue doesn't take an index while paused, and pause() waits for an unroll that
+        is in flight.
+        """
+        # Arrange
+        free_queue = queue.Queue()
+        full_queue = queue.Queue()
+        server, connection, session_thread, buffers = create_server_session(free_queue, full_queue)
+
+        # Act
+        server.pause()
+        free_queue.put(0)
+        session_thread.join(0.5)
+        index_while_paused = free_queue.get(block=False)
+
+        server.resume()
+        free_queue.put(1)
+        connection.unroll_requested.wait(10)
+        pause_thread = threading.Thread(target=server.pause)
+        pause_thread.start()
+        pause_thread.join(0.5)
+        pause_waited = pause_thread.is_alive()
+        connection.unroll_released.set()
+        pause_thread.join(10)
+
+        # Assert
+        assert index_while_paused == 0
+        assert pause_waited
+        assert not pause_thread.is_alive()
+        assert full_queue.get(block=False) == 1
+        assert (buffers["reward"][1] == 1).all()
+        assert (buffers["reward"][0] == 0).all()
+
+    def test_disconnect_returns_index(self):
+        # Arrange
+        free_queue = queue.Queue()
+        full_queue = queue.Queue()
+        server, connection, session_thread, _ = create_server_session(free_queue, full_queue)
+
+        # Act
+        free_queue.put(1)
+        connection.unroll_requested.wait(10)
+        connection.disconnect = True
+        connection.unroll_released.set()
+        session_thread.join(10)
+
+        # Assert
+        assert not session_thread.is_alive()
+        assert free_queue.get(block=False) == 1
+        assert full_queue.empty()
+        assert server._num_active_sessions == 0
+
+    def test_stop_while_waiting_for_index(self):
+        """
+        A None left on the free_queue for a forked actor doesn't stop (or strand) a session: stop() does, even while
+        the session is waiting for an index.
+        """
+        # Arrange
+        free_queue = queue.Queue()
+        full_queue = queue.Queue()
+        server, connection, session_thread, _ = create_server_session(free_queue, full_queue)
+        free_queue.put(None)
+        session_thread.join(0.3)
+
+        # Act
+        server.stop()
+        session_thread.join(5)
+
+        # Assert
+        assert not session_thread.is_alive()
+        assert unpack_message(connection.sent_messages[-1]) == {"type": "stop"}
+        assert free_queue.get(block=False) is None
@@ -0,0 +1,76 @@
+import threading
+import numpy as np
+import torch
+import gym
+from dotmap import DotMap
+from continual_rl.policies.ewc.ewc_monobeast import EWCMonobeast
+from continual_rl.policies.progress_and_compress.progress_and_compress_policy import ProgressAndCompressNet
+
+
+class TestProgressAndCompressConsolidation(object):
+
+    def test_async_consolidation_snapshot_is_detached_from_knowledge_base(self):
+        """
+        With async_ewc_consolidation, the knowledge base is consolidated on a background thread while the learner
+        keeps running it. The snapshot being consolidated must not record into the live knowledge base (via its
+        hooks), nor see later updates to its weights.
+        """
+        # Arrange
+        torch.manual_seed(0)
+        observation_space = gym.spaces.Box(low=0, high=255, shape=(1, 3, 7, 7), dtype=np.uint8)
+        action_spaces = {0: gym.spaces.Discrete(4)}
+        model_flags = DotMap(use_lstm=False, conv_net_arch="orig", baseline_includes_uncertainty=False,
+                             baseline_extended_arch=False, online_ewc=False)
+        model = ProgressAndCompressNet(observation_space, action_spaces, model_flags)
+        knowledge_base = model.knowledge_base
+        boundary_weights = {name: param.detach().clone() for name, param in knowledge_base.named_parameters()}
+        inputs = {"frame": torch.randint(0, 255, (2, 3, 1, 3, 7, 7), dtype=torch.uint8),
+                  "reward": torch.randn((2, 3)),
+                  "done": torch.zeros((2, 3), dtype=torch.bool),
+                  "last_action": torch.randint(0, 4, (2, 3), dtype=torch.int64)}
+
+        consolidation_started = threading.Event()
+        learner_updated = threading.Event()
+        consolidated = {}
+
+        def checkpoint_task(task_id, task_flags, snapshot_model, online=False):
+            consolidation_started.set()
+            learner_updated.wait(10)
+
+            # The learner is mid-way through a forward_with_knowledge_base, recording the KB's inputs
+            knowledge_base._record_layerwise_inputs = True
+            try:
+                snapshot_model(inputs, 0)
+                consolidated["recorded_into_live_knowledge_base"] = len(knowledge_base.latest_layerwise_inputs) > 0
+            finally:
+                knowledge_base._record_layerwise_inputs = False
+
+            consolidated["weights"] = {name: param.detach().clone()
+                                       for name, param in snapshot_model.named_parameters()}
+
+        monobeast = EWCMonobeast.__new__(EWCMonobeast)
+        monobeast._model_flags = model_flags
+        monobeast._observation_space = observation_space
+        monobeast._action_spaces = action_spaces
+        monobeast._consolidation_thread = None
+        monobeast._consolidation_exception = None
+        monobeast._consolidation_stats_lock = threading.Lock()
+        monobeast._consolidation_stats = EWCMonobeast._create_empty_consolidation_stats()
+        monobeast._tasks = {0: DotMap(replay_frozen=torch.zeros(1))}
+        monobeast.checkpoint_task = checkpoint_task
+
+        # Act
+        monobeast._start_consolidation(0, DotMap(action_space_id=0), knowledge_base)
+        consolidation_started.wait(10)
+        with torch.no_grad():
+            for param in knowledge_base.parameters():
+                param.add_(1.0)
+        learner_updated.set()
+        monobeast._wait_for_consolidation()
+
+        # Assert
+        assert monobeast._consolidation_exception is None
+        assert not consolidated["recorded_into_live_knowledge_base"]
+        for name, weights in consolidated["weights"].items():
+            assert torch.equal(weights, boundary_weights[name])
+        assert monobeast._tasks[0].replay_frozen[0] == 0
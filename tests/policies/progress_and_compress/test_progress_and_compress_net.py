@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+import torch
+import gym
+from dotmap import DotMap
+from continual_rl.policies.impala.actor_quantization import create_quantized_actor_model
+from continual_rl.policies.progress_and_compress.progress_and_compress_policy import ProgressAndCompressNet, \
+    FusedProgressAndCompressNet
+
+
+class TestProgressAndCompressNet(object):
+
+    def _create_model(self, model_class=ProgressAndCompressNet, observation_shape=(1, 3, 7, 7), conv_net_arch="orig",
+                      baseline_extended_arch=False):
+        observation_space = gym.spaces.Box(low=0, high=255, shape=observation_shape, dtype=np.uint8)
+        action_spaces = {0: gym.spaces.Discrete(4)}
+        model_flags = DotMap(use_lstm=False, conv_net_arch=conv_net_arch, baseline_includes_uncertainty=False,
+                             baseline_extended_arch=baseline_extended_arch)
+        return model_class(observation_space, action_spaces, model_flags)
+
+    def _create_fused_copy(self, model, **model_kwargs):
+        """
+        A FusedProgressAndCompressNet with the same weights as the hook-based model
+        """
+        fused_model = self._create_model(FusedProgressAndCompressNet, **model_kwargs)
+        fused_model.knowledge_base.load_state_dict(model.knowledge_base.state_dict())
+
+        column_params = dict(model._active_column.named_parameters())
+        with torch.no_grad():
+            for name, param in fused_model._active_column.named_parameters():
+                param.copy_(column_params[name])
+
+            adaptor_params = list(model._active_column._adaptor_params)
+            fused_adaptor_params = list(fused_model._adaptors.parameters())
+            assert len(adaptor_params) == len(fused_adaptor_params)
+            for adaptor_param, fused_adaptor_param in zip(adaptor_params, fused_adaptor_params):
+                fused_adaptor_param.copy_(adaptor_param)
+
+        return fused_model
+
+    def _create_inputs(self, time_steps, batch_size, observation_shape=(1, 3, 7, 7)):
+        return {"frame": torch.randint(0, 255, (time_steps, batch_size, *observation_shape), dtype=torch.uint8),
+                "reward": torch.randn((time_steps, batch_size)),
+                "done": torch.zeros((time_steps, batch_size), dtype=torch.bool),
+                "last_action": torch.randint(0, 4, (time_steps, batch_size), dtype=torch.int64)}
+
+    def test_forward_with_knowledge_base_matches_separate_forwards(self):
+        # Arrange
+        torch.manual_seed(0)
+        model = self._create_model()
+        inputs = self._create_inputs(time_steps=5, batch_size=3)
+
+        # Act
+        knowledge_base_output, column_output = model.forward_with_knowledge_base(inputs, 0)
+        num_inputs_kept = len(model.knowledge_base.latest_layerwise_inputs)
+        with torch.no_grad():
+            expected_column_output, _ = model(inputs, 0)
+        expected_knowledge_base_output, _ = model.knowledge_base(inputs, 0)
+
+        # Assert
+        knowledge_base_output, column_output = knowledge_base_output[0], column_output[0]
+        assert torch.allclose(column_output["policy_logits"], expected_column_output["policy_logits"])
+        assert torch.allclose(column_output["baseline"], expected_column_output["baseline"])
+        assert torch.allclose(knowledge_base_output["policy_logits"], expected_knowledge_base_output["policy_logits"])
+        assert knowledge_base_output["policy_logits"].requires_grad
+        assert not column_output["policy_logits"].requires_grad
+        assert num_inputs_kept == 0
+
+    @pytest.mark.parametrize("model_kwargs", [
+        dict(observation_shape=(1, 3, 7, 7)),
+        dict(observation_shape=(1, 3, 7, 7), baseline_extended_arch=True),
+        dict(observation_shape=(4, 1, 64, 64), conv_net_arch="orig"),  # Shares one ReLU between layers
+        dict(observation_shape=(4, 1, 64, 64), conv_net_arch="impala_res_cnn"),
+    ])
+    def test_fused_net_matches_hook_net(self, model_kwargs):
+        # Arrange
+        torch.manual_seed(0)
+        model = self._create_model(**model_kwargs)
+        fused_model = self._create_fused_copy(model, **model_kwargs)
+        inputs = self._create_inputs(time_steps=3, batch_size=2, observation_shape=model_kwargs["observation_shape"])
+
+        # Act
+        column_output, _ = model(inputs, 0)
+        fused_column_output, _ = fused_model(inputs, 0)
+        (column_output["policy_logits"].sum() + column_output["baseline"].sum()).backward()
+        (fused_column_output["policy_logits"].sum() + fused_column_output["baseline"].sum()).backward()
+
+        (knowledge_base_output, _), (target_output, _) = model.forward_with_knowledge_base(inputs, 0)
+        (fused_knowledge_base_output, _), (fused_target_output, _) = fused_model.forward_with_knowledge_base(inputs,
+                                                                                                             0)
+
+        # Assert
+        for key in ("policy_logits", "baseline"):
+            assert torch.allclose(fused_column_output[key], column_output[key], atol=1e-5)
+            assert torch.allclose(fused_knowledge_base_output[key], knowledge_base_output[key], atol=1e-5)
+            assert torch.allclose(fused_target_output[key], target_output[key], atol=1e-5)
+
+        # The active column's gradients match, and the KB gets none from the active column's loss
+        column_grads = dict(model._active_column.named_parameters())
+        for name, param in fused_model._active_column.named_parameters():
+            assert torch.allclose(param.grad, column_grads[name].grad, atol=1e-5)
+
+        for adaptor_param, fused_adaptor_param in zip(model._active_column._adaptor_params,
+                                                      fused_model._adaptors.parameters()):
+            assert torch.allclose(fused_adaptor_param.grad, adaptor_param.grad, atol=1e-5)
+
+        assert all(param.grad is None for param in fused_model.knowledge_base.parameters())
+        assert fused_knowledge_base_output["policy_logits"].requires_grad
+        assert not fused_target_output["policy_logits"].requires_grad
+
+    def test_fused_net_eval_on_knowledge_base(self):
+        # Arrange
+        torch.manual_seed(0)
+        model = self._create_model()
+        fused_model = self._create_fused_copy(model)
+        for eval_model in (model, fused_model):
+            eval_model.configure_eval(eval_on_kb=True, eval_is_stochastic=False)
+            eval_model.eval()
+        inputs = self._create_inputs(time_steps=3, batch_size=2)
+
+        # Act
+        output, _ = model(inputs, 0)
+        fused_output, _ = fused_model(inputs, 0)
+
+        # Assert
+        assert torch.allclose(fused_output["policy_logits"], output["policy_logits"], atol=1e-5)
+        assert torch.equal(fused_output["action"], output["action"])
+        assert not fused_model.knowledge_base.training
+
+    def test_fused_net_dynamic_quantization(self):
+        # Arrange
+        torch.manual_seed(0)
+        fused_model = self._create_model(FusedProgressAndCompressNet)
+        fused_model.eval()
+        inputs = self._create_inputs(time_steps=3, batch_size=2)
+
+        # Act
+        quantized_model = create_quantized_actor_model(fused_model, "dynamic")
+        with torch.no_grad():
+            output, _ = fused_model(inputs, 0)
+            quantized_output, _ = quantized_model(inputs, 0)
+
+        # Assert
+        assert isinstance(quantized_model.knowledge_base.policy, torch.nn.quantized.dynamic.Linear)
+        assert quantized_output["policy_logits"].shape == output["policy_logits"].shape
+        assert torch.allclose(quantized_output["policy_logits"], output["policy_logits"], atol=0.1)
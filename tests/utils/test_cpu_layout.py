@@ -0,0 +1,35 @@
+from continual_rl.utils import cpu_layout
+
+
+class TestCpuLayout(object):
+
+    def test_parse_cpu_list(self):
+        # Arrange
+        cpu_list = "0-3,8,10-11\n"
+
+        # Act
+        cpus = cpu_layout.parse_cpu_list(cpu_list)
+
+        # Assert
+        assert cpus == [0, 1, 2, 3, 8, 10, 11]
+
+    def test_actor_cpus_round_robin(self):
+        # Arrange
+        actor_cpus = [4, 5, 6, 7, 8]
+
+        # Act
+        single_threaded = [cpu_layout.get_actor_cpus(actor_cpus, actor_index, 1) for actor_index in range(6)]
+        two_threaded = [cpu_layout.get_actor_cpus(actor_cpus, actor_index, 2) for actor_index in range(3)]
+
+        # Assert
+        assert single_threaded == [[4], [5], [6], [7], [8], [4]]
+        assert two_threaded == [[4, 5], [6, 7], [8, 4]]
+
+    def test_explicit_cpus_take_precedence(self):
+        # Act
+        cpus = cpu_layout.resolve_cpus([2, 3], numa_node=0)
+        unpinned = cpu_layout.resolve_cpus([], numa_node=None)
+
+        # Assert
+        assert cpus == [2, 3]
+        assert unpinned is None
@@ -0,0 +1,106 @@
+import cloudpickle
+import gym
+import numpy as np
+import torch
+from torch import multiprocessing as mp
+from continual_rl.experiments.environment_runners.environment_runner_batch import EnvironmentRunnerBatch
+from continual_rl.utils import env_fork_server
+from continual_rl.utils.env_fork_server import EnvForkServer
+from tests.common_mocks.mock_preprocessor import MockPreprocessor
+
+
+class MockEnv(gym.Env):
+    def __init__(self):
+        self.observation_space = gym.spaces.Box(low=0, high=1, shape=(1,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+        self.num_resets = 0
+
+    def reset(self):
+        self.num_resets += 1
+        return np.zeros((1,), dtype=np.float32)
+
+    def step(self, action):
+        return np.zeros((1,), dtype=np.float32), 0.0, False, {}
+
+    def seed(self, seed=None):
+        pass
+
+
+def make_mock_env():
+    return MockEnv()
+
+
+class ResetCountingEnv(MockEnv):
+    def reset(self):
+        super().reset()
+        return np.array([self.num_resets], dtype=np.float32)
+
+
+def make_reset_counting_env():
+    return ResetCountingEnv()
+
+
+def fill_from_worker(connection, shared_tensor, pickled_env_spec):
+    env_spec = cloudpickle.loads(pickled_env_spec)
+    env, _ = env_fork_server.make_env(env_spec, template_key="mock_task", create_seed=True)
+    shared_tensor.fill_(3)
+    connection.send(env.num_resets)
+
+
+class TestEnvForkServer(object):
+
+    def test_worker_receives_shared_state_and_template(self):
+        """
+        A worker forked by the server writes into a shared tensor, and takes the template env (which was reset once
+        while being built) rather than constructing a new one (which would have been reset zero times).
+        """
+        # Arrange
+        server = EnvForkServer(preload_modules=["gym"])
+        server.start()
+        server.set_template_env(make_mock_env, "mock_task")
+        shared_tensor = torch.zeros(4).share_memory_()
+        local_connection, remote_connection = mp.Pipe()
+
+        # Act
+        process = server.Process(target=fill_from_worker,
+                                 args=(remote_connection, shared_tensor, cloudpickle.dumps(make_mock_env)))
+        process.start()
+        remote_connection.close()
+        num_resets = local_connection.recv()
+        process.join(30)
+        server.stop()
+
+        # Assert
+        assert num_resets == 1
+        assert (shared_tensor == 3).all()
+        assert process.exitcode == 0
+
+    def test_template_not_taken_by_creator(self):
+        # Arrange
+        env_fork_server.set_template_env(make_mock_env, "mock_task")
+
+        # Act
+        env, _ = env_fork_server.make_env(make_mock_env, template_key="mock_task")
+        env_fork_server.clear_template_env()
+
+        # Assert
+        assert env.num_resets == 0
+
+    def test_batch_runner_workers_take_server_template(self):
+        """
+        The runner's first env is its own, but the workers are forked from the server, and each takes its copy of the
+        template (reset once while being built), so their first reset is their second.
+        """
+        # Arrange
+        server = EnvForkServer(preload_modules=["gym"])
+        server.start()
+        runner = EnvironmentRunnerBatch(policy=None, num_parallel_envs=3, timesteps_per_collection=10,
+                                        fork_server=server, warm_env_template=True)
+
+        # Act
+        observations = runner._initialize_envs(make_reset_counting_env, MockPreprocessor(), task_id=0)
+        runner.cleanup(task_spec=None)
+        server.stop()
+
+        # Assert
+        assert observations.flatten().tolist() == [1, 2, 2]
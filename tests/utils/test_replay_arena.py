@@ -0,0 +1,42 @@
+import os
+import pytest
+import torch
+from continual_rl.utils.replay_arena import ReplayArena, ReplayArenaException, REGION_ALIGNMENT
+
+
+class TestReplayArena(object):
+
+    def test_create_and_reload(self, tmpdir):
+        # Arrange
+        arena_path = os.path.join(tmpdir, "arena.fbt")
+        specs = {"frame": dict(size=(2, 3, 5), dtype=torch.uint8),
+                 "reservoir_val": dict(size=(2, 3, 1), dtype=torch.float32),
+                 "done": dict(size=(2, 3, 4), dtype=torch.bool)}
+        arena = ReplayArena(arena_path, specs, access_hint="random")
+
+        # Act
+        initial_reservoir_vals = arena.tensors["reservoir_val"].clone()
+        arena.tensors["frame"][1, 2] = 7
+        arena.tensors["reservoir_val"][0, 1] = 0.5
+        arena.tensors["done"][1, 0, 3] = True
+        del arena
+
+        reloaded_arena = ReplayArena(arena_path, specs)
+
+        # Assert
+        assert (initial_reservoir_vals == 0).all()
+        assert not reloaded_arena.created
+        assert reloaded_arena.tensors["frame"][1, 2].tolist() == [7] * 5
+        assert reloaded_arena.tensors["frame"].sum() == 7 * 5
+        assert reloaded_arena.tensors["reservoir_val"][0, 1].item() == 0.5
+        assert reloaded_arena.tensors["done"].sum() == 1
+        assert all(region["offset"] % REGION_ALIGNMENT == 0 for region in reloaded_arena.layout["regions"].values())
+
+    def test_mismatched_layout_raises(self, tmpdir):
+        # Arrange
+        arena_path = os.path.join(tmpdir, "arena.fbt")
+        ReplayArena(arena_path, {"frame": dict(size=(2, 3, 5), dtype=torch.uint8)})
+
+        # Act, Assert
+        with pytest.raises(ReplayArenaException):
+            ReplayArena(arena_path, {"frame": dict(size=(4, 3, 5), dtype=torch.uint8)})